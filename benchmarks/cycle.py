@@ -0,0 +1,207 @@
+""" runs polling cycles against fake servers, started by benchmarks.run """
+from clients import SlackClient, GitHubClient, AsyncSlackClient, AsyncGitHubClient
+from clients import LocalCacheClient, SlackHistoryCursor
+from clients.slack import SlackThreadIndex, SLACK_METHOD_TIERS
+from processors import MessageApproved, MessageMerged
+from processors import PullRequestStateService, PullRequestPollingSchedule
+from processors import AsyncPullRequestStateService, ReactionWriter
+from prometheus_client import REGISTRY
+from utils import get_arguments, get_channels, FairQueue, TokenBucket
+from main import run_threaded, run_asyncio, AsyncPipeline
+import argparse
+import asyncio
+import json
+import logging
+import os
+import requests
+import resource
+import sys
+import time
+
+METRICS = {"slack_calls": "pr_vigilante_slack_api_calls_total",
+           "github_calls": "pr_vigilante_github_api_calls_total",
+           "github_conditional": "pr_vigilante_github_conditional_requests_total",
+           "cache_lookups": "pr_vigilante_cache_lookups_total",
+           "throttled_seconds": "pr_vigilante_throttled_seconds_total"}
+
+
+def get_counters():
+    counters = {key: {} for key in METRICS}
+    names = {name: key for key, name in METRICS.items()}
+    for metric in REGISTRY.collect():
+        for sample in metric.samples:
+            key = names.get(sample.name)
+            if key:
+                label = " ".join(sample.labels.values())
+                counters[key][label] = sample.value
+    return counters
+
+
+def get_delta(before: dict, after: dict):
+    return {key: {label: round(value - before[key].get(label, 0), 3)
+                  for label, value in values.items()
+                  if value != before[key].get(label, 0)}
+            for key, values in after.items()}
+
+
+def get_disk_io():
+    # block layer i/o of this process, linux only
+    try:
+        with open("/proc/self/io") as io_file:
+            stats = dict(line.split(": ") for line in io_file.read().splitlines())
+        return {key: int(stats[key]) for key in ("read_bytes", "write_bytes")}
+    except (OSError, KeyError):
+        return {}
+
+
+def get_cache_size(dir_path: str):
+    files, size = 0, 0
+    for root, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            files += 1
+            size += os.path.getsize(os.path.join(root, file_name))
+    return {"files": files, "bytes": size}
+
+
+def run(bench_args, args):
+    slack_client = SlackClient(args.slack_api_token, base_url=args.slack_api_url)
+    # client pacing follows the fake server limits instead of real tiers
+    per_minute = bench_args.slack_rate_limit or 10 ** 6
+    for method in SLACK_METHOD_TIERS:
+        slack_client.rate_limits[method] = TokenBucket(rate=per_minute / 60,
+                                                       capacity=max(1, per_minute // 10))
+    github_client = GitHubClient(args.github_api_token,
+                                 api_host=args.github_api_url,
+                                 quota_reserve=args.github_quota_reserve,
+                                 pool_size=max(10, args.approval_workers + args.merge_workers))
+    local_client = LocalCacheClient(args.cache_folder_path,
+                                    args.cache_backend,
+                                    args.cache_memory_max_entries,
+                                    args.cache_memory_max_bytes,
+                                    args.cache_memory_ttl_seconds)
+
+    channel_weights = get_channels(args.slack_channel_id)
+    channels = {}
+    for channel in channel_weights:
+        history_cursor = None
+        if args.slack_incremental_sync:
+            history_cursor = SlackHistoryCursor(local_client,
+                                                channel,
+                                                args.slack_full_sync_minutes)
+        thread_index = None
+        if not args.slack_disable_thread_index:
+            thread_index = SlackThreadIndex()
+        channels[channel] = (history_cursor, thread_index)
+    polling_schedule = None
+    if args.adaptive_polling:
+        polling_schedule = PullRequestPollingSchedule(
+            args.sleep_period_minutes * 60,
+            args.adaptive_polling_max_minutes * 60)
+    if args.engine == "asyncio":
+        async_github_client = AsyncGitHubClient(args.github_api_token,
+                                                api_host=args.github_api_url,
+                                                quota_reserve=args.github_quota_reserve,
+                                                max_concurrency=args.async_concurrency,
+                                                budgets=github_client.budgets)
+        state_service = AsyncPullRequestStateService(github_client, local_client,
+                                                     polling_schedule,
+                                                     args.github_reviews_last_page_first,
+                                                     async_github_client,
+                                                     args.closed_recheck_minutes * 60)
+        async_slack_client = AsyncSlackClient(args.slack_api_token,
+                                              base_url=args.slack_api_url,
+                                              max_concurrency=args.slack_reply_workers,
+                                              rate_limits=slack_client.rate_limits)
+        reaction_writer = ReactionWriter(slack_client, state_service, args.dry_run)
+        pipeline = AsyncPipeline(async_slack_client, async_github_client, args, channels,
+                                 state_service, channel_weights, reaction_writer=reaction_writer)
+        loop = asyncio.new_event_loop()
+    else:
+        state_service = PullRequestStateService(github_client, local_client, polling_schedule,
+                                                args.github_reviews_last_page_first,
+                                                args.closed_recheck_minutes * 60)
+        reaction_writer = ReactionWriter(slack_client, state_service, args.dry_run)
+    reaction_writer.start()
+
+    queue_req_approval = FairQueue(key=lambda message: message["channel"],
+                                   weights=channel_weights)
+    queue_req_merging = FairQueue(key=lambda message: message["channel"],
+                                  weights=channel_weights)
+    processors = [MessageApproved(slack_client, github_client, local_client, args,
+                                  queue_req_approval, state_service, reaction_writer)
+                  for _ in range(args.approval_workers)]
+    processors.extend(MessageMerged(slack_client, github_client, local_client, args,
+                                    queue_req_merging, state_service, reaction_writer)
+                      for _ in range(args.merge_workers))
+    for processor in processors:
+        processor.start()
+
+    cycles = []
+    for cycle in range(bench_args.cycles):
+        if cycle and bench_args.churn:
+            requests.get(f"{bench_args.github_url}/_bench/churn",
+                         params={"ratio": bench_args.churn, "seed": cycle})
+        counters = get_counters()
+        disk_io = get_disk_io()
+        time_start = time.perf_counter()
+        if args.engine == "asyncio":
+            messages_scanned = run_asyncio(loop, pipeline)
+        else:
+            messages_scanned = run_threaded(slack_client, args,
+                                            queue_req_approval, queue_req_merging,
+                                            channels, state_service)
+        # reactions are paced outside the cycle, waiting keeps call counts per cycle
+        reaction_writer.join_queue()
+        seconds = time.perf_counter() - time_start
+
+        result = {"cycle": cycle + 1,
+                  "seconds": round(seconds, 3),
+                  "messages_scanned": messages_scanned}
+        result.update(get_delta(counters, get_counters()))
+        result["disk_io"] = {key: value - disk_io[key]
+                             for key, value in get_disk_io().items()}
+        cycles.append(result)
+        logging.warning(f"cycle {cycle + 1} took {seconds:.2f}s")
+
+    for _ in range(args.approval_workers):
+        queue_req_approval.put(None)
+    for _ in range(args.merge_workers):
+        queue_req_merging.put(None)
+    reaction_writer.worker_queue.put(None)
+    if args.engine == "asyncio":
+        loop.run_until_complete(async_slack_client.close())
+        loop.run_until_complete(async_github_client.close())
+    return {"cycles": cycles,
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "cache": get_cache_size(args.cache_folder_path)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--slack-url", required=True)
+    parser.add_argument("--github-url", required=True)
+    parser.add_argument("--channel", nargs="+", required=True)
+    parser.add_argument("--window-minutes", type=int, default=1440)
+    parser.add_argument("--cycles", type=int, default=2)
+    parser.add_argument("--churn", type=float, default=0.0)
+    parser.add_argument("--slack-rate-limit", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    bench_args, app_args = parser.parse_known_args()
+
+    logging.basicConfig(level=bench_args.log_level, stream=sys.stderr,
+                        format="%(asctime)s - %(threadName)s - %(levelname)s %(message)s")
+    # application arguments are parsed the same way as in main.py
+    sys.argv = [sys.argv[0],
+                "--slack_api_token", "xoxb-benchmark",
+                "--slack_api_url", bench_args.slack_url,
+                "--slack_channel_id", *bench_args.channel,
+                "--slack_time_window_minutes", str(bench_args.window_minutes),
+                "--github_api_token", "benchmark",
+                "--github_api_url", bench_args.github_url,
+                "--sleep_period_minutes", "1",
+                *app_args]
+    json.dump(run(bench_args, get_arguments()), sys.stdout)
+
+
+if __name__ == '__main__':
+    main()
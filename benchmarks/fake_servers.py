@@ -0,0 +1,430 @@
+from aiohttp import web, WSMsgType
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter, defaultdict
+from email.utils import formatdate, parsedate_to_datetime
+from threading import Event, Lock, Thread
+from urllib import parse
+import asyncio
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+import uuid
+
+
+class RateLimiter:
+    """ Fake server rate limiter class """
+
+    def __init__(self, per_minute: int):
+        self.rate = per_minute / 60
+        self.capacity = max(1, per_minute // 10)
+        self.buckets = {}
+        self.lock = Lock()
+
+    def acquire(self, key: str):
+        # returns seconds to wait when the request is over the limit
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            tokens, updated_at = self.buckets.get(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                return (1 - tokens) / self.rate
+            self.buckets[key] = (tokens - 1, now)
+            return 0
+
+
+class FakeServer:
+    """ Fake API server base class """
+
+    def __init__(self, latency_ms: int = 0, host: str = "127.0.0.1"):
+        self.latency = latency_ms / 1000
+        self.calls = Counter()
+        self.lock = Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                server.handle(self, "GET")
+
+            def do_POST(self):
+                server.handle(self, "POST")
+
+        class Server(ThreadingHTTPServer):
+            # the asyncio engine opens up to --async_concurrency connections at once,
+            # a short listen backlog drops them and stalls clients on SYN retries
+            request_queue_size = 1024
+
+        self.httpd = Server((host, 0), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True,
+                             name=self.__class__.__name__)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        logging.info(f"{self.__class__.__name__} listening on {self.url}")
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def count(self, method: str, status: int):
+        with self.lock:
+            self.calls[f"{method} {status}"] += 1
+
+    def handle(self, request, verb: str):
+        url = parse.urlparse(request.path)
+        params = {key: values[-1] for key, values in parse.parse_qs(url.query).items()}
+        body = request.rfile.read(int(request.headers.get("Content-Length") or 0))
+        if body:
+            if "json" in (request.headers.get("Content-Type") or ""):
+                params.update(json.loads(body))
+            else:
+                params.update({key: values[-1] for key, values
+                               in parse.parse_qs(body.decode()).items()})
+        if self.latency:
+            time.sleep(self.latency)
+        status, headers, payload = self.route(verb, url.path, params, request.headers)
+        data = json.dumps(payload).encode() if payload is not None else b""
+        request.send_response(status)
+        for key, value in headers.items():
+            request.send_header(key, value)
+        if data:
+            request.send_header("Content-Type", "application/json; charset=utf-8")
+        request.send_header("Content-Length", str(len(data)))
+        request.end_headers()
+        request.wfile.write(data)
+
+    def route(self, verb: str, path: str, params: dict, headers):
+        raise NotImplementedError
+
+
+class FakeSlackServer(FakeServer):
+    """ Fake Slack Web API server class """
+
+    def __init__(self, channels: dict, latency_ms: int = 0, rate_limit: int = 0,
+                 page_size: int = 100, host: str = "127.0.0.1", socket_url: str = None):
+        super().__init__(latency_ms, host)
+        # handed out by apps.connections.open, see FakeSocketModeServer
+        self.socket_url = socket_url
+        # channel id -> messages (newest first), replies are kept by thread ts
+        self.channels = {}
+        self.replies = {}
+        for channel, messages in channels.items():
+            self.channels[channel] = [message for message in messages
+                                      if message.get("thread_ts", message["ts"]) == message["ts"]]
+            for message in messages:
+                if "thread_ts" in message:
+                    self.replies.setdefault((channel, message["thread_ts"]), []).append(message)
+            self.channels[channel].sort(key=lambda item: float(item["ts"]), reverse=True)
+        self.messages = {(channel, message["ts"]): message
+                         for channel, messages in channels.items() for message in messages}
+        self.limiter = RateLimiter(rate_limit)
+        self.page_size = page_size
+
+    @property
+    def url(self):
+        return f"{super().url}/api/"
+
+    def route(self, verb, path, params, headers):
+        method = path.rsplit("/", 1)[-1]
+        time_wait = self.limiter.acquire(method)
+        if time_wait:
+            self.count(method, 429)
+            return 429, {"Retry-After": str(max(1, round(time_wait)))}, \
+                {"ok": False, "error": "ratelimited"}
+
+        handler = {"apps.connections.open": self.open_connection,
+                   "conversations.history": self.get_history,
+                   "conversations.replies": self.get_replies,
+                   "reactions.add": self.add_reaction}.get(method)
+        if handler is None:
+            self.count(method, 404)
+            return 404, {}, {"ok": False, "error": "unknown_method"}
+        payload = handler(params)
+        self.count(method, 200)
+        return 200, {}, payload
+
+    def open_connection(self, params):
+        if not self.socket_url:
+            return {"ok": False, "error": "not_allowed_token_type"}
+        return {"ok": True, "url": self.socket_url}
+
+    def get_limit(self, params):
+        return min(int(params.get("limit") or self.page_size), self.page_size)
+
+    def get_history(self, params):
+        messages = self.channels.get(params.get("channel"))
+        if messages is None:
+            return {"ok": False, "error": "channel_not_found"}
+        oldest = float(params.get("oldest") or 0)
+        latest = float(params.get("latest") or time.time())
+        inclusive = str(params.get("inclusive")).lower() in ("1", "true")
+        if inclusive:
+            window = [message for message in messages
+                      if oldest <= float(message["ts"]) <= latest]
+        else:
+            window = [message for message in messages
+                      if oldest < float(message["ts"]) < latest]
+        limit = self.get_limit(params)
+        return {"ok": True, "messages": window[:limit], "has_more": len(window) > limit}
+
+    def get_replies(self, params):
+        channel = params.get("channel")
+        message = self.messages.get((channel, params.get("ts")))
+        if message is None:
+            return {"ok": False, "error": "thread_not_found"}
+        thread = self.replies.get((channel, message["ts"]), [message])
+        offset = int(params.get("cursor") or 0)
+        limit = self.get_limit(params)
+        page = thread[offset:offset + limit]
+        has_more = offset + limit < len(thread)
+        return {"ok": True, "messages": page, "has_more": has_more,
+                "response_metadata": {"next_cursor": str(offset + limit) if has_more else ""}}
+
+    def add_reaction(self, params):
+        message = self.messages.get((params.get("channel"), params.get("timestamp")))
+        if message is None:
+            return {"ok": False, "error": "message_not_found"}
+        with self.lock:
+            reactions = message.setdefault("reactions", [])
+            if any(reaction["name"] == params.get("name") for reaction in reactions):
+                return {"ok": False, "error": "already_reacted"}
+            reactions.append({"name": params.get("name"), "users": ["UBENCH"], "count": 1})
+        return {"ok": True}
+
+
+class FakeSocketModeServer:
+    """ Fake Slack Socket Mode server class """
+
+    def __init__(self, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = None
+        self.sockets = []
+        # envelope id -> set once a client acknowledges it
+        self.acks = defaultdict(Event)
+        self.connected = Event()
+        self.runner = None
+
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.loop.run_forever, daemon=True,
+                             name=self.__class__.__name__)
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/link"
+
+    def start(self):
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self.listen(), self.loop).result(5)
+        logging.info(f"{self.__class__.__name__} listening on {self.url}")
+        return self
+
+    def stop(self):
+        asyncio.run_coroutine_threadsafe(self.runner.cleanup(), self.loop).result(5)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def listen(self):
+        app = web.Application()
+        app.router.add_get("/link", self.handle)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, 0).start()
+        self.port = self.runner.addresses[0][1]
+
+    async def handle(self, request):
+        socket = web.WebSocketResponse()
+        await socket.prepare(request)
+        await socket.send_json({"type": "hello", "num_connections": 1,
+                                "connection_info": {"app_id": "ABENCHMARK"}})
+        self.sockets.append(socket)
+        self.connected.set()
+        async for message in socket:
+            if message.type == WSMsgType.TEXT:
+                envelope_id = json.loads(message.data).get("envelope_id")
+                if envelope_id:
+                    self.acks[envelope_id].set()
+        self.sockets.remove(socket)
+        return socket
+
+    def send_event(self, event: dict):
+        # returns the envelope id, events go to every connected client
+        envelope = {"envelope_id": str(uuid.uuid4()),
+                    "type": "events_api",
+                    "accepts_response_payload": False,
+                    "payload": {"type": "event_callback", "event": event}}
+
+        async def send():
+            for socket in self.sockets:
+                await socket.send_json(envelope)
+
+        asyncio.run_coroutine_threadsafe(send(), self.loop).result(5)
+        return envelope["envelope_id"]
+
+    def wait_ack(self, envelope_id: str, timeout: float = 5):
+        return self.acks[envelope_id].wait(timeout)
+
+
+class FakeGitHubServer(FakeServer):
+    """ Fake GitHub REST and GraphQL API server class """
+
+    RE_PULL_REQUEST = re.compile(r"^/repos/([^/]+)/([^/]+)/pulls/(\d+)(/reviews)?$")
+
+    def __init__(self, pull_requests: dict, latency_ms: int = 0, quota: int = 5000,
+                 reset_seconds: int = 3600, conditional: bool = True, page_size: int = 100,
+                 host: str = "127.0.0.1"):
+        super().__init__(latency_ms, host)
+        # "owner/repo/number" -> {"merged", "state", "head_sha", "reviews", "updated_at"}
+        self.pull_requests = pull_requests
+        self.quota = quota
+        self.reset_seconds = reset_seconds
+        self.conditional = conditional
+        self.page_size = page_size
+        self.used = {"core": 0, "graphql": 0}
+        self.reset_at = int(time.time()) + reset_seconds
+
+    def get_rate_headers(self, resource):
+        return {"x-ratelimit-limit": str(self.quota),
+                "x-ratelimit-remaining": str(max(0, self.quota - self.used[resource])),
+                "x-ratelimit-used": str(self.used[resource]),
+                "x-ratelimit-reset": str(self.reset_at),
+                "x-ratelimit-resource": resource}
+
+    def use_quota(self, resource):
+        with self.lock:
+            if time.time() >= self.reset_at:
+                self.used = {"core": 0, "graphql": 0}
+                self.reset_at = int(time.time()) + self.reset_seconds
+            if self.used[resource] >= self.quota:
+                return False
+            self.used[resource] += 1
+            return True
+
+    def route(self, verb, path, params, headers):
+        if path == "/_bench/churn":
+            self.count("churn", 200)
+            return 200, {}, {"changed": self.churn(float(params.get("ratio", 0)),
+                                                   int(params.get("seed", 0)))}
+        if path == "/graphql" and verb == "POST":
+            return self.get_graphql(params)
+
+        match = self.RE_PULL_REQUEST.match(path)
+        method = "pulls.reviews" if match and match.group(4) else "pulls"
+        pull_request = self.pull_requests.get("/".join(match.groups()[:3])) if match else None
+        if pull_request is None:
+            self.count(method, 404)
+            return 404, self.get_rate_headers("core"), {"message": "Not Found"}
+
+        if match.group(4):
+            page = max(1, int(params.get("page") or 1))
+            per_page = min(int(params.get("per_page") or 30), self.page_size)
+            reviews = pull_request["reviews"][(page - 1) * per_page:page * per_page]
+            body = reviews
+            last_page = max(1, -(-len(pull_request["reviews"]) // per_page))
+        else:
+            body = {"number": int(match.group(3)), "state": pull_request["state"],
+                    "merged": pull_request["merged"],
+                    "head": {"sha": pull_request["head_sha"]},
+                    "updated_at": pull_request["updated_at"]}
+            page, last_page = 1, 1
+
+        entity_tag = f'W/"{hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()}"'
+        response_headers = {"ETag": entity_tag, "Last-Modified": pull_request["updated_at"]}
+        if page < last_page:
+            link = f"http://{headers.get('Host')}{path}?per_page={per_page}"
+            response_headers["Link"] = f'<{link}&page={page + 1}>; rel="next", ' \
+                                       f'<{link}&page={last_page}>; rel="last"'
+
+        # conditional requests answered with 304 do not count against the quota
+        if self.conditional and self.is_not_modified(headers, entity_tag,
+                                                     pull_request["updated_at"]):
+            self.count(method, 304)
+            return 304, {**response_headers, **self.get_rate_headers("core")}, None
+        if not self.use_quota("core"):
+            self.count(method, 403)
+            return 403, self.get_rate_headers("core"), {"message": "API rate limit exceeded"}
+        self.count(method, 200)
+        return 200, {**response_headers, **self.get_rate_headers("core")}, body
+
+    @staticmethod
+    def is_not_modified(headers, entity_tag: str, last_modified: str):
+        if headers.get("If-None-Match"):
+            return headers["If-None-Match"] == entity_tag
+        if headers.get("If-Modified-Since"):
+            try:
+                return parsedate_to_datetime(headers["If-Modified-Since"]) >= \
+                    parsedate_to_datetime(last_modified)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def get_graphql(self, params):
+        if not self.use_quota("graphql"):
+            self.count("graphql", 403)
+            return 403, self.get_rate_headers("graphql"), {"message": "API rate limit exceeded"}
+        variables = params.get("variables") or {}
+        data = {}
+        index = 0
+        while f"owner{index}" in variables:
+            pull_request = self.pull_requests.get(f"{variables[f'owner{index}']}/"
+                                                  f"{variables[f'name{index}']}/"
+                                                  f"{variables[f'number{index}']}")
+            data[f"pr{index}"] = {"pullRequest": self.get_graphql_state(pull_request)} \
+                if pull_request else None
+            index += 1
+        self.count("graphql", 200)
+        return 200, self.get_rate_headers("graphql"), {"data": data}
+
+    @staticmethod
+    def get_graphql_state(pull_request):
+        latest = {}
+        for review in pull_request["reviews"]:
+            latest[review["user"]["login"]] = review
+        approved = [review for review in latest.values() if review["state"] == "APPROVED"]
+        decision = "APPROVED" if approved and len(approved) == len(latest) else \
+            "REVIEW_REQUIRED"
+        state = "MERGED" if pull_request["merged"] else pull_request["state"].upper()
+        return {"merged": pull_request["merged"], "state": state,
+                "reviewDecision": decision, "headRefOid": pull_request["head_sha"],
+                "latestReviews": {"nodes": [
+                    {"state": review["state"], "author": review["user"],
+                     "commit": {"oid": review["commit_id"]}} for review in latest.values()]}}
+
+    def churn(self, ratio: float, seed: int = 0):
+        # moves a share of open pull requests forward (approved, then merged)
+        rng = random.Random(seed)
+        changed = 0
+        with self.lock:
+            for pull_request in self.pull_requests.values():
+                if pull_request["state"] != "open" or rng.random() >= ratio:
+                    continue
+                if pull_request["reviews"] and \
+                        pull_request["reviews"][-1]["state"] == "APPROVED":
+                    pull_request.update(state="closed", merged=True)
+                else:
+                    pull_request["reviews"].append(
+                        {"id": len(pull_request["reviews"]) + 1, "state": "APPROVED",
+                         "user": {"login": "reviewer"}, "commit_id": pull_request["head_sha"]})
+                # second resolution, a change has to move Last-Modified forward
+                updated_at = max(time.time(), parsedate_to_datetime(
+                    pull_request["updated_at"]).timestamp() + 1)
+                pull_request["updated_at"] = formatdate(updated_at, usegmt=True)
+                changed += 1
+        return changed
@@ -0,0 +1,77 @@
+""" micro-benchmarks pull request link extraction on large synthetic block payloads
+
+usage: python -m benchmarks.parser --elements 10 100 1000 [options]
+"""
+from parsers import MessagePullRequestParser
+import argparse
+import random
+import timeit
+
+
+def generate_message(rng: random.Random, elements: int, depth: int, link_ratio: float):
+    """ returns a message with rich text sections nested depth levels deep """
+    def get_section(count, level):
+        if level == depth:
+            section = []
+            for index in range(count):
+                if rng.random() < link_ratio:
+                    section.append({"type": "link",
+                                    "url": f"https://github.com/owner{rng.randrange(10)}/"
+                                           f"repo{rng.randrange(50)}/pull/{rng.randrange(10000)}"})
+                else:
+                    section.append({"type": "text", "text": f"some text {index} "})
+            return {"type": "rich_text_section", "elements": section}
+        return {"type": "rich_text_list", "style": "bullet",
+                "elements": [get_section(count // 2 + count % 2, level + 1),
+                             get_section(count // 2, level + 1)]}
+
+    blocks = [{"type": "rich_text", "block_id": f"b{rng.getrandbits(32):08x}",
+               "elements": [get_section(elements, 1)]}]
+    links = [element["url"] for element in get_links(blocks)]
+    return {"type": "message", "ts": f"{rng.random() * 10 ** 9:.6f}",
+            "text": " ".join(f"<{link}>" for link in links) or "message",
+            "blocks": blocks,
+            "attachments": [{"fallback": "attachment", "title_link": link}
+                            for link in links[:1]]}
+
+
+def get_links(nodes: list):
+    links = []
+    for node in nodes:
+        if node.get("type") == "link":
+            links.append(node)
+        links.extend(get_links(node.get("elements", [])))
+    return links
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--elements", type=int, nargs="+", default=[10, 100, 1000],
+                        help="leaf elements per message")
+    parser.add_argument("--depth", type=int, default=4, help="nesting levels of sections")
+    parser.add_argument("--link-ratio", type=float, default=0.1)
+    parser.add_argument("--messages", type=int, default=200, help="messages per payload size")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    bench_args = parser.parse_args()
+
+    print(" | ".join(("elements", "messages", "pull requests", "us per message")))
+    for elements in bench_args.elements:
+        rng = random.Random(bench_args.seed)
+        messages = [generate_message(rng, elements, bench_args.depth, bench_args.link_ratio)
+                    for _ in range(bench_args.messages)]
+        pull_requests = sum(len(MessagePullRequestParser(message).pull_requests)
+                            for message in messages)
+        seconds = min(timeit.repeat(lambda: [MessagePullRequestParser(message)
+                                             for message in messages],
+                                    number=1, repeat=bench_args.repeat))
+        print(" | ".join(str(value) for value in (
+            elements,
+            bench_args.messages,
+            pull_requests,
+            round(seconds / bench_args.messages * 10 ** 6, 1))))
+
+
+if __name__ == '__main__':
+    main()
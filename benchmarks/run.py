@@ -0,0 +1,167 @@
+""" benchmarks polling cycles on synthetic channels served by fake Slack and GitHub APIs
+
+usage: python -m benchmarks.run --messages 1000 10000 50000 [options] [-- application args]
+"""
+from .fake_servers import FakeSlackServer, FakeGitHubServer
+from .synthetic import generate_channel
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_revision():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_PATH,
+                            capture_output=True, text=True, check=False)
+    return result.stdout.strip() or None
+
+
+def run_scenario(bench_args, message_count: int, app_args: list):
+    time_start = time.perf_counter()
+    channels, pull_requests = {}, {}
+    for index in range(bench_args.channels):
+        # the same seed space makes channels cross-post some pull requests
+        channel_messages, channel_pull_requests = generate_channel(
+            message_count // bench_args.channels,
+            bench_args.window_minutes,
+            bench_args.pr_ratio,
+            bench_args.multi_pr_ratio,
+            bench_args.thread_ratio,
+            bench_args.replies_max,
+            bench_args.repos,
+            bench_args.reviews_max,
+            bench_args.seed + index)
+        channels[f"CBENCHMARK{index}"] = channel_messages
+        for key, pull_request in channel_pull_requests.items():
+            pull_requests.setdefault(key, pull_request)
+    messages = [message for channel_messages in channels.values()
+                for message in channel_messages]
+    logging.info(f"generated {len(messages)} messages in {len(channels)} channels with "
+                 f"{len(pull_requests)} pull requests in {time.perf_counter() - time_start:.1f}s")
+
+    slack_server = FakeSlackServer(channels,
+                                   bench_args.slack_latency_ms,
+                                   bench_args.slack_rate_limit,
+                                   bench_args.slack_page_size).start()
+    github_server = FakeGitHubServer(pull_requests,
+                                     bench_args.github_latency_ms,
+                                     bench_args.github_quota,
+                                     bench_args.github_reset_seconds,
+                                     not bench_args.github_no_conditional,
+                                     bench_args.github_page_size).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="pr-vigilante-bench-") as work_dir:
+            # runs in a separate process so peak RSS covers the application only,
+            # the working directory keeps config.yaml and the cache out of the tree
+            command = [sys.executable, "-m", "benchmarks.cycle",
+                       "--slack-url", slack_server.url,
+                       "--github-url", github_server.url,
+                       "--channel", *channels,
+                       "--window-minutes", str(bench_args.window_minutes),
+                       "--cycles", str(bench_args.cycles),
+                       "--churn", str(bench_args.churn),
+                       "--slack-rate-limit", str(bench_args.slack_rate_limit),
+                       "--log-level", bench_args.log_level,
+                       *app_args]
+            env = {**os.environ, "PYTHONPATH": ROOT_PATH}
+            result = subprocess.run(command, cwd=work_dir, env=env, stdout=subprocess.PIPE,
+                                    text=True, check=True)
+    finally:
+        slack_server.stop()
+        github_server.stop()
+
+    report = json.loads(result.stdout)
+    report.update(messages=message_count,
+                  channel_messages=len(messages),
+                  pull_requests=len(pull_requests),
+                  server_calls={"slack": dict(slack_server.calls),
+                                "github": dict(github_server.calls)})
+    return report
+
+
+def get_calls(calls: dict):
+    return int(sum(value for label, value in calls.items()))
+
+
+def print_report(reports: list):
+    columns = ("messages", "cycle", "seconds", "slack calls", "github calls", "304s",
+               "429s", "cache mem/disk/miss", "peak rss mb")
+    print(" | ".join(columns))
+    for report in reports:
+        for cycle in report["cycles"]:
+            cache = cycle.get("cache_lookups", {})
+            slack_calls = cycle.get("slack_calls", {})
+            print(" | ".join(str(value) for value in (
+                report["messages"],
+                cycle["cycle"],
+                cycle["seconds"],
+                get_calls(slack_calls),
+                get_calls(cycle.get("github_calls", {})),
+                int(cycle.get("github_conditional", {}).get("hit", 0)),
+                int(sum(value for label, value in slack_calls.items()
+                        if label.endswith("429"))),
+                f"{int(cache.get('memory', 0))}/{int(cache.get('backend', 0))}/"
+                f"{int(cache.get('miss', 0))}",
+                report["peak_rss_mb"])))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, nargs="+", default=[1000, 10000, 50000],
+                        help="channel sizes to benchmark")
+    parser.add_argument("--channels", type=int, default=1,
+                        help="channels the messages are split between")
+    parser.add_argument("--cycles", type=int, default=2,
+                        help="polling cycles per channel, later ones run with warm caches")
+    parser.add_argument("--churn", type=float, default=0.05,
+                        help="share of open pull requests changing state between cycles")
+    parser.add_argument("--window-minutes", type=int, default=1440)
+    parser.add_argument("--pr-ratio", type=float, default=0.5)
+    parser.add_argument("--multi-pr-ratio", type=float, default=0.1)
+    parser.add_argument("--thread-ratio", type=float, default=0.2)
+    parser.add_argument("--replies-max", type=int, default=5)
+    parser.add_argument("--repos", type=int, default=50)
+    parser.add_argument("--reviews-max", type=int, default=3,
+                        help="review count above the page size exercises pagination")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--slack-latency-ms", type=int, default=0)
+    parser.add_argument("--slack-rate-limit", type=int, default=6000,
+                        help="requests per minute and method, 0 disables limits")
+    parser.add_argument("--slack-page-size", type=int, default=100)
+    parser.add_argument("--github-latency-ms", type=int, default=0)
+    parser.add_argument("--github-quota", type=int, default=100000,
+                        help="requests per rate limit window, the client spreads requests "
+                             "evenly across the window")
+    parser.add_argument("--github-reset-seconds", type=int, default=60)
+    parser.add_argument("--github-no-conditional", action="store_true",
+                        help="never answer conditional requests with 304")
+    parser.add_argument("--github-page-size", type=int, default=100)
+    parser.add_argument("--output", help="write the full report as json")
+    parser.add_argument("--log-level", default="WARNING")
+    argv = sys.argv[1:]
+    app_args = argv[argv.index("--") + 1:] if "--" in argv else []
+    bench_args = parser.parse_args(argv[:argv.index("--")] if "--" in argv else argv)
+
+    logging.basicConfig(level=bench_args.log_level,
+                        format="%(asctime)s - %(levelname)s %(message)s")
+    reports = [run_scenario(bench_args, message_count, app_args)
+               for message_count in bench_args.messages]
+    print_report(reports)
+
+    if bench_args.output:
+        with open(bench_args.output, "w") as output_file:
+            json.dump({"revision": get_revision(),
+                       "arguments": vars(bench_args),
+                       "application_arguments": app_args,
+                       "reports": reports}, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
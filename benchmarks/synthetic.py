@@ -0,0 +1,83 @@
+from email.utils import formatdate
+import random
+import time
+
+PULL_REQUEST_STATES = ("open", "approved", "merged", "closed")
+
+
+def get_message_blocks(rng: random.Random, urls: list, text: str):
+    elements = [{"type": "text", "text": f"{text} "}]
+    for url in urls:
+        elements.append({"type": "link", "url": url})
+        elements.append({"type": "text", "text": " "})
+    return [{"type": "rich_text",
+             "block_id": f"b{rng.getrandbits(32):08x}",
+             "elements": [{"type": "rich_text_section", "elements": elements}]}]
+
+
+def get_pull_request(rng: random.Random, reviews_max: int):
+    state = rng.choice(PULL_REQUEST_STATES)
+    head_sha = f"{rng.getrandbits(160):040x}"
+    reviews = [{"id": index + 1,
+                "state": rng.choice(("COMMENTED", "CHANGES_REQUESTED")),
+                "user": {"login": f"reviewer{rng.randrange(20)}"},
+                "commit_id": head_sha}
+               for index in range(rng.randint(0, reviews_max))]
+    if state in ("approved", "merged"):
+        reviews.append({"id": len(reviews) + 1, "state": "APPROVED",
+                        "user": {"login": "reviewer"}, "commit_id": head_sha})
+    return {"state": "closed" if state in ("merged", "closed") else "open",
+            "merged": state == "merged",
+            "head_sha": head_sha,
+            "reviews": reviews,
+            "updated_at": formatdate(usegmt=True)}
+
+
+def generate_channel(message_count: int, window_minutes: int = 1440, pr_ratio: float = 0.5,
+                     multi_pr_ratio: float = 0.1, thread_ratio: float = 0.2,
+                     replies_max: int = 5, repos: int = 50, reviews_max: int = 3,
+                     seed: int = 1):
+    """ returns channel messages (parents and replies) and pull requests they link """
+    rng = random.Random(seed)
+    now = time.time()
+    # keep a margin so messages do not fall out of the window during a run
+    span = window_minutes * 60 * 0.9
+
+    pull_requests = {}
+    messages = []
+
+    def get_urls():
+        if rng.random() >= pr_ratio:
+            return []
+        urls = []
+        for _ in range(rng.randint(2, 4) if rng.random() < multi_pr_ratio else 1):
+            key = f"owner{rng.randrange(max(1, repos // 10))}/repo{rng.randrange(repos)}/" \
+                  f"{rng.randint(1, message_count)}"
+            pull_requests.setdefault(key, get_pull_request(rng, reviews_max))
+            owner, repo, number = key.split("/")
+            urls.append(f"https://github.com/{owner}/{repo}/pull/{number}")
+        return urls
+
+    for index in range(message_count):
+        ts = f"{now - span * (index + 1) / message_count:.6f}"
+        urls = get_urls()
+        message = {"type": "message", "user": f"U{rng.randrange(100):04d}", "ts": ts,
+                   "text": " ".join(f"<{url}>" for url in urls) or f"message {index}",
+                   "blocks": get_message_blocks(rng, urls, f"message {index}")}
+        messages.append(message)
+        if rng.random() >= thread_ratio:
+            continue
+
+        replies = []
+        for reply_index in range(rng.randint(1, replies_max)):
+            reply_ts = f"{float(ts) + (reply_index + 1) / 1000:.6f}"
+            reply_urls = get_urls()
+            replies.append({"type": "message", "user": f"U{rng.randrange(100):04d}",
+                            "ts": reply_ts, "thread_ts": ts,
+                            "text": " ".join(f"<{url}>" for url in reply_urls) or "reply",
+                            "blocks": get_message_blocks(rng, reply_urls, "reply")})
+        message.update(thread_ts=ts, reply_count=len(replies),
+                       latest_reply=replies[-1]["ts"])
+        messages.extend(replies)
+
+    return messages, pull_requests
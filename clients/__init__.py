@@ -1,3 +1,6 @@
-from .github import GitHubClient
-from .slack import SlackClient
-from .local import LocalCacheClient, NoCachedData
+from .github import GitHubClient, AsyncGitHubClient
+from .slack import SlackClient, AsyncSlackClient
+from .local import LocalCacheClient, SlackHistoryCursor, NoCachedData
+from .local import CacheBackend, FileCacheBackend, SQLiteCacheBackend
+from .webhook import GitHubWebhookServer
+from .lease import LeaseBackend, SQLiteLeaseBackend, ChannelLeaseCoordinator, LEASE_BACKENDS
@@ -1,50 +1,308 @@
+from collections import deque
+from datetime import datetime
 from functools import wraps
-from utils import sleep_until
+from threading import Lock
+from urllib import parse
+from metrics import GITHUB_API_CALLS, GITHUB_CONDITIONAL_REQUESTS
+from metrics import GITHUB_RATE_LIMIT_REMAINING, THROTTLED_SECONDS
+import aiohttp
+import asyncio
 import logging
 import requests
 import json
+import time
 from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+
+class GitHubRequestBudget:
+    """ GitHub Request Budget class """
+
+    # share of the usable quota spent in bursts before the burn rate counts
+    BURST_RATIO = 0.1
+
+    def __init__(self, resource="core", reserve=100):
+        self.resource = resource
+        # requests kept for conditional (304-likely) requests only
+        self.reserve = reserve
+        self.limit = None
+        self.remaining = None
+        self.reset_time = None
+        self.next_slot = 0
+        # (time, remaining) of the first response within the current rate limit window
+        self.window_start = None
+        # (time, remaining) within the current rate limit window
+        self.samples = deque(maxlen=100)
+        self.warned_at = 0
+        self.lock = Lock()
+
+    def update(self, headers):
+        try:
+            remaining = int(headers["x-ratelimit-remaining"])
+            reset_time = float(headers["x-ratelimit-reset"])
+            limit = int(headers.get("x-ratelimit-limit", 0))
+        except (KeyError, TypeError, ValueError):
+            return
+        with self.lock:
+            if reset_time != self.reset_time:
+                self.samples.clear()
+                self.next_slot = 0
+                self.window_start = (time.time(), remaining)
+            self.limit, self.remaining, self.reset_time = limit, remaining, reset_time
+            self.samples.append((time.time(), remaining))
+        GITHUB_RATE_LIMIT_REMAINING.labels(self.resource).set(remaining)
+        self.check_exhaustion()
+
+    def get_delay(self, is_conditional=False):
+        with self.lock:
+            if self.remaining is None:
+                return 0
+            time_now = time.time()
+            window = max(self.reset_time - time_now, 0)
+            if self.remaining <= 0:
+                return window
+            # conditional requests answered with 304 don't count against the quota
+            if is_conditional:
+                return 0
+            if self.remaining <= self.reserve:
+                return window
+            if not self.is_overspending(time_now, window):
+                return 0
+            # spread the remaining requests evenly across the reset window
+            interval = window / (self.remaining - self.reserve)
+            slot = max(self.next_slot, time_now)
+            self.next_slot = slot + interval
+            return slot - time_now
+
+    def is_overspending(self, time_now, window):
+        # whether the burn rate since the window start would use up the quota before the reset
+        start_time, start_remaining = self.window_start
+        burst = (start_remaining - self.reserve) * self.BURST_RATIO
+        used = start_remaining - self.remaining - burst
+        if used <= 0:
+            return False
+        burn_rate = used / max(time_now - start_time, 1)
+        return burn_rate * window > self.remaining - self.reserve
+
+    def get_wait(self, is_conditional=False):
+        time_wait = self.get_delay(is_conditional)
+        if time_wait > 1:
+            logging.info(f"github api budget: waiting {time_wait:.1f}s")
+        if time_wait > 0:
+            THROTTLED_SECONDS.labels("github").inc(time_wait)
+        return time_wait
+
+    def acquire(self, is_conditional=False):
+        time_wait = self.get_wait(is_conditional)
+        if time_wait > 0:
+            time.sleep(time_wait)
+
+    async def acquire_async(self, is_conditional=False):
+        time_wait = self.get_wait(is_conditional)
+        if time_wait > 0:
+            await asyncio.sleep(time_wait)
+
+    def projected_exhaustion(self):
+        with self.lock:
+            if len(self.samples) < 2:
+                return None
+            (first_time, first_remaining), (last_time, last_remaining) = \
+                self.samples[0], self.samples[-1]
+        used = first_remaining - last_remaining
+        if used <= 0 or last_time <= first_time:
+            return None
+        return last_time + last_remaining / (used / (last_time - first_time))
+
+    def check_exhaustion(self):
+        exhaustion_time = self.projected_exhaustion()
+        if not exhaustion_time or exhaustion_time >= self.reset_time:
+            return
+        if time.time() - self.warned_at < 60:
+            return
+        self.warned_at = time.time()
+        logging.warning(f"github api quota is projected to run out at "
+                        f"{datetime.fromtimestamp(exhaustion_time)}, "
+                        f"before reset at {datetime.fromtimestamp(self.reset_time)}")
+
+    def get_reset_delay(self, headers):
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+        if headers.get("x-ratelimit-reset"):
+            return max(float(headers["x-ratelimit-reset"]) - time.time(), 0) + 1
+        return 60
+
+    @staticmethod
+    def is_rate_limited(response):
+        return response.status_code in (403, 429) and (
+            response.headers.get("x-ratelimit-remaining") == "0"
+            or "retry-after" in response.headers)
+
+
+def get_api_method(api_url, is_graphql=False):
+    if is_graphql:
+        return "graphql"
+    path = parse.urlparse(api_url or "").path
+    return "pulls.reviews" if path.rstrip("/").endswith("/reviews") else "pulls"
+
+
+class GitHubResponse:
+    """ GitHub API response class """
+
+    def __init__(self, status_code, headers, links, text):
+        # same attributes as requests.Response used by the clients and parsers
+        self.status_code = status_code
+        self.headers = headers
+        self.links = links
+        self.text = text
+
+    def __bool__(self):
+        return self.status_code < 400
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def get_request_params(client, kwargs):
+    is_graphql = kwargs.get("api_url") == client.graphql_url
+    budget = client.budgets["graphql" if is_graphql else "core"]
+    is_conditional = any((kwargs.get("headers") or {}).values())
+    method = get_api_method(kwargs.get("api_url") or kwargs.get("api_route"), is_graphql)
+    return budget, is_conditional, method
+
+
+def check_response(budget, method, is_conditional, result):
+    # returns seconds to wait before retrying a rate limited request, None otherwise
+    if not isinstance(result, (requests.Response, GitHubResponse)):
+        GITHUB_API_CALLS.labels(method, "error").inc()
+        return None
+    GITHUB_API_CALLS.labels(method, str(result.status_code)).inc()
+    if is_conditional:
+        GITHUB_CONDITIONAL_REQUESTS.labels(
+            "hit" if result.status_code == 304 else "miss").inc()
+    budget.update(result.headers)
+    if budget.is_rate_limited(result):
+        time_wait = budget.get_reset_delay(result.headers)
+        logging.warning(f"api rate limit hit, retrying in {time_wait:.0f}s")
+        THROTTLED_SECONDS.labels("github").inc(time_wait)
+        return time_wait
+    logging.info(f"github api quota used:"
+                 f" {result.headers.get('x-ratelimit-used')}"
+                 f" / limit {result.headers.get('x-ratelimit-limit')}")
+    logging.info(f"github api quota remaining:"
+                 f" {result.headers.get('x-ratelimit-remaining')}")
+    return None
 
 
 def api_rate_control(func):
     @wraps(func)
-    def wrapper(*args, **kwargs):
+    def wrapper(self, *args, **kwargs):
+        budget, is_conditional, method = get_request_params(self, kwargs)
+        while True:
+            budget.acquire(is_conditional)
+            result = func(self, *args, **kwargs)
+            time_wait = check_response(budget, method, is_conditional, result)
+            if time_wait is None:
+                return result
+            time.sleep(time_wait)
+    return wrapper
+
+
+def async_api_rate_control(func):
+    @wraps(func)
+    async def wrapper(self, *args, **kwargs):
+        budget, is_conditional, method = get_request_params(self, kwargs)
         while True:
-            result = func(*args, **kwargs)
-            limit = result.headers.get(
-                "x-ratelimit-limit")
-            remaining = result.headers.get(
-                "x-ratelimit-remaining")
-            reset_time = result.headers.get(
-                "x-ratelimit-reset")
-            used = result.headers.get(
-                "x-ratelimit-used"
-            )
-            if remaining == 0:
-                logging.warning("api rate limit hit")
-                time_wait = float(reset_time)
-                sleep_until(time_wait)
-                continue
-            else:
-                logging.info(f"github api quota used:"
-                             f" {used} / limit {limit}")
-                logging.info(f"github api quota remaining:"
-                             f" {remaining}")
+            await budget.acquire_async(is_conditional)
+            result = await func(self, *args, **kwargs)
+            time_wait = check_response(budget, method, is_conditional, result)
+            if time_wait is None:
                 return result
+            await asyncio.sleep(time_wait)
     return wrapper
 
 
+REVIEWS_PER_PAGE = 100
+
+PULL_REQUEST_STATE_FRAGMENT = """
+fragment PullRequestState on PullRequest {
+  merged
+  state
+  reviewDecision
+  headRefOid
+  latestReviews(last: 100) {
+    nodes {
+      state
+      author { login }
+      commit { oid }
+    }
+  }
+}
+"""
+
+
+def get_review_page_headers(validators: dict):
+    return {"If-None-Match": validators.get("ETag"),
+            "If-Modified-Since": None if validators.get("ETag") else validators.get("Last-Modified")}
+
+
+def get_next_review_page(page, response, pages, reviews):
+    # returns the next page to request or None once the listing is complete
+    if response.status_code != 304:
+        return page + 1 if "next" in response.links else None
+    if page < len(pages):
+        return page + 1
+    # a full last page means new reviews may have started another one
+    if page == len(pages) and pages[-1].get("count", 0) >= REVIEWS_PER_PAGE:
+        return page + 1
+    return None
+
+
+def get_pull_requests_states_query(pull_requests):
+    variables = {}
+    definitions = []
+    selections = []
+    for index, pull_request in enumerate(pull_requests):
+        variables.update({f"owner{index}": pull_request["repo_owner"],
+                          f"name{index}": pull_request["repo_name"],
+                          f"number{index}": int(pull_request["number"])})
+        definitions.append(f"$owner{index}: String!, $name{index}: String!, "
+                           f"$number{index}: Int!")
+        selections.append(f"pr{index}: repository(owner: $owner{index}, name: $name{index}) "
+                          f"{{ pullRequest(number: $number{index}) {{ ...PullRequestState }} }}")
+    query = f"query({', '.join(definitions)}) {{ {' '.join(selections)} }}" \
+            f"{PULL_REQUEST_STATE_FRAGMENT}"
+    return {"query": query, "variables": variables}
+
+
+def get_pull_requests_states_data(response_json, count):
+    for error in response_json.get("errors", []):
+        logging.warning(f"GH GraphQL error: {error.get('message')}")
+    data = response_json.get("data") or {}
+    return [(data.get(f"pr{index}") or {}).get("pullRequest")
+            for index in range(count)]
+
+
 class GitHubClient:
     """ GitHub client class """
 
-    def __init__(self, api_token, api_host=None, max_retries=1):
+    def __init__(self, api_token, api_host=None, max_retries=1, graphql_url=None,
+                 quota_reserve=100, pool_size=10):
         self.api_host = api_host if api_host else "https://api.github.com"
+        self.graphql_url = graphql_url if graphql_url else f"{self.api_host}/graphql"
         self.headers = {
             "Accept": "application/vnd.github.v3+json",
             "Authorization": f"token {api_token}"
         }
         self.client = requests.Session()
-        self.client.mount(self.api_host, HTTPAdapter(max_retries=max_retries))
+        # one connection per processor worker
+        self.client.mount(self.api_host, HTTPAdapter(max_retries=max_retries,
+                                                     pool_maxsize=pool_size))
+        if not self.graphql_url.startswith(self.api_host):
+            self.client.mount(self.graphql_url, HTTPAdapter(max_retries=max_retries,
+                                                            pool_maxsize=pool_size))
+        # shared by every thread using the client, GraphQL has its own quota
+        self.budgets = {"core": GitHubRequestBudget("core", quota_reserve),
+                        "graphql": GitHubRequestBudget("graphql", quota_reserve)}
 
     @api_rate_control
     def api_call(self, api_url=None, api_route=None, verb=None,
@@ -59,6 +317,8 @@ class GitHubClient:
             res = self.client.request(method=verb, url=api_url,
                                       headers=headers,
                                       params=query, json=data)
+            if GitHubRequestBudget.is_rate_limited(res):
+                return res
             res.raise_for_status()
             return res
         except requests.exceptions.RequestException as err:
@@ -75,6 +335,8 @@ class GitHubClient:
         res = self.api_call(api_route=api_route,
                             verb="GET",
                             headers=headers)
+        if not res:
+            return {}
         if (entity_tag or last_modified) and res.status_code == 304:
             logging.info("requested object was not modified")
             return {}
@@ -82,37 +344,159 @@ class GitHubClient:
                    "details": res.json()}
         return details
 
-    def get_pull_request_reviews(self, repo_owner, repo_name, number, page=None,
-                                 entity_tag=None, last_modified=None):
+    def get_pull_request_reviews(self, repo_owner, repo_name, number, pages=None, start_page=1):
+        # pages - validators and review count of every cached page,
+        # returns (page, headers, reviews or None if not modified) of every requested page
         api_route = f"repos/{repo_owner}/{repo_name}/pulls/{number}/reviews"
-        api_query = {"page": page, "per_page": 100}
+        pages = pages if pages else []
+        fetched = []
+        page = start_page
+        while page:
+            validators = pages[page - 1] if page <= len(pages) else {}
+            res = self.api_call(api_route=api_route,
+                                verb="GET",
+                                query={"page": page, "per_page": REVIEWS_PER_PAGE},
+                                headers=get_review_page_headers(validators))
+            if not res:
+                return None
+            reviews = None if res.status_code == 304 else json.loads(res.text)
+            fetched.append((page, res.headers, reviews))
+            page = get_next_review_page(page, res, pages, reviews)
+        return fetched
+
+    def _get_pull_requests_states(self, pull_requests):
+        res = self.api_call(api_url=self.graphql_url,
+                            verb="POST",
+                            data=get_pull_requests_states_query(pull_requests))
+        if not res:
+            return [None] * len(pull_requests)
+        return get_pull_requests_states_data(res.json(), len(pull_requests))
+
+    def get_pull_requests_states(self, pull_requests, batch_size=50):
+        states = []
+        for index in range(0, len(pull_requests), batch_size):
+            batch = pull_requests[index:index + batch_size]
+            logging.info(f"resolving {len(batch)} pull requests using GraphQL")
+            states.extend(self._get_pull_requests_states(batch))
+        return states
+
+
+class AsyncGitHubClient:
+    """ Async GitHub client class """
+
+    def __init__(self, api_token, api_host=None, max_retries=1, graphql_url=None,
+                 quota_reserve=100, max_concurrency=100, budgets=None):
+        self.api_host = api_host if api_host else "https://api.github.com"
+        self.graphql_url = graphql_url if graphql_url else f"{self.api_host}/graphql"
+        self.headers = {
+            "Accept": "application/vnd.github.v3+json",
+            "Authorization": f"token {api_token}"
+        }
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        # budgets can be shared with a GitHubClient using the same token
+        self.budgets = budgets if budgets else {
+            "core": GitHubRequestBudget("core", quota_reserve),
+            "graphql": GitHubRequestBudget("graphql", quota_reserve)}
+        # bound to the event loop, created by open()
+        self.session = None
+        self.semaphore = None
+
+    async def open(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(headers=self.headers)
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @async_api_rate_control
+    async def api_call(self, api_url=None, api_route=None, verb=None,
+                       headers: dict = None, query: dict = None, data: dict = None):
+        # requests skips None values, aiohttp doesn't
+        headers = {key: value for key, value in (headers or {}).items() if value}
+        query = {key: str(value) for key, value in (query or {}).items() if value is not None}
+        if verb is None:
+            verb = "POST" if data else "GET"
+        if api_url is None:
+            api_url = f"{self.api_host}/{api_route}"
+        for attempt in range(self.max_retries + 1):
+            try:
+                logging.info(f"calling api url {api_url}")
+                async with self.semaphore:
+                    async with self.session.request(verb, api_url, headers=headers,
+                                                    params=query, json=data) as res:
+                        text = await res.text()
+                        links = {rel: {"url": str(link["url"])}
+                                 for rel, link in res.links.items()}
+                        # aiohttp normalizes header case, cached data is looked up by "ETag"
+                        response_headers = CaseInsensitiveDict(
+                            (key.decode("latin-1"), value.decode("latin-1"))
+                            for key, value in res.raw_headers)
+                        response = GitHubResponse(res.status, response_headers, links, text)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                logging.warning(f"GH API client error: {err}")
+                if attempt == self.max_retries:
+                    return {}
+        if GitHubRequestBudget.is_rate_limited(response) or response:
+            return response
+        logging.warning(f"GH API client error: {response.status_code} for url {api_url}")
+        return {}
+
+    async def get_pull_request_details(self, repo_owner, repo_name, number,
+                                       entity_tag=None, last_modified=None):
+        api_route = f"repos/{repo_owner}/{repo_name}/pulls/{number}"
         headers = {
             "If-None-Match": entity_tag,
             "If-Modified-Since": last_modified
         }
-        res = self.api_call(api_route=f"{api_route}",
-                            verb="GET",
-                            query=api_query,
-                            headers=headers)
-
+        res = await self.api_call(api_route=api_route,
+                                  verb="GET",
+                                  headers=headers)
+        if not res:
+            return {}
         if (entity_tag or last_modified) and res.status_code == 304:
             logging.info("requested object was not modified")
             return {}
+        details = {"headers": dict(res.headers),
+                   "details": res.json()}
+        return details
+
+    async def get_pull_request_reviews(self, repo_owner, repo_name, number, pages=None,
+                                       start_page=1):
+        api_route = f"repos/{repo_owner}/{repo_name}/pulls/{number}/reviews"
+        pages = pages if pages else []
+        fetched = []
+        page = start_page
+        while page:
+            validators = pages[page - 1] if page <= len(pages) else {}
+            res = await self.api_call(api_route=api_route,
+                                      verb="GET",
+                                      query={"page": page, "per_page": REVIEWS_PER_PAGE},
+                                      headers=get_review_page_headers(validators))
+            if not res:
+                return None
+            reviews = None if res.status_code == 304 else res.json()
+            fetched.append((page, res.headers, reviews))
+            page = get_next_review_page(page, res, pages, reviews)
+        return fetched
+
+    async def _get_pull_requests_states(self, pull_requests):
+        res = await self.api_call(api_url=self.graphql_url,
+                                  verb="POST",
+                                  data=get_pull_requests_states_query(pull_requests))
+        if not res:
+            return [None] * len(pull_requests)
+        return get_pull_requests_states_data(res.json(), len(pull_requests))
 
-        reviews = {"reviews": []}
-        response_json = json.loads(res.text)
-        content = {"headers": dict(res.headers),
-                   "review": response_json}
-        reviews["reviews"].append(content)
-
-        if page is None:
-            while "next" in res.links.keys():
-                res = self.api_call(api_url=res.links["next"]["url"],
-                                    verb="GET",
-                                    query=api_query,
-                                    headers=headers)
-                response_json = json.loads(res.text)
-                content = {"headers": dict(res.headers),
-                           "review": response_json}
-                reviews["reviews"].append(content)
-        return reviews
+    async def get_pull_requests_states(self, pull_requests, batch_size=50):
+        batches = [pull_requests[index:index + batch_size]
+                   for index in range(0, len(pull_requests), batch_size)]
+        logging.info(f"resolving {len(pull_requests)} pull requests using GraphQL "
+                     f"in {len(batches)} batches")
+        results = await asyncio.gather(*(self._get_pull_requests_states(batch)
+                                         for batch in batches))
+        return [state for states in results for state in states]
@@ -0,0 +1,175 @@
+from abc import ABC, abstractmethod
+from threading import Event, Lock, Thread
+import hashlib
+import logging
+import sqlite3
+import time
+
+
+def get_rendezvous_owner(key: str, members: list):
+    # highest random weight, only keys of a joining / leaving member move
+    return max(members, key=lambda member: hashlib.sha1(f"{member}/{key}".encode()).digest())
+
+
+class LeaseBackend(ABC):
+    """ Lease Backend base class """
+
+    @abstractmethod
+    def heartbeat(self, member: str, ttl: float):
+        # registers the member, returns members with a live heartbeat
+        pass
+
+    @abstractmethod
+    def acquire(self, name: str, member: str, ttl: float):
+        # takes or renews the lease, returns False if another member holds it
+        pass
+
+    @abstractmethod
+    def release(self, name: str, member: str):
+        pass
+
+    @abstractmethod
+    def leave(self, member: str):
+        pass
+
+
+class SQLiteLeaseBackend(LeaseBackend):
+    """ SQLite Lease Backend class """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = Lock()
+        # rollback journal, the database may be shared by several hosts
+        self.connection = sqlite3.connect(self.db_path,
+                                          check_same_thread=False,
+                                          isolation_level=None,
+                                          timeout=30)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS members (
+                member TEXT PRIMARY KEY,
+                expires_at REAL NOT NULL
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                member TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )""")
+
+    def heartbeat(self, member, ttl):
+        time_now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "INSERT INTO members (member, expires_at) VALUES (?, ?) "
+                    "ON CONFLICT (member) DO UPDATE SET expires_at = excluded.expires_at",
+                    (member, time_now + ttl))
+                self.connection.execute("DELETE FROM members WHERE expires_at < ?", (time_now,))
+                rows = self.connection.execute("SELECT member FROM members").fetchall()
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+        return [row[0] for row in rows]
+
+    def acquire(self, name, member, ttl):
+        time_now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                self.connection.execute(
+                    "INSERT INTO leases (name, member, expires_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE "
+                    "SET member = excluded.member, expires_at = excluded.expires_at "
+                    "WHERE leases.member = excluded.member OR leases.expires_at < ?",
+                    (name, member, time_now + ttl, time_now))
+                row = self.connection.execute("SELECT member FROM leases WHERE name = ?",
+                                              (name,)).fetchone()
+                self.connection.execute("COMMIT")
+            except sqlite3.Error:
+                self.connection.execute("ROLLBACK")
+                raise
+        return row[0] == member
+
+    def release(self, name, member):
+        with self.lock:
+            self.connection.execute("DELETE FROM leases WHERE name = ? AND member = ?",
+                                    (name, member))
+
+    def leave(self, member):
+        with self.lock:
+            self.connection.execute("DELETE FROM leases WHERE member = ?", (member,))
+            self.connection.execute("DELETE FROM members WHERE member = ?", (member,))
+
+
+LEASE_BACKENDS = {"sqlite": SQLiteLeaseBackend}
+
+
+class ChannelLeaseCoordinator(Thread):
+    """ Channel Lease Coordinator class """
+
+    def __init__(self, backend, member_id, channels, lease_seconds=60, heartbeat_seconds=15):
+        super().__init__()
+        self.name = "shard leases"
+        self.daemon = True
+
+        self.backend = backend
+        self.member_id = member_id
+        self.channels = list(channels)
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+
+        self.owned = set()
+        self.renewed_at = 0
+        self.lock = Lock()
+        self.stopped = Event()
+
+    def rebalance(self):
+        # leases expire relative to the time they were requested
+        time_start = time.time()
+        members = self.backend.heartbeat(self.member_id, self.lease_seconds)
+        if self.member_id not in members:
+            members.append(self.member_id)
+        desired = {channel for channel in self.channels
+                   if get_rendezvous_owner(channel, members) == self.member_id}
+
+        with self.lock:
+            released = self.owned - desired
+        for channel in released:
+            self.backend.release(f"channels/{channel}", self.member_id)
+        owned = set()
+        for channel in desired:
+            # a channel of a dead member is taken over once its lease expires
+            if self.backend.acquire(f"channels/{channel}", self.member_id, self.lease_seconds):
+                owned.add(channel)
+
+        with self.lock:
+            if owned != self.owned:
+                logging.info(f"{self.member_id} owns channels {sorted(owned)} "
+                             f"of {len(self.channels)}, members: {sorted(members)}")
+            self.owned = owned
+            self.renewed_at = time_start
+
+    def get_channels(self):
+        with self.lock:
+            if time.time() - self.renewed_at > self.lease_seconds:
+                # leases were not renewed in time, other members may own them now
+                return set()
+            return set(self.owned)
+
+    def is_owned(self, channel):
+        return channel in self.get_channels()
+
+    def run(self):
+        while not self.stopped.wait(self.heartbeat_seconds):
+            try:
+                self.rebalance()
+            except Exception as err:
+                logging.warning(f"unable to renew channel leases: {err}")
+
+    def stop(self):
+        self.stopped.set()
+        self.backend.leave(self.member_id)
+        with self.lock:
+            self.owned = set()
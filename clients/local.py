@@ -1,27 +1,86 @@
+from abc import ABC, abstractmethod
+from metrics import CACHE_LOOKUPS
+from nested_lookup import nested_lookup
+from collections import OrderedDict
+from threading import Lock
+from utils import KeyedLock
 import os
 import shutil
+import sqlite3
 import json
 import logging
+import time
 
 
 class NoCachedData(Exception):
     pass
 
 
-class LocalCacheClient:
-    """ Local Cache Client class """
+def get_validators(data):
+    # latest conditional request validators found in a cached entry
+    validators = {}
+    for key in ("ETag", "Last-Modified"):
+        values = nested_lookup(key, data) if data else []
+        if values:
+            validators[key] = str(values[-1])
+    return validators
+
+
+class CacheBackend(ABC):
+    """ Cache Backend base class """
+
+    @abstractmethod
+    def save(self, data, file_path, file_name):
+        # returns the entry merged with the stored one
+        pass
+
+    @abstractmethod
+    def load(self, file_path, file_name):
+        pass
+
+    def load_validators(self, file_path, file_name, data=None):
+        # backends without stored validators look them up in the entry
+        if data is None:
+            try:
+                data = self.load(file_path, file_name)
+            except NoCachedData:
+                return {}
+        return get_validators(data)
+
+    @abstractmethod
+    def delete(self, dir_path):
+        pass
+
+    @abstractmethod
+    def list_entries(self, dir_path):
+        # yields (file path, file name, last modification time)
+        pass
+
+    @abstractmethod
+    def add_tombstone(self, dir_path):
+        pass
+
+    @abstractmethod
+    def remove_tombstones(self, dir_paths):
+        pass
+
+    @abstractmethod
+    def list_tombstones(self):
+        pass
+
+
+class FileCacheBackend(CacheBackend):
+    """ File Cache Backend class """
 
     def __init__(self, dir_path):
         self.dir_path = dir_path
-        if not os.path.exists(self.dir_path):
-            logging.info(f"creating cache directory {self.dir_path}")
-            os.makedirs(self.dir_path)
+        # deleted paths waiting for garbage collection, one per line
+        self.tombstones_path = os.path.join(self.dir_path, "tombstones.log")
 
-    def save(self, data, file_path, file_name=None):
-        file_name = file_name if file_name else "data.json"
+    def save(self, data, file_path, file_name):
         _path = os.path.join(self.dir_path, file_path)
-        if not os.path.exists(_path):
-            os.makedirs(_path)
+        if not os.path.exists(f"{_path}/{file_name}"):
+            os.makedirs(_path, exist_ok=True)
             logging.info(f"storing new {file_name} under {_path}")
             with open(f"{_path}/{file_name}", "w") as file:
                 json.dump(data, file, ensure_ascii=False, indent=2)
@@ -33,11 +92,11 @@ class LocalCacheClient:
                 data = {**file_data, **data}
                 json.dump(data, file, ensure_ascii=False, indent=2)
                 file.truncate()
+        return data
 
-    def load(self, file_path, file_name=None):
-        file_name = file_name if file_name else "data.json"
+    def load(self, file_path, file_name):
         _path = os.path.join(self.dir_path, file_path)
-        if not os.path.exists(_path):
+        if not os.path.exists(f"{_path}/{file_name}"):
             raise NoCachedData
         else:
             logging.info(f"loading {file_name} from {_path}")
@@ -49,9 +108,425 @@ class LocalCacheClient:
         _path = os.path.join(self.dir_path, dir_path)
         shutil.rmtree(_path, onerror=FileNotFoundError)
         logging.info(f"path {_path} was removed")
-        for current_dir, sub_dirs, files in os.walk(self.dir_path, topdown=False):
-            for _dir in sub_dirs:
-                dir_path = os.path.join(current_dir, _dir)
-                if not os.listdir(dir_path):
-                    logging.info(f"cleaned up {dir_path}")
-                    os.rmdir(os.path.realpath(os.path.join(dir_path)))
+        # only parents of the removed path can become empty
+        _path = os.path.dirname(os.path.normpath(_path))
+        while os.path.normpath(_path) != os.path.normpath(self.dir_path):
+            try:
+                os.rmdir(_path)
+            except OSError:
+                break
+            logging.info(f"cleaned up {_path}")
+            _path = os.path.dirname(_path)
+
+    def list_entries(self, dir_path):
+        _path = os.path.join(self.dir_path, dir_path)
+        for current_dir, sub_dirs, files in os.walk(_path):
+            for file_name in files:
+                file_path = os.path.relpath(current_dir, self.dir_path)
+                try:
+                    updated_at = os.path.getmtime(os.path.join(current_dir, file_name))
+                except FileNotFoundError:
+                    continue
+                yield file_path, file_name, updated_at
+
+    def add_tombstone(self, dir_path):
+        with open(self.tombstones_path, "a") as file:
+            file.write(f"{dir_path}\n")
+
+    def remove_tombstones(self, dir_paths):
+        dir_paths = set(dir_paths)
+        tombstones = [dir_path for dir_path in self.list_tombstones()
+                      if dir_path not in dir_paths]
+        with open(f"{self.tombstones_path}.tmp", "w") as file:
+            file.writelines(f"{dir_path}\n" for dir_path in tombstones)
+        os.replace(f"{self.tombstones_path}.tmp", self.tombstones_path)
+
+    def list_tombstones(self):
+        if not os.path.exists(self.tombstones_path):
+            return []
+        with open(self.tombstones_path, "r") as file:
+            return [line.strip() for line in file if line.strip()]
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """ SQLite Cache Backend class """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = Lock()
+        self.connection = sqlite3.connect(self.db_path,
+                                          check_same_thread=False,
+                                          isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                path TEXT NOT NULL,
+                name TEXT NOT NULL,
+                data TEXT NOT NULL,
+                entity_tag TEXT,
+                last_modified TEXT,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (path, name)
+            )""")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS tombstones (
+                path TEXT PRIMARY KEY
+            )""")
+
+    def save(self, data, file_path, file_name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM cache WHERE path = ? AND name = ?",
+                (file_path, file_name)).fetchone()
+            if row:
+                logging.info(f"updating {file_name} under {file_path}")
+                data = {**json.loads(row[0]), **data}
+            else:
+                logging.info(f"storing new {file_name} under {file_path}")
+            validators = get_validators(data)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?)",
+                (file_path, file_name, json.dumps(data, ensure_ascii=False),
+                 validators.get("ETag"), validators.get("Last-Modified"), time.time()))
+        return data
+
+    def load(self, file_path, file_name):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM cache WHERE path = ? AND name = ?",
+                (file_path, file_name)).fetchone()
+        if not row:
+            raise NoCachedData
+        logging.info(f"loading {file_name} from {file_path}")
+        return json.loads(row[0])
+
+    def load_validators(self, file_path, file_name, data=None):
+        # stored on save, the entry doesn't have to be parsed
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT entity_tag, last_modified FROM cache WHERE path = ? AND name = ?",
+                (file_path, file_name)).fetchone()
+        if not row:
+            return {}
+        return {key: value for key, value in zip(("ETag", "Last-Modified"), row) if value}
+
+    def delete(self, dir_path):
+        dir_path = dir_path.rstrip("/")
+        # '0' follows '/' so the range covers every nested path
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM cache WHERE path = ? OR (path >= ? AND path < ?)",
+                (dir_path, f"{dir_path}/", f"{dir_path}0"))
+        logging.info(f"path {dir_path} was removed")
+
+    def list_entries(self, dir_path):
+        dir_path = dir_path.rstrip("/")
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT path, name, updated_at FROM cache "
+                "WHERE path = ? OR (path >= ? AND path < ?)",
+                (dir_path, f"{dir_path}/", f"{dir_path}0")).fetchall()
+        yield from rows
+
+    def add_tombstone(self, dir_path):
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO tombstones VALUES (?)", (dir_path,))
+
+    def remove_tombstones(self, dir_paths):
+        with self.lock:
+            self.connection.executemany("DELETE FROM tombstones WHERE path = ?",
+                                        [(dir_path,) for dir_path in dir_paths])
+
+    def list_tombstones(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT path FROM tombstones").fetchall()
+        return [row[0] for row in rows]
+
+    def migrate(self, dir_path):
+        tombstones = FileCacheBackend(dir_path)
+        for tombstone in tombstones.list_tombstones():
+            self.add_tombstone(tombstone)
+        if os.path.exists(tombstones.tombstones_path):
+            os.remove(tombstones.tombstones_path)
+        migrated = 0
+        for current_dir, sub_dirs, files in os.walk(dir_path, topdown=False):
+            for file_name in files:
+                if not file_name.endswith(".json"):
+                    continue
+                file_path = os.path.relpath(current_dir, dir_path)
+                with open(os.path.join(current_dir, file_name), "r") as file:
+                    data = json.load(file)
+                self.save(data, file_path, file_name)
+                os.remove(os.path.join(current_dir, file_name))
+                migrated += 1
+            if current_dir != dir_path and not os.listdir(current_dir):
+                os.rmdir(current_dir)
+        if migrated:
+            logging.info(f"migrated {migrated} cached files into {self.db_path}")
+
+
+class MemoryCache:
+    """ Memory Cache class """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=3600):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+
+        # key -> (expires at, size, json text), least recently used first,
+        # every lookup decodes its own copy so callers can't change cached entries
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def _pop(self, key):
+        _, size, text = self.entries.pop(key)
+        self.size -= size
+        return text
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                text = entry[2]
+            else:
+                if entry:
+                    self._pop(key)
+                self.misses += 1
+                return None
+        return json.loads(text)
+
+    def set(self, key, data):
+        text = json.dumps(data, ensure_ascii=False)
+        size = len(text)
+        if size > self.max_bytes:
+            self.discard(key)
+            return
+        with self.lock:
+            if key in self.entries:
+                self._pop(key)
+            self.entries[key] = (time.monotonic() + self.ttl, size, text)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self._pop(next(iter(self.entries)))
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            if key in self.entries:
+                self._pop(key)
+
+    def discard_prefix(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key[0] == prefix or key[0].startswith(f"{prefix}/")]:
+                self._pop(key)
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries),
+                    "bytes": self.size,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions}
+
+
+class LocalCacheClient:
+    """ Local Cache Client class """
+
+    def __init__(self, dir_path, backend="file", memory_max_entries=0,
+                 memory_max_bytes=0, memory_ttl=0):
+        self.dir_path = dir_path
+        if not os.path.exists(self.dir_path):
+            logging.info(f"creating cache directory {self.dir_path}")
+            os.makedirs(self.dir_path)
+
+        if backend == "sqlite":
+            self.backend = SQLiteCacheBackend(os.path.join(self.dir_path, "cache.db"))
+            self.backend.migrate(self.dir_path)
+        else:
+            self.backend = FileCacheBackend(self.dir_path)
+
+        self.memory = None
+        if memory_max_entries and memory_max_bytes and memory_ttl:
+            self.memory = MemoryCache(memory_max_entries, memory_max_bytes, memory_ttl)
+
+        # deleted paths waiting for garbage collection, kept by the backend across restarts
+        self.tombstones = set(self.backend.list_tombstones())
+        # file path -> last load / save time
+        self.accessed = {}
+        self.lock = Lock()
+        # read-modify-write of an entry is serialized per path only
+        self.path_locks = KeyedLock()
+
+    def get_tombstone(self, file_path):
+        parts = file_path.strip("/").split("/")
+        with self.lock:
+            for index in range(1, len(parts) + 1):
+                _path = "/".join(parts[:index])
+                if _path in self.tombstones:
+                    return _path
+        return None
+
+    def save(self, data, file_path, file_name=None):
+        file_name = file_name if file_name else "data.json"
+        with self.lock:
+            self.accessed[file_path] = time.time()
+        with self.path_locks(file_path):
+            tombstone = self.get_tombstone(file_path)
+            if tombstone:
+                # stale data must not be merged into the new entry
+                self.sweep([tombstone])
+            data = self.backend.save(data, file_path, file_name)
+            if self.memory:
+                # write-through of the merged entry
+                self.memory.set((file_path, file_name), data)
+
+    def load(self, file_path, file_name=None):
+        file_name = file_name if file_name else "data.json"
+        if self.get_tombstone(file_path):
+            CACHE_LOOKUPS.labels("miss").inc()
+            raise NoCachedData
+        with self.lock:
+            self.accessed[file_path] = time.time()
+        if self.memory:
+            data = self.memory.get((file_path, file_name))
+            if data is not None:
+                logging.debug(f"loading {file_name} of {file_path} from memory")
+                CACHE_LOOKUPS.labels("memory").inc()
+                return data
+        # a save or delete overtaking the backend read would leave stale data in memory
+        with self.path_locks(file_path):
+            if self.get_tombstone(file_path):
+                CACHE_LOOKUPS.labels("miss").inc()
+                raise NoCachedData
+            try:
+                data = self.backend.load(file_path, file_name)
+            except NoCachedData:
+                CACHE_LOOKUPS.labels("miss").inc()
+                raise
+            CACHE_LOOKUPS.labels("backend").inc()
+            if self.memory:
+                self.memory.set((file_path, file_name), data)
+        return data
+
+    def load_validators(self, file_path, file_name=None, data=None):
+        # data - the entry if it was loaded already
+        file_name = file_name if file_name else "data.json"
+        if self.get_tombstone(file_path):
+            return {}
+        return self.backend.load_validators(file_path, file_name, data)
+
+    def delete(self, dir_path):
+        dir_path = dir_path.strip("/")
+        with self.path_locks(dir_path):
+            if self.memory:
+                self.memory.discard_prefix(dir_path)
+            with self.lock:
+                if dir_path not in self.tombstones:
+                    self.tombstones.add(dir_path)
+                    self.backend.add_tombstone(dir_path)
+        logging.info(f"path {dir_path} was marked for removal")
+
+    def sweep(self, dir_paths):
+        swept = []
+        for dir_path in dir_paths:
+            with self.path_locks(dir_path):
+                if self.memory:
+                    self.memory.discard_prefix(dir_path)
+                self.backend.delete(dir_path)
+                with self.lock:
+                    if dir_path in self.tombstones:
+                        self.tombstones.discard(dir_path)
+                        swept.append(dir_path)
+                    self.accessed.pop(dir_path, None)
+        if swept:
+            with self.lock:
+                # paths deleted again in the meantime keep their tombstone
+                self.backend.remove_tombstones([dir_path for dir_path in swept
+                                                if dir_path not in self.tombstones])
+
+    def collect_garbage(self, max_age_seconds=None, batch_size=500, dir_path="repos"):
+        with self.lock:
+            tombstones = list(self.tombstones)
+        for index in range(0, len(tombstones), batch_size):
+            self.sweep(tombstones[index:index + batch_size])
+        if tombstones:
+            logging.info(f"removed {len(tombstones)} deleted cache paths")
+
+        if not max_age_seconds:
+            return
+        # entries nobody looked at within the time window belong to messages
+        # which are not scanned anymore
+        oldest = time.time() - max_age_seconds
+        expired = []
+        for file_path, file_name, updated_at in self.backend.list_entries(dir_path):
+            with self.lock:
+                accessed_at = max(self.accessed.get(file_path, 0), updated_at)
+            if accessed_at < oldest:
+                expired.append(file_path)
+        for index in range(0, len(expired), batch_size):
+            self.sweep(expired[index:index + batch_size])
+        if expired:
+            logging.info(f"removed {len(expired)} expired cache paths")
+
+    def stats(self):
+        return self.memory.stats() if self.memory else {}
+
+
+class SlackHistoryCursor:
+    """ Slack History Cursor class """
+
+    def __init__(self, local_client, channel, full_sync_minutes=0):
+        self.local_client = local_client
+        self.cache_path = f"channels/{channel}"
+        self.file_name = "cursor.json"
+        self.full_sync_minutes = full_sync_minutes
+
+        try:
+            data = self.local_client.load(self.cache_path, self.file_name)
+        except NoCachedData:
+            data = {}
+        self.latest_ts = data.get("latest_ts")
+        self.full_sync_ts = data.get("full_sync_ts")
+        # ts -> parent message, cursors of older versions kept timestamps only
+        pending = data.get("pending", {})
+        self.pending = pending if isinstance(pending, dict) else dict.fromkeys(pending)
+
+    def is_full_sync(self):
+        if self.latest_ts is None or self.full_sync_ts is None:
+            return True
+        if self.full_sync_minutes:
+            return time.time() - self.full_sync_ts >= self.full_sync_minutes * 60
+        return False
+
+    def get_oldest_ts(self):
+        if self.is_full_sync():
+            logging.info(f"full history sync for {self.cache_path}")
+            return None
+        logging.info(f"incremental history sync for {self.cache_path} "
+                     f"since {self.latest_ts}")
+        return self.latest_ts
+
+    def update(self, messages, pending, oldest_ts, full_sync=False):
+        timestamps = [message["ts"] for message in messages]
+        if self.latest_ts:
+            timestamps.append(self.latest_ts)
+        if timestamps:
+            self.latest_ts = max(timestamps, key=float)
+        if full_sync:
+            self.full_sync_ts = time.time()
+        # messages which left the time window are not re-checked anymore
+        self.pending = {ts: message for ts, message in pending.items()
+                        if float(ts) >= float(oldest_ts)}
+        logging.info(f"{len(self.pending)} pending threads in {self.cache_path}")
+        self.local_client.save({"latest_ts": self.latest_ts,
+                                "full_sync_ts": self.full_sync_ts,
+                                "pending": self.pending},
+                               self.cache_path, self.file_name)
@@ -1,10 +1,28 @@
 from slack_sdk import WebClient
+from slack_sdk.web.async_client import AsyncWebClient
 from slack_sdk.errors import SlackApiError
 from slack_sdk.http_retry.builtin_handlers import ConnectionErrorRetryHandler
+from slack_sdk.http_retry.builtin_async_handlers import AsyncConnectionErrorRetryHandler
+from slack_sdk.socket_mode import SocketModeClient
+from slack_sdk.socket_mode.response import SocketModeResponse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from functools import wraps
-from utils import sleep_until
+from traceback import format_exc
+from utils import TokenBucket
+from metrics import SLACK_API_CALLS, SLACK_RATE_LIMIT_LEVEL, THROTTLED_SECONDS
+import aiohttp
+import asyncio
 import logging
+import time
+
+# requests per minute, see https://api.slack.com/docs/rate-limits
+SLACK_RATE_TIERS = {1: 1, 2: 20, 3: 50, 4: 100}
+SLACK_METHOD_TIERS = {
+    "conversations.history": 3,
+    "conversations.replies": 3,
+    "reactions.add": 3
+}
 
 
 def set_oldest_ts(minutes: int):
@@ -14,9 +32,13 @@ def set_oldest_ts(minutes: int):
     return str(oldest.timestamp())
 
 
-def set_conv_params(channel: str, minutes: int, latest_ts: str = None):
-    # set oldest_ts ts based on minutes to look back
-    oldest_ts = set_oldest_ts(minutes)
+def set_conv_params(channel: str, minutes: int, latest_ts: str = None, oldest_ts: str = None):
+    # set oldest_ts ts based on minutes to look back,
+    # a newer cursor (if provided) narrows the window down
+    window_ts = set_oldest_ts(minutes)
+    inclusive = oldest_ts is None
+    if oldest_ts is None or float(oldest_ts) < float(window_ts):
+        oldest_ts = window_ts
     # set latest_ts to current time if not provided
     latest_ts = latest_ts if latest_ts else str(datetime.now().timestamp())
     params = {
@@ -24,40 +46,97 @@ def set_conv_params(channel: str, minutes: int, latest_ts: str = None):
         "oldest": oldest_ts,
         "channel": channel,
         "limit": 100,
-        "inclusive": True
+        "inclusive": inclusive
     }
     return params
 
 
-def api_rate_control(func):
-    @wraps(func)
-    def wrapper(self, *args, **kwargs):
-        while True:
-            try:
-                result = func(self, *args, **kwargs)
-                return result
-            except SlackApiError as err:
-                if err.response.status_code == 429:
-                    logging.warning("api rate limit hit!")
-                    time_wait = float(err.response["headers"]["Retry-After"])
-                    sleep_until(time_wait)
-                    continue
-                else:
-                    break
-    return wrapper
+def get_rate_limits():
+    rate_limits = {}
+    for method, tier in SLACK_METHOD_TIERS.items():
+        per_minute = SLACK_RATE_TIERS[tier]
+        rate_limits[method] = TokenBucket(rate=per_minute / 60,
+                                          capacity=max(1, per_minute // 10))
+    return rate_limits
+
+
+def get_retry_delay(method: str, bucket: TokenBucket, err: SlackApiError):
+    # returns seconds to wait before retrying a rate limited call, None otherwise
+    SLACK_API_CALLS.labels(method, str(err.response.status_code)).inc()
+    if err.response.status_code != 429:
+        return None
+    time_wait = float(err.response.headers.get("Retry-After", 1))
+    logging.warning(f"api rate limit hit for {method}, "
+                    f"retrying in {time_wait}s")
+    bucket.drain(time_wait)
+    THROTTLED_SECONDS.labels("slack").inc(time_wait)
+    return time_wait
+
+
+def api_rate_control(method: str):
+    def decorator(func):
+        @wraps(func)
+        def wrapper(self, *args, **kwargs):
+            bucket = self.rate_limits[method]
+            while True:
+                time_start = time.monotonic()
+                bucket.acquire()
+                THROTTLED_SECONDS.labels("slack").inc(time.monotonic() - time_start)
+                SLACK_RATE_LIMIT_LEVEL.labels(method).set(bucket.level)
+                try:
+                    result = func(self, *args, **kwargs)
+                    SLACK_API_CALLS.labels(method, "ok" if result else "error").inc()
+                    return result
+                except SlackApiError as err:
+                    time_wait = get_retry_delay(method, bucket, err)
+                    if time_wait is None:
+                        break
+                    time.sleep(time_wait)
+        return wrapper
+    return decorator
+
+
+def async_api_rate_control(method: str):
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            bucket = self.rate_limits[method]
+            while True:
+                time_start = time.monotonic()
+                await bucket.acquire_async()
+                THROTTLED_SECONDS.labels("slack").inc(time.monotonic() - time_start)
+                SLACK_RATE_LIMIT_LEVEL.labels(method).set(bucket.level)
+                try:
+                    result = await func(self, *args, **kwargs)
+                    SLACK_API_CALLS.labels(method, "ok" if result else "error").inc()
+                    return result
+                except SlackApiError as err:
+                    time_wait = get_retry_delay(method, bucket, err)
+                    if time_wait is None:
+                        break
+                    await asyncio.sleep(time_wait)
+        return wrapper
+    return decorator
 
 
 class SlackClient:
     """ Slack client class """
 
-    def __init__(self, api_token: str, max_retries=1):
-        self.client = WebClient(api_token)
+    def __init__(self, api_token: str, max_retries=1, base_url: str = None):
+        self.client = WebClient(api_token, **({"base_url": base_url} if base_url else {}))
+        self.socket_client = None
 
         conn_error_handler = ConnectionErrorRetryHandler(
             max_retry_count=max_retries)
         self.client.retry_handlers.append(conn_error_handler)
 
-    @api_rate_control
+        self.rate_limits = get_rate_limits()
+
+    def get_rate_limit_levels(self):
+        return {method: round(bucket.level, 2)
+                for method, bucket in self.rate_limits.items()}
+
+    @api_rate_control("reactions.add")
     def add_message_reaction(self, channel: str, reaction: str, timestamp: str, dry_run: bool):
         if not dry_run:
             try:
@@ -65,42 +144,56 @@ class SlackClient:
                 self.client.reactions_add(channel=channel, name=reaction, timestamp=timestamp)
                 return True
             except SlackApiError as err:
+                if err.response.status_code == 429:
+                    raise
+                if err.response["error"] == "already_reacted":
+                    logging.debug(f"reaction '{reaction}' already on message")
+                    return True
                 logging.info(f"error reacting to message: {err}")
                 return False
         else:
             logging.info(f"dry-run: adding reaction '{reaction}' to message")
             return True
 
-    @api_rate_control
-    def _get_conversation_history(self, channel: str, minutes: int, latest_ts: str = None):
-        params = set_conv_params(channel, minutes, latest_ts)
+    @api_rate_control("conversations.history")
+    def _get_conversation_history(self, channel: str, minutes: int, latest_ts: str = None,
+                                  oldest_ts: str = None):
+        params = set_conv_params(channel, minutes, latest_ts, oldest_ts)
         try:
             history = self.client.conversations_history(**params)
             return history
         except SlackApiError as err:
+            if err.response.status_code == 429:
+                raise
             logging.info(f"error loading conv. history: {err}")
             return []
 
-    def get_conversation_history(self, channel: str, minutes: int):
-        history = self._get_conversation_history(channel, minutes)
+    def get_conversation_history(self, channel: str, minutes: int, oldest_ts: str = None):
+        history = self._get_conversation_history(channel, minutes, oldest_ts=oldest_ts)
         messages = history["messages"]
 
         while history.get("has_more"):
             last_ts = history["messages"][-1]["ts"]
             history = self._get_conversation_history(
-                channel, minutes, last_ts)
+                channel, minutes, last_ts, oldest_ts)
             messages.extend(history["messages"])
+        # inclusive pagination returns the boundary message twice
+        messages = list({message["ts"]: message for message in messages}.values())
         logging.info(f"fetched {len(messages)} messages")
         return messages
 
-    @api_rate_control
-    def _get_conversation_replies(self, channel: str, minutes: int, ts: str, latest_ts: str = None):
-        params = set_conv_params(channel, minutes, latest_ts)
+    @api_rate_control("conversations.replies")
+    def _get_conversation_replies(self, channel: str, minutes: int, ts: str, cursor: str = None):
+        params = set_conv_params(channel, minutes)
         params["ts"] = ts
+        if cursor:
+            params["cursor"] = cursor
         try:
             threads = self.client.conversations_replies(**params)
             return threads
         except SlackApiError as err:
+            if err.response.status_code == 429:
+                raise
             logging.info(f"error loading message replies: {err}")
             return []
 
@@ -109,10 +202,211 @@ class SlackClient:
         replies = history["messages"]
 
         while history.get("has_more"):
-            last_ts = history["messages]"][-1]["ts"]
+            cursor = history["response_metadata"]["next_cursor"]
             history = self._get_conversation_replies(
-                channel, minutes, ts, last_ts)
+                channel, minutes, ts, cursor)
             replies.extend(history["messages"])
         if len(replies) > 1:
             logging.info(f"fetched {len(replies)} replies for message {ts}")
         return replies
+
+    def get_message(self, channel: str, minutes: int, ts: str):
+        history = self._get_conversation_replies(channel, minutes, ts)
+        for message in history["messages"] if history else []:
+            if message["ts"] == ts:
+                return message
+        logging.info(f"message {ts} was not found")
+        return None
+
+    def start_socket_mode(self, app_token: str, listener):
+        def on_request(client, request):
+            client.send_socket_mode_response(
+                SocketModeResponse(envelope_id=request.envelope_id))
+            if request.type != "events_api":
+                return
+            try:
+                listener(request.payload.get("event", {}))
+            except Exception:
+                logging.error(format_exc())
+
+        self.socket_client = SocketModeClient(
+            app_token=app_token,
+            web_client=WebClient(base_url=self.client.base_url))
+        self.socket_client.socket_mode_request_listeners.append(on_request)
+        self.socket_client.connect()
+        logging.info("connected to slack using socket mode")
+
+    def get_conversations_replies(self, channel: str, minutes: int, threads: list, max_workers=1):
+        if max_workers <= 1 or len(threads) <= 1:
+            return {ts: self.get_conversation_replies(channel, minutes, ts)
+                    for ts in threads}
+        # the pool size bounds concurrency, the rate is bound by conversations.replies bucket
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix="slack replies") as executor:
+            results = executor.map(
+                lambda ts: self.get_conversation_replies(channel, minutes, ts), threads)
+            replies = dict(zip(threads, results))
+        logging.info(f"fetched replies for {len(threads)} threads, "
+                     f"rate limit levels: {self.get_rate_limit_levels()}")
+        return replies
+
+
+class AsyncSlackClient:
+    """ Async Slack client class """
+
+    def __init__(self, api_token: str, max_retries=1, base_url: str = None,
+                 max_concurrency=10, rate_limits: dict = None):
+        self.api_token = api_token
+        self.base_url = base_url
+        self.max_retries = max_retries
+        self.max_concurrency = max_concurrency
+        # rate limits are per workspace, buckets can be shared with a SlackClient
+        self.rate_limits = rate_limits if rate_limits else get_rate_limits()
+        # bound to the event loop, created by open()
+        self.client = None
+        self.session = None
+        self.semaphore = None
+
+    async def open(self):
+        if self.client is None:
+            self.session = aiohttp.ClientSession()
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.client = AsyncWebClient(
+                self.api_token, session=self.session,
+                retry_handlers=[AsyncConnectionErrorRetryHandler(
+                    max_retry_count=self.max_retries)],
+                **({"base_url": self.base_url} if self.base_url else {}))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.client = self.session = None
+
+    @async_api_rate_control("reactions.add")
+    async def add_message_reaction(self, channel: str, reaction: str, timestamp: str,
+                                   dry_run: bool):
+        if not dry_run:
+            try:
+                logging.info(f"adding reaction '{reaction}' to message")
+                await self.client.reactions_add(channel=channel, name=reaction,
+                                                timestamp=timestamp)
+                return True
+            except SlackApiError as err:
+                if err.response.status_code == 429:
+                    raise
+                if err.response["error"] == "already_reacted":
+                    logging.debug(f"reaction '{reaction}' already on message")
+                    return True
+                logging.info(f"error reacting to message: {err}")
+                return False
+        else:
+            logging.info(f"dry-run: adding reaction '{reaction}' to message")
+            return True
+
+    @async_api_rate_control("conversations.history")
+    async def _get_conversation_history(self, channel: str, minutes: int, latest_ts: str = None,
+                                        oldest_ts: str = None):
+        params = set_conv_params(channel, minutes, latest_ts, oldest_ts)
+        try:
+            history = await self.client.conversations_history(**params)
+            return history
+        except SlackApiError as err:
+            if err.response.status_code == 429:
+                raise
+            logging.info(f"error loading conv. history: {err}")
+            return []
+
+    async def get_conversation_history(self, channel: str, minutes: int, oldest_ts: str = None):
+        history = await self._get_conversation_history(channel, minutes, oldest_ts=oldest_ts)
+        messages = list(history["messages"]) if history else []
+
+        while history and history.get("has_more"):
+            last_ts = history["messages"][-1]["ts"]
+            history = await self._get_conversation_history(
+                channel, minutes, last_ts, oldest_ts)
+            messages.extend(history["messages"] if history else [])
+        # inclusive pagination returns the boundary message twice
+        messages = list({message["ts"]: message for message in messages}.values())
+        logging.info(f"fetched {len(messages)} messages")
+        return messages
+
+    @async_api_rate_control("conversations.replies")
+    async def _get_conversation_replies(self, channel: str, minutes: int, ts: str,
+                                        cursor: str = None):
+        params = set_conv_params(channel, minutes)
+        params["ts"] = ts
+        if cursor:
+            params["cursor"] = cursor
+        try:
+            async with self.semaphore:
+                threads = await self.client.conversations_replies(**params)
+            return threads
+        except SlackApiError as err:
+            if err.response.status_code == 429:
+                raise
+            logging.info(f"error loading message replies: {err}")
+            return []
+
+    async def get_conversation_replies(self, channel: str, minutes: int, ts: str):
+        history = await self._get_conversation_replies(channel, minutes, ts)
+        replies = list(history["messages"]) if history else []
+
+        while history and history.get("has_more"):
+            cursor = history["response_metadata"]["next_cursor"]
+            history = await self._get_conversation_replies(
+                channel, minutes, ts, cursor)
+            replies.extend(history["messages"] if history else [])
+        if len(replies) > 1:
+            logging.info(f"fetched {len(replies)} replies for message {ts}")
+        return replies
+
+    async def get_conversations_replies(self, channel: str, minutes: int, threads: list):
+        # concurrency is bound by the semaphore, the rate by conversations.replies bucket
+        results = await asyncio.gather(*(self.get_conversation_replies(channel, minutes, ts)
+                                         for ts in threads))
+        logging.info(f"fetched replies for {len(threads)} threads, "
+                     f"rate limit levels: {self.get_rate_limit_levels()}")
+        return dict(zip(threads, results))
+
+    def get_rate_limit_levels(self):
+        return {method: round(bucket.level, 2)
+                for method, bucket in self.rate_limits.items()}
+
+
+class SlackThreadIndex:
+    """ Slack Thread Index class """
+
+    def __init__(self):
+        # thread ts -> latest reply ts and replies carrying pull requests
+        self.threads = {}
+
+    def get_replies(self, message: dict):
+        if not message.get("reply_count"):
+            logging.debug(f"message {message['ts']} has no replies")
+            return [message]
+
+        thread = self.threads.get(message["ts"])
+        if thread and thread["latest_reply"] == message.get("latest_reply"):
+            logging.debug(f"thread {message['ts']} has no new replies")
+            # the parent message from history is always the most recent one
+            return [message] + [reply for reply in thread["replies"]
+                                if reply["ts"] != message["ts"]]
+        return None
+
+    def update(self, message: dict, replies: list):
+        if not message.get("reply_count"):
+            return
+        self.threads[message["ts"]] = {
+            "latest_reply": message.get("latest_reply"),
+            "replies": replies
+        }
+
+    def discard(self, thread_ts: str):
+        self.threads.pop(thread_ts, None)
+
+    def prune(self, oldest_ts: str):
+        expired = [ts for ts in self.threads if float(ts) < float(oldest_ts)]
+        for ts in expired:
+            del self.threads[ts]
+        if expired:
+            logging.info(f"removed {len(expired)} expired threads from index")
@@ -0,0 +1,64 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from traceback import format_exc
+import hashlib
+import hmac
+import json
+import logging
+
+
+def verify_signature(secret: str, body: bytes, signature: str):
+    if not signature or not signature.startswith("sha256="):
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(f"sha256={digest}", signature)
+
+
+class GitHubWebhookServer:
+    """ GitHub Webhook Server class """
+
+    def __init__(self, port: int, secret: str, listener, host: str = "0.0.0.0"):
+        self.secret = secret
+        self.listener = listener
+
+        webhook_server = self
+
+        class RequestHandler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not verify_signature(webhook_server.secret, body,
+                                        self.headers.get("X-Hub-Signature-256")):
+                    logging.warning("webhook signature verification failed")
+                    self.send_response(401)
+                    self.end_headers()
+                    return
+                try:
+                    payload = json.loads(body)
+                except ValueError:
+                    self.send_response(400)
+                    self.end_headers()
+                    return
+
+                self.send_response(204)
+                self.end_headers()
+                event = self.headers.get("X-GitHub-Event")
+                logging.info(f"received github webhook event {event}")
+                try:
+                    webhook_server.listener(event, payload)
+                except Exception:
+                    logging.error(format_exc())
+
+            def log_message(self, format, *args):
+                logging.debug(f"webhook request: {format % args}")
+
+        self.server = ThreadingHTTPServer((host, port), RequestHandler)
+        self.thread = Thread(target=self.server.serve_forever,
+                             name="github webhooks", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        logging.info(f"listening for github webhooks on port {self.server.server_port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -1,56 +1,517 @@
 from clients import SlackClient, GitHubClient
-from clients import LocalCacheClient
-from utils import get_arguments, SafeScheduler
+from clients.slack import set_oldest_ts, SlackThreadIndex
+from clients import LocalCacheClient, SlackHistoryCursor
+from clients import GitHubWebhookServer
+from clients import ChannelLeaseCoordinator, LEASE_BACKENDS
+from utils import get_arguments, get_channels, SafeScheduler, FairQueue
+from metrics import CYCLE_DURATION, CYCLE_MESSAGES, MESSAGES_SCANNED, QUEUE_DEPTH
+from metrics import start_metrics_server
+from clients import AsyncSlackClient, AsyncGitHubClient
 from processors import MessageApproved, MessageMerged
-from processors.helpers import get_pull_requests, get_reactions
+from processors import AsyncMessageApproved, AsyncMessageMerged
+from processors import PullRequestStateService, PullRequestPollingSchedule
+from processors import AsyncPullRequestStateService
+from processors import ReactionWriter
+from processors.helpers import get_pull_requests, get_reactions, message_cache
+from queue import Empty
 from threading import Thread
-import queue
+import asyncio
+import atexit
 import logging
+import signal
+import sys
 import time
 
 
-class SlackMessageThread(Thread):
-    def __init__(self, slack_client, config, queue_req_approval, queue_req_merging):
-        super().__init__()
-        self.name = "slack messages"
+def is_actionable(message, reaction, state_service=None):
+    if get_reactions(message, reaction):
+        return False
+    if state_service:
+        return state_service.terminal_index.is_message_actionable(
+            reaction, message["channel"], message["ts"])
+    return True
 
+
+class SlackChannelScanner:
+    """ Slack Channel Scanner class """
+
+    def __init__(self, config, channel, history_cursor=None, thread_index=None,
+                 state_service=None):
+        self.args_config = config
+        self.channel = channel
+        self.history_cursor = history_cursor
+        self.thread_index = thread_index
+        self.state_service = state_service
+
+        self.messages_approval = []
+        self.messages_merging = []
+        self.messages_scanned = 0
+
+    def is_due(self, message, kind):
+        if not self.state_service:
+            return True
+        return any(self.state_service.is_due(f"{pull_request.api_route}/{kind}")
+                   for pull_request in get_pull_requests(message))
+
+    def dispatch(self, message):
+        if self.state_service:
+            for pull_request in get_pull_requests(message):
+                self.state_service.message_index.add(pull_request.api_route, message)
+
+        is_pending = False
+        if is_actionable(message, self.args_config.approved_reaction_name,
+                         self.state_service):
+            if self.is_due(message, "reviews"):
+                self.messages_approval.append(message)
+            is_pending = True
+        if is_actionable(message, self.args_config.merged_reaction_name,
+                         self.state_service):
+            if self.is_due(message, "details"):
+                self.messages_merging.append(message)
+            is_pending = True
+        return is_pending
+
+    def get_prefetch_params(self):
+        # api route -> pull request params
+        pull_requests = {}
+        for message in self.messages_approval + self.messages_merging:
+            for pull_request in get_pull_requests(message):
+                pull_requests[pull_request.api_route] = pull_request.params
+        return pull_requests
+
+    def scan_replies(self, message_replies):
+        pull_request_replies = []
+        is_pending = False
+        self.messages_scanned += len(message_replies)
+        for reply in message_replies:
+            # processors react in the channel the message was read from
+            reply["channel"] = self.channel
+            if not get_pull_requests(reply):
+                continue
+            pull_request_replies.append(reply)
+            if self.dispatch(reply):
+                is_pending = True
+        return is_pending, pull_request_replies
+
+    def get_oldest_ts(self):
+        if self.history_cursor:
+            return self.history_cursor.get_oldest_ts()
+        return None
+
+    def get_threads(self, messages, full_sync):
+        # returns replies known from the thread index and threads to fetch
+        message_replies = {}
+        if self.thread_index:
+            for message in messages:
+                replies = self.thread_index.get_replies(message)
+                if replies is not None:
+                    message_replies[message["ts"]] = replies
+
+        threads = [message["ts"] for message in messages
+                   if message["ts"] not in message_replies]
+        if self.history_cursor and not full_sync:
+            # messages and threads which are still waiting for reactions
+            scanned = {message["ts"] for message in messages}
+            for ts, message in self.history_cursor.pending.items():
+                if ts in scanned:
+                    continue
+                replies = self.get_pending_replies(message)
+                if replies is None:
+                    threads.append(ts)
+                else:
+                    message_replies[ts] = replies
+        return message_replies, threads
+
+    def get_pending_replies(self, message):
+        # stored messages without a thread are evaluated again from their payload,
+        # threads are only fetched when the thread index doesn't know them
+        if not message:
+            return None
+        if self.thread_index:
+            return self.thread_index.get_replies(message)
+        return None if message.get("reply_count") else [message]
+
+    def scan(self, messages, message_replies):
+        # returns ts -> parent message of messages and threads waiting for reactions
+        pending = {}
+        for message in messages:
+            is_pending, pull_request_replies = self.scan_replies(
+                message_replies.pop(message["ts"]))
+            if is_pending:
+                pending[message["ts"]] = message
+            if self.thread_index:
+                # only settled threads are served from the index
+                if is_pending:
+                    self.thread_index.discard(message["ts"])
+                else:
+                    self.thread_index.update(message, pull_request_replies)
+
+        for thread_ts, replies in message_replies.items():
+            is_pending, _ = self.scan_replies(replies)
+            if is_pending:
+                # replies start with the parent message
+                pending[thread_ts] = next((reply for reply in replies
+                                           if reply["ts"] == thread_ts), None)
+        return pending
+
+    def enqueue(self, queue_req_approval, queue_req_merging):
+        # newest messages first, they are the most likely to change
+        for message in sorted(self.messages_approval,
+                              key=lambda item: float(item["ts"]), reverse=True):
+            queue_req_approval.put(message)
+        for message in sorted(self.messages_merging,
+                              key=lambda item: float(item["ts"]), reverse=True):
+            queue_req_merging.put(message)
+
+    def update(self, messages, pending, full_sync):
+        oldest_window_ts = set_oldest_ts(self.args_config.slack_time_window_minutes)
+        if self.thread_index:
+            self.thread_index.prune(oldest_window_ts)
+        if self.history_cursor:
+            self.history_cursor.update(messages, pending,
+                                       oldest_window_ts, full_sync)
+
+    def cleanup(self):
+        oldest_window_ts = set_oldest_ts(self.args_config.slack_time_window_minutes)
+        message_cache.prune(oldest_window_ts)
+        if self.state_service:
+            self.state_service.message_index.prune(oldest_window_ts)
+            self.state_service.terminal_index.prune(oldest_window_ts)
+            self.state_service.terminal_index.flush()
+
+
+class SlackMessageThread(SlackChannelScanner, Thread):
+    def __init__(self, slack_client, config, channel, history_cursor=None, thread_index=None,
+                 state_service=None):
+        SlackChannelScanner.__init__(self, config, channel, history_cursor, thread_index,
+                                     state_service)
+        Thread.__init__(self)
+        self.name = f"slack messages {channel}"
+
+        self.client = slack_client
+        # set once the channel was scanned
+        self.scan_result = None
+
+    def run(self):
+        oldest_ts = self.get_oldest_ts()
+        full_sync = oldest_ts is None
+
+        messages = self.client.get_conversation_history(
+            self.channel,
+            self.args_config.slack_time_window_minutes,
+            oldest_ts)
+
+        message_replies, threads = self.get_threads(messages, full_sync)
+        message_replies.update(self.client.get_conversations_replies(
+            self.channel,
+            self.args_config.slack_time_window_minutes,
+            threads,
+            self.args_config.slack_reply_workers))
+        pending = self.scan(messages, message_replies)
+        # queued by run_threaded once all channels are scanned
+        self.scan_result = (messages, pending, full_sync)
+
+
+class AsyncSlackChannelScanner(SlackChannelScanner):
+    """ Async Slack Channel Scanner class """
+
+    async def run(self, slack_client):
+        oldest_ts = self.get_oldest_ts()
+        full_sync = oldest_ts is None
+
+        messages = await slack_client.get_conversation_history(
+            self.channel,
+            self.args_config.slack_time_window_minutes,
+            oldest_ts)
+
+        message_replies, threads = self.get_threads(messages, full_sync)
+        message_replies.update(await slack_client.get_conversations_replies(
+            self.channel,
+            self.args_config.slack_time_window_minutes,
+            threads))
+        pending = self.scan(messages, message_replies)
+        # cursors are saved to the local cache, off the event loop
+        await asyncio.to_thread(self.update, messages, pending, full_sync)
+
+
+class AsyncPipeline:
+    """ Async Pipeline class """
+
+    def __init__(self, slack_client, github_client, config, channels, state_service,
+                 channel_weights=None, shard_coordinator=None, reaction_writer=None):
+        # channels - channel id -> (history cursor, thread index)
+        self.slack_client = slack_client
+        self.github_client = github_client
+        self.args_config = config
+        self.channels = channels
+        self.channel_weights = channel_weights
+        self.state_service = state_service
+        self.shard_coordinator = shard_coordinator
+
+        self.processor_approved = AsyncMessageApproved(slack_client, state_service, config,
+                                                       reaction_writer)
+        self.processor_merged = AsyncMessageMerged(slack_client, state_service, config,
+                                                   reaction_writer)
+
+    async def process(self, processor, worker_queue):
+        while True:
+            try:
+                message = worker_queue.get_nowait()
+            except Empty:
+                return
+            try:
+                await processor.process(message)
+            except Exception:
+                logging.exception(f"unable to process message {message['ts']}")
+
+    async def run_cycle(self):
+        channels = self.channels
+        if self.shard_coordinator:
+            owned = self.shard_coordinator.get_channels()
+            channels = {channel: channel_state for channel, channel_state in channels.items()
+                        if channel in owned}
+            if not channels:
+                logging.info("no channels are leased to this replica")
+                return 0
+        await self.slack_client.open()
+        await self.github_client.open()
+        self.state_service.new_cycle()
+
+        with CYCLE_DURATION.time():
+            scanners = [AsyncSlackChannelScanner(self.args_config,
+                                                 channel,
+                                                 history_cursor,
+                                                 thread_index,
+                                                 self.state_service)
+                        for channel, (history_cursor, thread_index) in channels.items()]
+            await asyncio.gather(*(scanner.run(self.slack_client) for scanner in scanners))
+
+            if self.args_config.github_graphql_batch_size:
+                pull_requests = {}
+                for scanner in scanners:
+                    pull_requests.update(scanner.get_prefetch_params())
+                if pull_requests:
+                    await self.state_service.prefetch_async(
+                        pull_requests, self.args_config.github_graphql_batch_size)
+
+            # channels take turns (by weight) for the limited concurrency
+            queue_req_approval = FairQueue(key=lambda message: message["channel"],
+                                           weights=self.channel_weights)
+            queue_req_merging = FairQueue(key=lambda message: message["channel"],
+                                          weights=self.channel_weights)
+            for scanner in scanners:
+                scanner.enqueue(queue_req_approval, queue_req_merging)
+            await asyncio.gather(
+                *(self.process(self.processor_approved, queue_req_approval)
+                  for _ in range(self.args_config.async_concurrency)),
+                *(self.process(self.processor_merged, queue_req_merging)
+                  for _ in range(self.args_config.async_concurrency)))
+            await asyncio.to_thread(scanners[0].cleanup)
+
+        messages_scanned = sum(scanner.messages_scanned for scanner in scanners)
+        CYCLE_MESSAGES.set(messages_scanned)
+        MESSAGES_SCANNED.inc(messages_scanned)
+        return messages_scanned
+
+
+class SlackEventHandler:
+    """ Slack Events handler class """
+
+    def __init__(self, slack_client, config, queue_req_approval, queue_req_merging,
+                 state_service=None, shard_coordinator=None):
         self.client = slack_client
         self.args_config = config
+        self.state_service = state_service
+        self.shard_coordinator = shard_coordinator
+        self.channels = get_channels(config.slack_channel_id)
 
         self.queue_req_approval = queue_req_approval
         self.queue_req_merging = queue_req_merging
 
-    def run(self):
-        messages = self.client.get_conversation_history(
-            self.args_config.slack_channel_id,
-            self.args_config.slack_time_window_minutes)
-        for message in messages:
-            message_replies = self.client.get_conversation_replies(
-                self.args_config.slack_channel_id,
-                self.args_config.slack_time_window_minutes,
-                message["ts"])
+    def is_watched(self, channel):
+        if channel not in self.channels:
+            return False
+        return not self.shard_coordinator or self.shard_coordinator.is_owned(channel)
+
+    def get_message(self, event):
+        if event.get("type") == "message":
+            if not self.is_watched(event.get("channel")):
+                return None
+            if event.get("subtype") == "message_changed":
+                return {**event.get("message", {}), "channel": event["channel"]}
+            if event.get("subtype") in (None, "thread_broadcast"):
+                return event
+            return None
+
+        if event.get("type") in ("reaction_added", "reaction_removed"):
+            item = event.get("item", {})
+            if item.get("type") != "message" or not self.is_watched(item.get("channel")):
+                return None
+            # only our own reactions change what the processors do with a message
+            if event.get("reaction") not in (self.args_config.approved_reaction_name,
+                                             self.args_config.merged_reaction_name):
+                return None
+            if event["type"] == "reaction_added":
+                # added by someone else (or by the reaction writer), the message is done
+                if self.state_service:
+                    self.state_service.terminal_index.mark_reacted(
+                        event["reaction"], item["channel"], item["ts"])
+                return None
+            if self.state_service:
+                self.state_service.terminal_index.unmark_reacted(
+                    event["reaction"], item["channel"], item["ts"])
+            message = self.client.get_message(item["channel"],
+                                              self.args_config.slack_time_window_minutes,
+                                              item["ts"])
+            return {**message, "channel": item["channel"]} if message else None
+        return None
+
+    def __call__(self, event):
+        logging.debug(f"received slack event {event.get('type')}")
+        message = self.get_message(event)
+        if not message or not get_pull_requests(message):
+            return
+
+        logging.info(f"message {message['ts']} was changed, queueing it")
+        if self.state_service:
+            for pull_request in get_pull_requests(message):
+                self.state_service.message_index.add(pull_request.api_route, message)
+        if is_actionable(message, self.args_config.approved_reaction_name,
+                         self.state_service):
+            self.queue_req_approval.put(message)
+        if is_actionable(message, self.args_config.merged_reaction_name,
+                         self.state_service):
+            self.queue_req_merging.put(message)
+
+
+class GitHubWebhookHandler:
+    """ GitHub Webhooks handler class """
+
+    def __init__(self, config, queue_req_approval, queue_req_merging, state_service,
+                 shard_coordinator=None):
+        self.args_config = config
+        self.state_service = state_service
+        self.shard_coordinator = shard_coordinator
+
+        self.queue_req_approval = queue_req_approval
+        self.queue_req_merging = queue_req_merging
+
+    def enqueue(self, api_route, reaction, worker_queue):
+        for message in self.state_service.message_index.get(api_route):
+            if self.shard_coordinator and \
+                    not self.shard_coordinator.is_owned(message["channel"]):
+                continue
+            if is_actionable(message, reaction, self.state_service):
+                logging.info(f"queueing message {message['ts']} referencing {api_route}")
+                worker_queue.put(message)
+
+    def __call__(self, event, payload):
+        pull_request = payload.get("pull_request")
+        if not pull_request:
+            return
+        repository = payload["repository"]
+        api_route = f"repos/" \
+                    f"{repository['owner']['login']}/" \
+                    f"{repository['name']}/" \
+                    f"pulls/{pull_request['number']}"
+        terminal_index = self.state_service.terminal_index
+
+        if event == "pull_request" and payload.get("action") == "closed":
+            terminal_index.mark(api_route, "details",
+                                "merged" if pull_request.get("merged") else "closed")
+            self.state_service.invalidate(f"{api_route}/details")
+            self.enqueue(api_route, self.args_config.merged_reaction_name,
+                         self.queue_req_merging)
+            if not pull_request.get("merged"):
+                self.enqueue(api_route, self.args_config.approved_reaction_name,
+                             self.queue_req_approval)
+
+        elif event == "pull_request" and payload.get("action") == "reopened":
+            terminal_index.unmark(api_route, "details")
+            terminal_index.unmark(api_route, "reviews")
+            self.state_service.invalidate(f"{api_route}/details")
+            self.state_service.invalidate(f"{api_route}/reviews")
+            for message in self.state_service.message_index.get(api_route):
+                for reaction in (self.args_config.approved_reaction_name,
+                                 self.args_config.merged_reaction_name):
+                    terminal_index.unmark_message(reaction, message["channel"], message["ts"])
+            self.enqueue(api_route, self.args_config.approved_reaction_name,
+                         self.queue_req_approval)
+            self.enqueue(api_route, self.args_config.merged_reaction_name,
+                         self.queue_req_merging)
+
+        elif event == "pull_request" and payload.get("action") == "synchronize":
+            # a new head no longer matches a known approval
+            terminal_index.set_head(api_route, pull_request.get("head", {}).get("sha"))
+            self.state_service.invalidate(f"{api_route}/reviews")
+
+        elif event == "pull_request_review":
+            self.state_service.invalidate(f"{api_route}/reviews")
+            if payload.get("action") == "submitted" and \
+                    payload.get("review", {}).get("state", "").upper() == "APPROVED":
+                # the reviews fetch decides whether the approval applies to the head
+                self.enqueue(api_route, self.args_config.approved_reaction_name,
+                             self.queue_req_approval)
+            elif payload.get("action") in ("submitted", "dismissed"):
+                # a later review or dismissal overrides a known approval
+                terminal_index.unmark(api_route, "reviews")
 
-            for reply in message_replies:
-                pull_requests = get_pull_requests(reply)
 
-                if pull_requests and not get_reactions(
-                        reply, self.args_config.approved_reaction_name):
-                    self.queue_req_approval.put(reply)
-                if pull_requests and not get_reactions(
-                        reply, self.args_config.merged_reaction_name):
-                    self.queue_req_merging.put(reply)
+def run_threaded(slack_client, config, queue_req_approval, queue_req_merging,
+                 channels, state_service=None, shard_coordinator=None):
+    # channels - channel id -> (history cursor, thread index)
+    if shard_coordinator:
+        owned = shard_coordinator.get_channels()
+        channels = {channel: channel_state for channel, channel_state in channels.items()
+                    if channel in owned}
+        if not channels:
+            logging.info("no channels are leased to this replica")
+            return 0
+    if state_service:
+        # pull requests cross-posted to several channels are resolved once per cycle
+        state_service.new_cycle()
 
-        self.queue_req_approval.join()
-        self.queue_req_merging.join()
+    with CYCLE_DURATION.time():
+        message_threads = [SlackMessageThread(slack_client,
+                                              config,
+                                              channel,
+                                              history_cursor,
+                                              thread_index,
+                                              state_service)
+                           for channel, (history_cursor, thread_index) in channels.items()]
+        for message_thread in message_threads:
+            message_thread.start()
+        for message_thread in message_threads:
+            message_thread.join()
+        scanned_threads = [message_thread for message_thread in message_threads
+                           if message_thread.scan_result]
 
+        if state_service and config.github_graphql_batch_size:
+            # one prefetch for all channels, cross-posted pull requests are queried once
+            pull_requests = {}
+            for message_thread in scanned_threads:
+                pull_requests.update(message_thread.get_prefetch_params())
+            if pull_requests:
+                state_service.prefetch(pull_requests, config.github_graphql_batch_size)
+        for message_thread in scanned_threads:
+            message_thread.enqueue(queue_req_approval, queue_req_merging)
+            message_thread.update(*message_thread.scan_result)
 
-def run_threaded(slack_client, config, queue_req_approval, queue_req_merging):
-    message_thread = SlackMessageThread(slack_client,
-                                        config,
-                                        queue_req_approval,
-                                        queue_req_merging)
-    message_thread.start()
-    message_thread.join()
+        queue_req_approval.join()
+        queue_req_merging.join()
+        if message_threads:
+            message_threads[0].cleanup()
+
+    messages_scanned = sum(message_thread.messages_scanned
+                           for message_thread in message_threads)
+    CYCLE_MESSAGES.set(messages_scanned)
+    MESSAGES_SCANNED.inc(messages_scanned)
+    return messages_scanned
+
+
+def run_asyncio(loop, pipeline):
+    # the loop outlives cycles, client sessions are bound to it
+    return loop.run_until_complete(pipeline.run_cycle())
 
 
 def main():
@@ -64,31 +525,162 @@ def main():
     scheduler = SafeScheduler(reschedule_on_failure=True)
 
     slack_client = SlackClient(args.slack_api_token,
-                               max_retries=args.max_retries)
+                               max_retries=args.max_retries,
+                               base_url=args.slack_api_url)
     github_client = GitHubClient(args.github_api_token,
-                                 max_retries=args.max_retries)
+                                 api_host=args.github_api_url,
+                                 max_retries=args.max_retries,
+                                 graphql_url=args.github_graphql_url,
+                                 quota_reserve=args.github_quota_reserve,
+                                 pool_size=max(10, args.approval_workers + args.merge_workers))
+
+    local_client = LocalCacheClient(args.cache_folder_path,
+                                    args.cache_backend,
+                                    args.cache_memory_max_entries,
+                                    args.cache_memory_max_bytes,
+                                    args.cache_memory_ttl_seconds)
+
+    channel_weights = get_channels(args.slack_channel_id)
+    channels = {}
+    for channel in channel_weights:
+        history_cursor = None
+        if args.slack_incremental_sync:
+            history_cursor = SlackHistoryCursor(local_client,
+                                                channel,
+                                                args.slack_full_sync_minutes)
+        thread_index = None
+        if not args.slack_disable_thread_index:
+            thread_index = SlackThreadIndex()
+        channels[channel] = (history_cursor, thread_index)
+
+    shard_coordinator = None
+    if args.shard_lease_path:
+        # replicas split channels between them through leases in a shared store
+        lease_backend = LEASE_BACKENDS[args.shard_backend](args.shard_lease_path)
+        shard_coordinator = ChannelLeaseCoordinator(lease_backend,
+                                                    args.shard_member_id,
+                                                    channel_weights,
+                                                    args.shard_lease_seconds,
+                                                    args.shard_heartbeat_seconds)
+        shard_coordinator.rebalance()
+        shard_coordinator.start()
+        # leases are released on shutdown instead of waiting for them to expire
+        atexit.register(shard_coordinator.stop)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    polling_schedule = None
+    if args.adaptive_polling:
+        polling_schedule = PullRequestPollingSchedule(
+            args.sleep_period_minutes * 60,
+            args.adaptive_polling_max_minutes * 60)
+    async_github_client = None
+    if args.engine == "asyncio":
+        # request budgets and rate limits are shared with the threaded clients
+        async_github_client = AsyncGitHubClient(args.github_api_token,
+                                                api_host=args.github_api_url,
+                                                max_retries=args.max_retries,
+                                                graphql_url=args.github_graphql_url,
+                                                quota_reserve=args.github_quota_reserve,
+                                                max_concurrency=args.async_concurrency,
+                                                budgets=github_client.budgets)
+        state_service = AsyncPullRequestStateService(github_client,
+                                                     local_client,
+                                                     polling_schedule,
+                                                     args.github_reviews_last_page_first,
+                                                     async_github_client,
+                                                     args.closed_recheck_minutes * 60)
+    else:
+        state_service = PullRequestStateService(github_client,
+                                                local_client,
+                                                polling_schedule,
+                                                args.github_reviews_last_page_first,
+                                                args.closed_recheck_minutes * 60)
+
+    # reactions are written by a single paced thread, processors only queue them
+    reaction_writer = ReactionWriter(slack_client, state_service, args.dry_run)
+    reaction_writer.start()
+
+    # channels take turns (by weight) so a noisy one can't starve the others
+    queue_req_approval = FairQueue(key=lambda message: message["channel"],
+                                   weights=channel_weights)
+    queue_req_merging = FairQueue(key=lambda message: message["channel"],
+                                  weights=channel_weights)
+    QUEUE_DEPTH.labels("approval").set_function(queue_req_approval.qsize)
+    QUEUE_DEPTH.labels("merging").set_function(queue_req_merging.qsize)
+    QUEUE_DEPTH.labels("reactions").set_function(reaction_writer.worker_queue.qsize)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
 
-    local_client = LocalCacheClient(args.cache_folder_path)
+    # every processor runs a pool of workers draining the same queue
+    for index in range(args.approval_workers):
+        processor_approved = MessageApproved(slack_client,
+                                             github_client,
+                                             local_client,
+                                             args,
+                                             queue_req_approval,
+                                             state_service,
+                                             reaction_writer)
+        processor_approved.name = f"{processor_approved.name}-{index + 1}"
+        processor_approved.start()
 
-    queue_req_approval = queue.Queue()
-    queue_req_merging = queue.Queue()
+    for index in range(args.merge_workers):
+        processor_merged = MessageMerged(slack_client,
+                                         github_client,
+                                         local_client,
+                                         args,
+                                         queue_req_merging,
+                                         state_service,
+                                         reaction_writer)
+        processor_merged.name = f"{processor_merged.name}-{index + 1}"
+        processor_merged.start()
 
-    processors_approved = MessageApproved(slack_client,
-                                          github_client,
-                                          local_client,
-                                          args,
-                                          queue_req_approval)
-    processors_approved.start()
+    if args.slack_app_token:
+        # polling below keeps running as a periodic reconciliation
+        slack_client.start_socket_mode(args.slack_app_token,
+                                       SlackEventHandler(slack_client,
+                                                         args,
+                                                         queue_req_approval,
+                                                         queue_req_merging,
+                                                         state_service,
+                                                         shard_coordinator))
 
-    processors_merged = MessageMerged(slack_client,
-                                      github_client,
-                                      local_client,
-                                      args,
-                                      queue_req_merging)
-    processors_merged.start()
+    if args.github_webhook_port and args.github_webhook_secret:
+        webhook_server = GitHubWebhookServer(args.github_webhook_port,
+                                             args.github_webhook_secret,
+                                             GitHubWebhookHandler(args,
+                                                                  queue_req_approval,
+                                                                  queue_req_merging,
+                                                                  state_service,
+                                                                  shard_coordinator))
+        webhook_server.start()
+    elif args.github_webhook_port:
+        logging.warning("github webhooks require a secret, receiver is disabled")
 
-    scheduler.every(args.sleep_period_minutes).minutes.do(
-        run_threaded, slack_client, args, queue_req_approval, queue_req_merging)
+    if args.engine == "asyncio":
+        # socket mode and webhooks keep using the threaded processors
+        async_slack_client = AsyncSlackClient(args.slack_api_token,
+                                              max_retries=args.max_retries,
+                                              base_url=args.slack_api_url,
+                                              max_concurrency=args.slack_reply_workers,
+                                              rate_limits=slack_client.rate_limits)
+        pipeline = AsyncPipeline(async_slack_client,
+                                 async_github_client,
+                                 args,
+                                 channels,
+                                 state_service,
+                                 channel_weights,
+                                 shard_coordinator,
+                                 reaction_writer)
+        scheduler.every(args.sleep_period_minutes).minutes.do(
+            run_asyncio, asyncio.new_event_loop(), pipeline)
+    else:
+        scheduler.every(args.sleep_period_minutes).minutes.do(
+            run_threaded, slack_client, args, queue_req_approval, queue_req_merging,
+            channels, state_service, shard_coordinator)
+    scheduler.every(args.cache_gc_minutes).minutes.do(
+        local_client.collect_garbage,
+        args.slack_time_window_minutes * 60 if args.slack_time_window_minutes else None,
+        args.cache_gc_batch_size)
     scheduler.run_all()
     while True:
         scheduler.run_pending()
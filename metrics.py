@@ -0,0 +1,56 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+import logging
+
+CYCLE_DURATION = Histogram(
+    "pr_vigilante_cycle_duration_seconds",
+    "Duration of a Slack scan cycle including processing of queued messages",
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+CYCLE_MESSAGES = Gauge(
+    "pr_vigilante_cycle_messages_scanned",
+    "Messages scanned during the last cycle")
+MESSAGES_SCANNED = Counter(
+    "pr_vigilante_messages_scanned_total",
+    "Messages scanned for pull request links")
+QUEUE_DEPTH = Gauge(
+    "pr_vigilante_queue_depth",
+    "Messages waiting in a processor queue",
+    ["queue"])
+PROCESSING_DURATION = Histogram(
+    "pr_vigilante_processing_duration_seconds",
+    "Time spent by a processor on a single message",
+    ["processor"])
+
+SLACK_API_CALLS = Counter(
+    "pr_vigilante_slack_api_calls_total",
+    "Slack Web API calls",
+    ["method", "status"])
+GITHUB_API_CALLS = Counter(
+    "pr_vigilante_github_api_calls_total",
+    "GitHub API calls",
+    ["method", "status"])
+GITHUB_CONDITIONAL_REQUESTS = Counter(
+    "pr_vigilante_github_conditional_requests_total",
+    "GitHub conditional requests by result (hit - 304 Not Modified)",
+    ["result"])
+GITHUB_RATE_LIMIT_REMAINING = Gauge(
+    "pr_vigilante_github_rate_limit_remaining",
+    "Remaining GitHub API quota",
+    ["resource"])
+SLACK_RATE_LIMIT_LEVEL = Gauge(
+    "pr_vigilante_slack_rate_limit_level",
+    "Fill level of the Slack method token bucket (0-1)",
+    ["method"])
+THROTTLED_SECONDS = Counter(
+    "pr_vigilante_throttled_seconds_total",
+    "Time spent waiting because of API rate limits",
+    ["api"])
+
+CACHE_LOOKUPS = Counter(
+    "pr_vigilante_cache_lookups_total",
+    "Cache lookups by result (memory, backend, miss)",
+    ["result"])
+
+
+def start_metrics_server(port: int):
+    start_http_server(port)
+    logging.info(f"serving metrics on port {port}")
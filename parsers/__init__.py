@@ -1,2 +1,3 @@
-from .github import PullRequestUrlParser, PullRequestDataParser
-from .slack import MessagePullRequestParser, MessageReactionsParser
+from .github import PullRequestRef, PullRequestDataParser, PullRequestStateParser
+from .github import get_reviews_projection, merge_reviews_projection
+from .slack import MessagePullRequestParser, MessageReactionsParser, get_pull_request_urls
@@ -1,33 +1,127 @@
+from threading import Lock
+from urllib import parse
+from weakref import WeakValueDictionary
 import logging
 import os.path
-from urllib import parse
 
 
-class PullRequestUrlParser:
-    """ Pull Request URL Parser """
+class PullRequestRef:
+    """ Pull Request reference class """
+
+    __slots__ = ("owner", "repo", "number", "api_route", "__weakref__")
 
-    def __init__(self, pull_request_url):
-        logging.info(f"parsing pull request url {pull_request_url} using {self.__class__.__name__}")
-        self.url = pull_request_url
+    # (owner, repo, number) -> reference, one object per pull request in the process
+    interned = WeakValueDictionary()
+    lock = Lock()
 
-        self.params = self.generate_pr_params()
-        if self.params:
-            logging.info(f"params: {self.params}")
-            self.api_route = f"repos/" \
-                             f"{self.params['repo_owner']}/" \
-                             f"{self.params['repo_name']}/" \
-                             f"pulls/{self.params['number']}"
+    def __new__(cls, owner: str, repo: str, number: int):
+        key = (owner, repo, int(number))
+        with cls.lock:
+            pull_request = cls.interned.get(key)
+            if pull_request is None:
+                pull_request = super().__new__(cls)
+                object.__setattr__(pull_request, "owner", key[0])
+                object.__setattr__(pull_request, "repo", key[1])
+                object.__setattr__(pull_request, "number", key[2])
+                object.__setattr__(pull_request, "api_route",
+                                   f"repos/{key[0]}/{key[1]}/pulls/{key[2]}")
+                cls.interned[key] = pull_request
+        return pull_request
 
-    def generate_pr_params(self):
-        url = parse.urlparse(self.url).path.split("/")
+    @classmethod
+    def from_url(cls, pull_request_url: str):
+        path = parse.urlparse(pull_request_url).path.split("/")
         try:
-            params = {"repo_owner": url[1], "repo_name": url[2], "number": url[4]}
-            logging.debug(f"url {self.url} params: {params}")
-            return params
-        except IndexError:
-            logging.warning(f"unable to generate params for {self.url}")
+            return cls(path[1], path[2], path[4])
+        except (IndexError, ValueError):
+            logging.warning(f"unable to generate params for {pull_request_url}")
             return None
 
+    @property
+    def params(self):
+        # keyword arguments of the GitHub client, a new dict callers may extend
+        return {"repo_owner": self.owner, "repo_name": self.repo, "number": self.number}
+
+    @property
+    def url(self):
+        return f"https://github.com/{self.owner}/{self.repo}/pull/{self.number}"
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{self.__class__.__name__} is immutable")
+
+    def __reduce__(self):
+        return self.__class__, (self.owner, self.repo, self.number)
+
+    def __eq__(self, other):
+        if not isinstance(other, PullRequestRef):
+            return NotImplemented
+        return (self.owner, self.repo, self.number) == (other.owner, other.repo, other.number)
+
+    def __hash__(self):
+        return hash((self.owner, self.repo, self.number))
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.owner}/{self.repo}#{self.number})"
+
+
+REVIEW_VALIDATORS = ("ETag", "Last-Modified")
+
+
+def merge_reviews_projection(projection: dict, pages: list, head_sha: str = None):
+    """ applies fetched review pages to a projection, reviews applied before are skipped by id """
+    # pages - (page number, response headers, reviews or None if the page was not modified),
+    # reviews are oldest first
+    reviewers = {login: dict(reviewer)
+                 for login, reviewer in (projection.get("reviewers") or {}).items()}
+    page_validators = list(projection.get("pages") or [])
+    last_review_id = projection.get("last_review_id") or 0
+
+    for page, headers, reviews in pages:
+        if reviews is None:
+            continue
+        if reviews or page == 1:
+            # empty pages past the end are probes, an empty listing still has validators
+            page_validators.extend({} for _ in range(page - len(page_validators)))
+            page_validators[page - 1] = {**{key: headers[key] for key in REVIEW_VALIDATORS
+                                            if headers.get(key)},
+                                         "count": len(reviews)}
+        for review in reviews:
+            state = review.get("state")
+            login = (review.get("user") or {}).get("login", "ghost")
+            review_id = review.get("id")
+            if review_id is not None and review_id <= last_review_id:
+                # refetched page, only a dismissal changes the effective review
+                reviewer = reviewers.get(login)
+                if reviewer and reviewer["id"] == review_id and reviewer["state"] != state:
+                    reviewer["state"] = state
+                continue
+            if review_id is not None:
+                last_review_id = review_id
+            if state == "PENDING":
+                continue
+            # comments don't override an approval or a change request
+            if state == "COMMENTED" and login in reviewers:
+                continue
+            reviewers[login] = {"state": state,
+                                "commit_id": review.get("commit_id"),
+                                "id": review_id}
+
+    # the reviews endpoint doesn't expose the head, only GraphQL states pass it in
+    return {"reviewers": reviewers,
+            "head_sha": head_sha,
+            "last_review_id": last_review_id,
+            "pages": page_validators}
+
+
+def get_reviews_projection(pages: list, head_sha: str = None):
+    """ returns the latest effective review state per reviewer and validators of every page """
+    # pages - (response headers, reviews) of a complete listing in page order
+    return merge_reviews_projection({}, [(page, headers, reviews) for page, (headers, reviews)
+                                         in enumerate(pages, start=1)], head_sha)
+
 
 class PullRequestDataParser:
     """ Pull Request Data Parser """
@@ -46,11 +140,74 @@ class PullRequestDataParser:
         logging.info("pull request is not merged")
         return False
 
-    def get_reviews_approved(self):
+    def get_details_closed(self):
+        if self.data and self.data.get("details"):
+            details = self.data.get("details")
+            if details.get("state") == "closed" and details["merged"] is not True:
+                logging.info("pull request is closed without merging")
+                return True
+        return False
+
+    def get_details_head_sha(self):
+        if self.data and self.data.get("details"):
+            return (self.data["details"].get("head") or {}).get("sha")
+        return None
+
+    def get_reviewers(self):
+        # legacy cache entries keep raw review pages, they are projected on read
+        if self.data and "reviewers" in self.data:
+            return self.data["reviewers"]
         if self.data and self.data.get("reviews"):
-            states = [rev["state"] for review in self.data["reviews"] for rev in review["review"]]
-            if states and states[-1] == "APPROVED":
+            return get_reviews_projection([({}, page["review"])
+                                           for page in self.data["reviews"]])["reviewers"]
+        return {}
+
+    def get_reviews_pages(self):
+        # validators and review count of every page, legacy entries are fetched in full
+        if self.data and "reviewers" in self.data:
+            return self.data.get("pages") or []
+        return []
+
+    def get_reviews_approved_commit(self):
+        approvals = [reviewer for reviewer in self.get_reviewers().values()
+                     if reviewer["state"] == "APPROVED"]
+        if approvals:
+            return max(approvals, key=lambda reviewer: reviewer["id"] or 0)["commit_id"]
+        return None
+
+    def get_reviews_approved(self):
+        if self.data and self.data.get("review_decision"):
+            if self.data["review_decision"] == "APPROVED":
+                logging.info("pull request is approved")
+                return True
+        else:
+            states = {reviewer["state"] for reviewer in self.get_reviewers().values()}
+            if "APPROVED" in states and "CHANGES_REQUESTED" not in states:
                 logging.info("pull request is approved")
                 return True
         logging.info("pull request is not approved")
         return False
+
+
+class PullRequestStateParser:
+    """ Pull Request GraphQL State Parser """
+
+    def __init__(self, pull_request_state):
+        self.state = pull_request_state
+        if self.state:
+            logging.info(f"parsing pull request state using {self.__class__.__name__}")
+
+    def get_details(self):
+        # same shape as cached /pulls/<number> data
+        return {"details": {"merged": self.state["merged"],
+                            "state": self.state["state"].lower(),
+                            "head": {"sha": self.state.get("headRefOid")}}}
+
+    def get_reviews(self):
+        # same shape as cached /pulls/<number>/reviews data
+        reviews = [{"state": review["state"],
+                    "user": review.get("author"),
+                    "commit_id": (review.get("commit") or {}).get("oid")}
+                   for review in self.state["latestReviews"]["nodes"]]
+        return {"review_decision": self.state.get("reviewDecision"),
+                **get_reviews_projection([({}, reviews)], self.state.get("headRefOid"))}
@@ -2,69 +2,48 @@ import logging
 import re
 
 
-class MessageElementParser:
-    """ Slack Message Element Parser """
-
-    def __init__(self, message: dict):
-        logging.info(f"parsing {message.get('ts')} using {self.__class__.__name__}")
-        self.message = message
-
-        self.layout_blocks = [block for block in self.message["blocks"]] if "blocks" in self.message.keys() else []
-        self.elements = self.get_layout_elements()
-        if self.elements:
-            logging.info(f"message contains {len(self.elements)} elements")
-
-    def get_block_elements(self, message_block: dict, block_elements: [] = None):
-        block_elements = block_elements if block_elements else []
-
-        if message_block.get("elements"):
-            for block_element in message_block.get("elements"):
-                if "elements" not in block_element.keys():
-                    block_elements.append(block_element)
-                else:
-                    for element in block_element.get("elements"):
-                        if "elements" not in element.keys():
-                            block_elements.append(element)
-                        else:
-                            self.get_block_elements(element, block_elements)
-        return block_elements
-
-    def get_layout_elements(self):
-        if self.layout_blocks:
-            layout_elements = []
-            for layout_block in self.layout_blocks:
-                block_elements = self.get_block_elements(layout_block)
-                layout_elements.extend(block_elements)
-            logging.debug(f"message layout elements: {layout_elements}")
-            return layout_elements
-        else:
-            logging.info("message does not contain any layout elements")
-            return []
-
-
-class MessagePullRequestParser(MessageElementParser):
+PULL_REQUEST_URL = re.compile(r"https?://github\.com/[^/\s<>|]+/[^/\s<>|]+/pull/\d+")
+# message parts which can carry links: rich text / section blocks, mrkdwn text, attachments
+# and their fields
+LINK_KEYS = {"blocks", "elements", "fields", "text", "url", "pretext", "title_link", "from_url",
+             "value"}
+
+
+def get_pull_request_urls(message: dict):
+    """ yields pull request urls linked from message blocks, text and attachments, once each """
+    seen = set()
+    # iterative depth-first walk, nodes are pushed in reverse to keep document order
+    stack = [message.get("attachments"), message.get("text"), message.get("blocks")]
+    while stack:
+        node = stack.pop()
+        node_type = type(node)
+        if node_type is str:
+            if "github.com/" not in node:
+                # substring test is much cheaper than a regex scan of plain text
+                continue
+            for match in PULL_REQUEST_URL.finditer(node):
+                url = match.group()
+                if url not in seen:
+                    seen.add(url)
+                    yield url
+        elif node_type is dict:
+            for key, value in reversed(node.items()):
+                if key in LINK_KEYS and value:
+                    stack.append(value)
+        elif node_type is list:
+            stack.extend(reversed(node))
+
+
+class MessagePullRequestParser:
     """ Slack Message Pull Request parser """
 
     def __init__(self, message: dict):
-        super().__init__(message)
-        logging.info(f"parsing {message.get('ts')} using {self.__class__.__name__}")
+        logging.debug(f"parsing {message.get('ts')} using {self.__class__.__name__}")
+        self.message = message
 
-        self.urls = [message_element.get("url") for message_element in self.elements
-                     if message_element.get("type") == "link"]
-        self.pull_requests = self.get_pull_requests()
+        self.pull_requests = list(get_pull_request_urls(message))
         if self.pull_requests:
-            logging.info(f"message contains {len(self.pull_requests)} pull requests")
-
-    def get_pull_requests(self):
-        re_pattern = r"http[s]://github.com/.+/pull/\d+"
-        if self.urls:
-            urls = [match.group() for url in self.urls
-                    if (match := re.search(re_pattern, url))]
-            logging.debug(f"message pr urls: {urls}")
-            return urls
-        else:
-            logging.info("message does not contain pull requests")
-            return []
+            logging.debug(f"message contains {len(self.pull_requests)} pull requests")
 
 
 class MessageReactionsParser:
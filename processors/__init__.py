@@ -1,2 +1,5 @@
-from .approved import MessageApproved
-from .merged import MessageMerged
+from .approved import MessageApproved, AsyncMessageApproved
+from .merged import MessageMerged, AsyncMessageMerged
+from .state import PullRequestStateService, AsyncPullRequestStateService
+from .polling import PullRequestPollingSchedule
+from .reactions import ReactionWriter
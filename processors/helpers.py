@@ -1,22 +1,64 @@
 from parsers import MessagePullRequestParser
-from parsers import PullRequestUrlParser
+from parsers import PullRequestRef
 from parsers import MessageReactionsParser
-from threading import Thread
+from threading import Lock, Thread
 from clients import NoCachedData
+from .state import PullRequestStateService
+
+
+class MessageParseCache:
+    """ Message Parse Cache class """
+
+    def __init__(self):
+        # (channel, ts) -> (fingerprint, pull requests, reactions)
+        self.entries = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def get_fingerprint(message):
+        # edits and reaction changes are the only ways a message changes
+        reactions = frozenset(reaction.get("name") for reaction in message.get("reactions", []))
+        return message.get("edited", {}).get("ts"), hash(reactions)
+
+    def get(self, message):
+        key = (message.get("channel"), message.get("ts"))
+        fingerprint = self.get_fingerprint(message)
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry and entry[0] == fingerprint:
+            return entry[1], entry[2]
+
+        parser = MessagePullRequestParser(message)
+        # the same pull request linked twice (e.g. http and https) is one reference
+        pull_requests = list(dict.fromkeys(
+            pull_request for pull_request in map(PullRequestRef.from_url, parser.pull_requests)
+            if pull_request))
+        reactions = frozenset(MessageReactionsParser(message).reactions)
+        with self.lock:
+            self.entries[key] = (fingerprint, pull_requests, reactions)
+        return pull_requests, reactions
+
+    def prune(self, oldest_ts):
+        with self.lock:
+            for key in [key for key in self.entries
+                        if not key[1] or float(key[1]) < float(oldest_ts)]:
+                del self.entries[key]
+
+
+message_cache = MessageParseCache()
 
 
 def get_pull_requests(message):
-    parser = MessagePullRequestParser(message)
-    if parser.pull_requests:
-        return [PullRequestUrlParser(pr)
-                for pr in parser.pull_requests]
+    pull_requests, _ = message_cache.get(message)
+    if pull_requests:
+        return list(pull_requests)
     return
 
 
 def get_reactions(message, reaction):
-    parser = MessageReactionsParser(message)
-    if parser.reactions:
-        return parser.lookup_reaction(reaction)
+    _, reactions = message_cache.get(message)
+    if reactions:
+        return reaction in reactions
     return
 
 
@@ -29,7 +71,7 @@ def get_cached_data(local_client, _path):
 
 
 class PullRequestProcessorBase(Thread):
-    def __init__(self, slack_client, github_client, local_client):
+    def __init__(self, slack_client, github_client, local_client, state_service=None):
         super().__init__()
 
         self.daemon = True
@@ -37,5 +79,8 @@ class PullRequestProcessorBase(Thread):
         self.github_client = github_client
         self.local_client = local_client
 
+        self.state_service = state_service if state_service else \
+            PullRequestStateService(github_client, local_client)
+
     def run(self):
         pass
@@ -1,74 +1,103 @@
-from .helpers import get_pull_requests, get_cached_data
+from .helpers import get_pull_requests
 from .helpers import PullRequestProcessorBase
 from parsers import PullRequestDataParser
-from nested_lookup import nested_lookup
+from metrics import PROCESSING_DURATION
+import asyncio
 import logging
+import time
 
 
 class MessageMerged(PullRequestProcessorBase):
-    def __init__(self, slack_client, github_client, local_client, args_config, worker_queue):
-        super().__init__(slack_client, github_client, local_client)
+    def __init__(self, slack_client, github_client, local_client, args_config, worker_queue,
+                 state_service=None, reaction_writer=None):
+        super().__init__(slack_client, github_client, local_client, state_service)
 
         self.args_config = args_config
         self.worker_queue = worker_queue
+        self.reaction_writer = reaction_writer
 
         self.name = "IfMerged"
         self.reaction = self.args_config.merged_reaction_name
 
+    def process(self, message):
+        pull_request_states = []
+        is_actionable = True
+        pull_requests = get_pull_requests(message)
+
+        for pull_request in pull_requests:
+            pull_request_data = self.state_service.get_details(pull_request)
+            parser = PullRequestDataParser(pull_request_data)
+            if parser.get_details_closed():
+                is_actionable = False
+                break
+            pull_request_states.append(parser.get_details_merged())
+
+        if not is_actionable:
+            # closed pull requests never get merged
+            self.state_service.terminal_index.mark_message(
+                self.reaction, message["channel"], message["ts"])
+        elif all(state for state in pull_request_states):
+            if self.reaction_writer:
+                self.reaction_writer.put(message["channel"], self.reaction, message["ts"])
+            else:
+                self.slack_client.add_message_reaction(
+                    message["channel"],
+                    self.reaction,
+                    message["ts"],
+                    self.args_config.dry_run)
+
+            for pull_request in pull_requests:
+                self.state_service.delete_details(pull_request)
+
     def run(self):
         while True:
             message = self.worker_queue.get()
             if message is None:
                 break
+            time_start = time.monotonic()
+            try:
+                self.process(message)
+            except Exception:
+                logging.exception(f"unable to process message {message['ts']}")
+            finally:
+                PROCESSING_DURATION.labels("merging").observe(time.monotonic() - time_start)
+                self.worker_queue.task_done()
+
+
+class AsyncMessageMerged:
+    """ Async Message Merged class """
+
+    def __init__(self, slack_client, state_service, args_config, reaction_writer=None):
+        self.slack_client = slack_client
+        self.state_service = state_service
+        self.args_config = args_config
+        self.reaction_writer = reaction_writer
 
-            pull_request_states = []
-            pull_requests_cache = []
-            is_merged = False
-            pull_requests = get_pull_requests(message)
-
-            for pull_request in pull_requests:
-                local_cache_path = f"{pull_request.api_route}/details"
-                pull_requests_cache.append(local_cache_path)
-
-                local_cache_data = get_cached_data(self.local_client,
-                                                   local_cache_path)
-                if local_cache_data:
-                    parser = PullRequestDataParser(local_cache_data)
-                    is_merged = parser.get_details_merged()
-
-                if local_cache_data and is_merged:
-                    pull_request_states.append(is_merged)
-                    continue
-
-                if local_cache_data and not is_merged:
-                    last_modified = nested_lookup("Last-Modified", local_cache_data)
-                    pull_request.params.update({
-                        "last_modified": str(last_modified[-1])
-                    })
-                    logging.info(f"new pull request params: "
-                                 f"{pull_request.params}")
-
-                github_api_params = pull_request.params
-                pull_request_data = self.github_client.get_pull_request_details(
-                    **github_api_params)
-
-                if pull_request_data:
-                    parser = PullRequestDataParser(pull_request_data)
-                    is_merged = parser.get_details_merged()
-
-                    self.local_client.save(pull_request_data,
-                                           local_cache_path)
-
-                pull_request_states.append(is_merged)
+        self.reaction = self.args_config.merged_reaction_name
 
-            if all(state for state in pull_request_states):
-                self.slack_client.add_message_reaction(
-                    self.args_config.slack_channel_id,
+    async def process(self, message):
+        time_start = time.monotonic()
+        pull_requests = get_pull_requests(message)
+
+        parsers = [PullRequestDataParser(pull_request_data)
+                   for pull_request_data in await asyncio.gather(
+                       *(self.state_service.get_details_async(pull_request)
+                         for pull_request in pull_requests))]
+        if any(parser.get_details_closed() for parser in parsers):
+            # closed pull requests never get merged
+            self.state_service.terminal_index.mark_message(
+                self.reaction, message["channel"], message["ts"])
+        elif all(parser.get_details_merged() for parser in parsers):
+            if self.reaction_writer:
+                self.reaction_writer.put(message["channel"], self.reaction, message["ts"])
+            else:
+                await self.slack_client.add_message_reaction(
+                    message["channel"],
                     self.reaction,
                     message["ts"],
                     self.args_config.dry_run)
 
-                for cache_path in pull_requests_cache:
-                    self.local_client.delete(cache_path)
+            for pull_request in pull_requests:
+                await self.state_service.delete_details_async(pull_request)
 
-            self.worker_queue.task_done()
+        PROCESSING_DURATION.labels("merging").observe(time.monotonic() - time_start)
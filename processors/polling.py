@@ -0,0 +1,63 @@
+from threading import Lock
+import heapq
+import logging
+import time
+
+
+class PullRequestPollingSchedule:
+    """ Pull Request Polling Schedule class """
+
+    def __init__(self, base_interval, max_interval):
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+
+        # cache path -> (next check time, current interval, not checked since due)
+        self.entries = {}
+        # (next check time, cache path), outdated items are skipped on pop
+        self.queue = []
+        self.due = set()
+        self.lock = Lock()
+
+    def _push(self, cache_path, next_check, interval, is_provisional=False):
+        self.entries[cache_path] = (next_check, interval, is_provisional)
+        heapq.heappush(self.queue, (next_check, cache_path))
+
+    def new_cycle(self):
+        time_now = time.time()
+        with self.lock:
+            self.due = set()
+            while self.queue and self.queue[0][0] <= time_now:
+                next_check, cache_path = heapq.heappop(self.queue)
+                entry = self.entries.get(cache_path)
+                if not entry or entry[0] != next_check:
+                    continue
+                if entry[2]:
+                    # nobody checked it since it became due, its message is gone
+                    del self.entries[cache_path]
+                    continue
+                self.due.add(cache_path)
+                # keeps the entry scheduled in case it is not checked this cycle
+                self._push(cache_path, time_now + self.base_interval, entry[1], True)
+            logging.info(f"{len(self.due)} of {len(self.entries)} "
+                         f"scheduled pull requests are due")
+
+    def is_due(self, cache_path):
+        with self.lock:
+            return cache_path in self.due or cache_path not in self.entries
+
+    def record(self, cache_path, is_changed):
+        time_now = time.time()
+        with self.lock:
+            entry = self.entries.get(cache_path)
+            if is_changed or not entry:
+                interval = self.base_interval
+            else:
+                interval = min(entry[1] * 2, self.max_interval)
+            self._push(cache_path, time_now + interval, interval)
+            self.due.discard(cache_path)
+        logging.debug(f"next check of {cache_path} in {interval}s")
+
+    def discard(self, cache_path):
+        with self.lock:
+            self.entries.pop(cache_path, None)
+            self.due.discard(cache_path)
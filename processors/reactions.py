@@ -0,0 +1,57 @@
+from queue import Queue
+from threading import Lock, Thread
+import logging
+
+
+class ReactionWriter(Thread):
+    """ Reaction Writer class """
+
+    def __init__(self, slack_client, state_service, dry_run=False):
+        super().__init__()
+        self.name = "reactions"
+        self.daemon = True
+
+        self.slack_client = slack_client
+        self.state_service = state_service
+        self.dry_run = dry_run
+
+        self.worker_queue = Queue()
+        # (reaction, channel, message ts) queued or being written
+        self.pending = set()
+        self.lock = Lock()
+
+    def put(self, channel, reaction, ts):
+        key = (reaction, channel, ts)
+        with self.lock:
+            if key in self.pending:
+                return False
+            # applied in an earlier cycle, the scanned message may predate the reaction
+            if not self.state_service.terminal_index.is_message_actionable(reaction, channel, ts):
+                return False
+            self.pending.add(key)
+        self.worker_queue.put(key)
+        return True
+
+    def write(self, key):
+        reaction, channel, ts = key
+        # paced by the reactions.add token bucket, a 429 only holds back this thread
+        if self.slack_client.add_message_reaction(channel, reaction, ts, self.dry_run):
+            if not self.dry_run:
+                self.state_service.terminal_index.mark_reacted(reaction, channel, ts)
+
+    def join_queue(self):
+        self.worker_queue.join()
+
+    def run(self):
+        while True:
+            key = self.worker_queue.get()
+            if key is None:
+                break
+            try:
+                self.write(key)
+            except Exception:
+                logging.exception(f"unable to add reaction '{key[0]}' to message {key[2]}")
+            finally:
+                with self.lock:
+                    self.pending.discard(key)
+                self.worker_queue.task_done()
@@ -0,0 +1,542 @@
+from clients import NoCachedData
+from parsers import PullRequestDataParser, PullRequestStateParser, merge_reviews_projection
+from threading import Event, Lock
+from utils import KeyedLock
+import asyncio
+import logging
+import time
+
+
+class TerminalStateIndex:
+    """ Terminal State Index class """
+
+    def __init__(self, local_client, recheck_seconds=3600):
+        self.local_client = local_client
+        self.cache_path = "index"
+        self.file_name = "terminal.json"
+        # closed pull requests can be reopened, they are checked again after this period
+        self.recheck_seconds = recheck_seconds
+        self.lock = Lock()
+        self.is_dirty = False
+
+        try:
+            data = self.local_client.load(self.cache_path, self.file_name)
+        except NoCachedData:
+            data = {}
+        # api route -> {"details": merged / closed, "reviews": approved,
+        #               "sha": approved commit, "head_sha": last known head, ...}
+        self.pull_requests = data.get("pull_requests", {})
+        # "<reaction>/<channel>/<message ts>" of messages which already got the reaction
+        self.messages = data.get("messages", {})
+        # "<reaction>/<channel>/<message ts>" -> [message ts, checked at] of messages
+        # referencing closed pull requests
+        self.skipped = data.get("skipped", {})
+
+    def get(self, api_route):
+        with self.lock:
+            return dict(self.pull_requests.get(api_route, {}))
+
+    def is_stale(self, entry):
+        checked_at = entry.get("checked_at", entry.get("decided_at", 0))
+        return time.time() - checked_at >= self.recheck_seconds
+
+    def get_closed(self, api_route):
+        # closed is answered until it is due for a check, reopened pull requests get unmarked
+        entry = self.get(api_route)
+        return entry.get("details") == "closed" and not self.is_stale(entry)
+
+    def get_approved(self, api_route):
+        # an approval is only final while it covers the head of the pull request
+        entry = self.get(api_route)
+        return entry.get("reviews") == "approved" and \
+            entry.get("sha") is not None and entry.get("head_sha") == entry["sha"]
+
+    def mark(self, api_route, kind, state, sha=None):
+        with self.lock:
+            entry = self.pull_requests.setdefault(api_route, {})
+            entry["checked_at"] = time.time()
+            if entry.get(kind) == state and (not sha or entry.get("sha") == sha):
+                return
+            entry.update({kind: state, "decided_at": time.time()})
+            if sha:
+                entry["sha"] = sha
+            self.is_dirty = True
+        logging.info(f"pull request {api_route} {kind} state is {state}")
+
+    def set_head(self, api_route, head_sha):
+        # heads are only tracked for pull requests with a terminal state
+        with self.lock:
+            entry = self.pull_requests.get(api_route)
+            if not entry or not head_sha or entry.get("head_sha") == head_sha:
+                return
+            entry["head_sha"] = head_sha
+            self.is_dirty = True
+        logging.info(f"pull request {api_route} head is {head_sha}")
+
+    def unmark(self, api_route, kind):
+        with self.lock:
+            entry = self.pull_requests.get(api_route, {})
+            if entry.pop(kind, None) is None:
+                return
+            self.is_dirty = True
+        logging.info(f"pull request {api_route} {kind} state was reset")
+
+    def mark_message(self, reaction, channel, ts):
+        with self.lock:
+            self.skipped[f"{reaction}/{channel}/{ts}"] = [ts, time.time()]
+            self.is_dirty = True
+        logging.info(f"message {ts} in {channel} is not actionable for '{reaction}'")
+
+    def unmark_message(self, reaction, channel, ts):
+        with self.lock:
+            if self.skipped.pop(f"{reaction}/{channel}/{ts}", None) is None:
+                return
+            self.is_dirty = True
+        logging.info(f"message {ts} in {channel} is actionable again for '{reaction}'")
+
+    def mark_reacted(self, reaction, channel, ts):
+        with self.lock:
+            self.messages[f"{reaction}/{channel}/{ts}"] = ts
+            self.is_dirty = True
+        logging.debug(f"message {ts} in {channel} got reaction '{reaction}'")
+
+    def unmark_reacted(self, reaction, channel, ts):
+        with self.lock:
+            if self.messages.pop(f"{reaction}/{channel}/{ts}", None) is None:
+                return
+            self.is_dirty = True
+        logging.info(f"reaction '{reaction}' was removed from message {ts} in {channel}")
+
+    def is_message_actionable(self, reaction, channel, ts):
+        key = f"{reaction}/{channel}/{ts}"
+        with self.lock:
+            if key in self.messages:
+                return False
+            skipped = self.skipped.get(key)
+            return not skipped or time.time() - skipped[1] >= self.recheck_seconds
+
+    def prune(self, oldest_ts):
+        with self.lock:
+            for key in [key for key, ts in self.messages.items()
+                        if float(ts) < float(oldest_ts)]:
+                del self.messages[key]
+                self.is_dirty = True
+            for key in [key for key, (ts, _) in self.skipped.items()
+                        if float(ts) < float(oldest_ts)]:
+                del self.skipped[key]
+                self.is_dirty = True
+            for key in [key for key, entry in self.pull_requests.items()
+                        if entry["decided_at"] < float(oldest_ts)]:
+                del self.pull_requests[key]
+                self.is_dirty = True
+
+    def flush(self):
+        with self.lock:
+            if not self.is_dirty:
+                return
+            data = {"pull_requests": {api_route: dict(entry)
+                                      for api_route, entry in self.pull_requests.items()},
+                    "messages": dict(self.messages),
+                    "skipped": dict(self.skipped)}
+            self.is_dirty = False
+        self.local_client.save(data, self.cache_path, self.file_name)
+
+
+class MessageIndex:
+    """ Pull Request to Slack Message Index class """
+
+    def __init__(self):
+        # api route -> "<channel>/<message ts>" -> message,
+        # a pull request cross-posted to several channels has one entry per message
+        self.messages = {}
+        self.lock = Lock()
+
+    def add(self, api_route, message):
+        with self.lock:
+            key = f"{message.get('channel')}/{message['ts']}"
+            self.messages.setdefault(api_route, {})[key] = message
+
+    def get(self, api_route):
+        with self.lock:
+            return list(self.messages.get(api_route, {}).values())
+
+    def prune(self, oldest_ts):
+        with self.lock:
+            for api_route in list(self.messages):
+                messages = {key: message for key, message in self.messages[api_route].items()
+                            if float(message["ts"]) >= float(oldest_ts)}
+                if messages:
+                    self.messages[api_route] = messages
+                else:
+                    del self.messages[api_route]
+
+
+class InFlightRequest:
+    """ In-Flight Request class """
+
+    def __init__(self):
+        # threads wait on the event, coroutines on a future of their own loop
+        self.event = Event()
+        self.futures = []
+        self.lock = Lock()
+
+    def wait(self):
+        self.event.wait()
+
+    async def wait_async(self):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.event.is_set():
+                return
+            self.futures.append((loop, future))
+        await future
+
+    @staticmethod
+    def resolve_future(future):
+        if not future.done():
+            future.set_result(None)
+
+    def set(self):
+        with self.lock:
+            self.event.set()
+            futures, self.futures = self.futures, []
+        for loop, future in futures:
+            try:
+                loop.call_soon_threadsafe(self.resolve_future, future)
+            except RuntimeError:
+                # the waiting loop was closed meanwhile
+                pass
+
+
+class PullRequestStateService:
+    """ Pull Request State Service class """
+
+    def __init__(self, github_client, local_client, polling_schedule=None,
+                 reviews_last_page_first=False, recheck_seconds=3600):
+        self.github_client = github_client
+        self.local_client = local_client
+        self.polling_schedule = polling_schedule
+        self.reviews_last_page_first = reviews_last_page_first
+
+        self.terminal_index = TerminalStateIndex(local_client, recheck_seconds)
+        self.message_index = MessageIndex()
+
+        # cache path -> pull request data resolved during the current cycle
+        self.results = {}
+        # cache path -> in-flight request, shared by threads and coroutines
+        self.in_flight = {}
+        self.lock = Lock()
+        # cache path -> lock, serializes load / fetch / save against deletes of a state
+        self.path_locks = KeyedLock(reentrant=False)
+
+    def new_cycle(self):
+        with self.lock:
+            self.results.clear()
+        if self.polling_schedule:
+            self.polling_schedule.new_cycle()
+        cache_stats = self.local_client.stats()
+        if cache_stats:
+            logging.info(f"memory cache stats: {cache_stats}")
+
+    def prime(self, states: dict):
+        results = {}
+        for api_route, state in states.items():
+            parser = PullRequestStateParser(state)
+            results[f"{api_route}/details"] = parser.get_details()
+            results[f"{api_route}/reviews"] = parser.get_reviews()
+        with self.lock:
+            self.results.update(results)
+        # reviews first, the head of details is only kept for pull requests with a terminal state
+        for cache_path, pull_request_data in sorted(results.items(),
+                                                    key=lambda item: item[0].endswith("/details")):
+            self.record(cache_path, pull_request_data)
+        logging.info(f"{len(states)} pull request states were prefetched")
+
+    def record(self, cache_path, pull_request_data):
+        api_route, kind = cache_path.rsplit("/", 1)
+        parser = PullRequestDataParser(pull_request_data)
+        if kind == "details":
+            self.terminal_index.set_head(api_route, parser.get_details_head_sha())
+        if kind == "details" and parser.get_details_merged():
+            self.terminal_index.mark(api_route, kind, "merged")
+        elif kind == "details" and parser.get_details_closed():
+            self.terminal_index.mark(api_route, kind, "closed")
+        elif kind == "details" and self.terminal_index.get(api_route).get(kind) == "closed":
+            # reopened since it was closed
+            self.terminal_index.unmark(api_route, kind)
+        elif kind == "reviews" and parser.get_reviews_approved():
+            self.terminal_index.mark(api_route, kind, "approved",
+                                     parser.get_reviews_approved_commit())
+
+    def invalidate(self, cache_path):
+        with self.lock:
+            self.results.pop(cache_path, None)
+        if self.polling_schedule:
+            self.polling_schedule.discard(cache_path)
+
+    def is_due(self, cache_path):
+        if self.polling_schedule:
+            return self.polling_schedule.is_due(cache_path)
+        return True
+
+    def is_closed(self, pull_request):
+        return self.terminal_index.get_closed(pull_request.api_route)
+
+    def prefetch(self, pull_requests: dict, batch_size: int):
+        # pull_requests - api route -> pull request params
+        states = self.github_client.get_pull_requests_states(
+            list(pull_requests.values()), batch_size)
+        self.prime({api_route: state for api_route, state in zip(pull_requests, states)
+                    if state})
+
+    def resolve(self, cache_path, fetch):
+        while True:
+            with self.lock:
+                if cache_path in self.results:
+                    logging.info(f"reusing {cache_path} resolved in this cycle")
+                    return self.results[cache_path]
+                request = self.in_flight.get(cache_path)
+                is_leader = request is None
+                if is_leader:
+                    request = self.in_flight[cache_path] = InFlightRequest()
+
+            if not is_leader:
+                logging.info(f"waiting for in-flight {cache_path} request")
+                request.wait()
+                # the leader failed if there is still no result, try again
+                continue
+
+            try:
+                result = fetch(cache_path)
+                with self.lock:
+                    self.results[cache_path] = result
+                if result:
+                    self.record(cache_path, result)
+                return result
+            finally:
+                with self.lock:
+                    del self.in_flight[cache_path]
+                request.set()
+
+    def load(self, cache_path):
+        try:
+            return self.local_client.load(cache_path)
+        except NoCachedData:
+            return None
+
+    def get_terminal_reviews(self, pull_request):
+        if self.terminal_index.get_approved(pull_request.api_route):
+            logging.info(f"{pull_request.api_route} was approved at its head "
+                         f"{self.terminal_index.get(pull_request.api_route)['sha']}")
+            return {"review_decision": "APPROVED"}
+        return None
+
+    def get_terminal_details(self, pull_request):
+        terminal_state = self.terminal_index.get(pull_request.api_route)
+        if terminal_state.get("details") == "merged" or \
+                self.terminal_index.get_closed(pull_request.api_route):
+            logging.info(f"{pull_request.api_route} is {terminal_state['details']}")
+            return {"details": {"merged": terminal_state["details"] == "merged",
+                                "state": "closed"}}
+        return None
+
+    def get_reviews(self, pull_request):
+        terminal_reviews = self.get_terminal_reviews(pull_request)
+        if terminal_reviews:
+            return terminal_reviews
+        return self.resolve(f"{pull_request.api_route}/reviews",
+                            lambda cache_path: self._fetch_reviews(pull_request, cache_path))
+
+    def get_details(self, pull_request):
+        terminal_details = self.get_terminal_details(pull_request)
+        if terminal_details:
+            return terminal_details
+        return self.resolve(f"{pull_request.api_route}/details",
+                            lambda cache_path: self._fetch_details(pull_request, cache_path))
+
+    def prepare_reviews(self, pull_request, cache_path):
+        # returns cached data and api params, params are None when cached data is enough
+        local_cache_data = self.load(cache_path)
+        if local_cache_data and PullRequestDataParser(local_cache_data).get_reviews_approved() \
+                and self.terminal_index.get_approved(pull_request.api_route):
+            return local_cache_data, None
+        if local_cache_data and not self.is_due(cache_path):
+            logging.info(f"{cache_path} is not due for a check")
+            return local_cache_data, None
+
+        github_api_params = dict(pull_request.params)
+        pages = PullRequestDataParser(local_cache_data).get_reviews_pages()
+        if pages:
+            # every page is requested with its own validators, 304s don't count against quota
+            github_api_params["pages"] = pages
+            if self.reviews_last_page_first:
+                # new reviews land on the last page
+                github_api_params["start_page"] = len(pages)
+            logging.info(f"requesting {cache_path} from page "
+                         f"{github_api_params.get('start_page', 1)} of {len(pages)}")
+        return local_cache_data, github_api_params
+
+    @staticmethod
+    def merge_reviews(local_cache_data, pages):
+        # returns the updated projection, empty if nothing changed
+        if not pages or all(reviews is None for _, _, reviews in pages):
+            logging.info("requested reviews were not modified")
+            return {}
+        projection = local_cache_data if local_cache_data and "reviewers" in local_cache_data \
+            else {}
+        return merge_reviews_projection(projection, pages)
+
+    def prepare_details(self, pull_request, cache_path):
+        local_cache_data = self.load(cache_path)
+        if local_cache_data and PullRequestDataParser(local_cache_data).get_details_merged():
+            return local_cache_data, None
+        if local_cache_data and not self.is_due(cache_path):
+            logging.info(f"{cache_path} is not due for a check")
+            return local_cache_data, None
+
+        github_api_params = dict(pull_request.params)
+        validators = self.local_client.load_validators(cache_path, data=local_cache_data) \
+            if local_cache_data else {}
+        if validators.get("Last-Modified"):
+            github_api_params["last_modified"] = validators["Last-Modified"]
+            logging.info(f"new pull request params: {github_api_params}")
+        return local_cache_data, github_api_params
+
+    def complete(self, cache_path, local_cache_data, pull_request_data):
+        if self.polling_schedule:
+            self.polling_schedule.record(cache_path, bool(pull_request_data))
+        if pull_request_data:
+            if local_cache_data and "reviews" in local_cache_data and \
+                    "reviewers" in pull_request_data:
+                # legacy raw review pages are replaced, not merged into
+                self.local_client.delete(cache_path)
+            self.local_client.save(pull_request_data, cache_path)
+            return pull_request_data
+        return local_cache_data
+
+    def _fetch_reviews(self, pull_request, cache_path):
+        with self.path_locks(cache_path):
+            local_cache_data, github_api_params = self.prepare_reviews(pull_request, cache_path)
+            if github_api_params is None:
+                return local_cache_data
+            pages = self.github_client.get_pull_request_reviews(**github_api_params)
+            return self.complete(cache_path, local_cache_data,
+                                 self.merge_reviews(local_cache_data, pages))
+
+    def _fetch_details(self, pull_request, cache_path):
+        with self.path_locks(cache_path):
+            local_cache_data, github_api_params = self.prepare_details(pull_request, cache_path)
+            if github_api_params is None:
+                return local_cache_data
+            pull_request_data = self.github_client.get_pull_request_details(
+                **github_api_params)
+            return self.complete(cache_path, local_cache_data, pull_request_data)
+
+    def delete(self, cache_path):
+        with self.path_locks(cache_path):
+            self.local_client.delete(cache_path)
+            if self.polling_schedule:
+                self.polling_schedule.discard(cache_path)
+
+    def delete_reviews(self, pull_request):
+        self.delete(f"{pull_request.api_route}/reviews")
+
+    def delete_details(self, pull_request):
+        self.delete(f"{pull_request.api_route}/details")
+
+
+class AsyncPullRequestStateService(PullRequestStateService):
+    """ Async Pull Request State Service class """
+
+    def __init__(self, github_client, local_client, polling_schedule=None,
+                 reviews_last_page_first=False, async_github_client=None, recheck_seconds=3600):
+        # sync methods keep serving threaded consumers (socket mode, webhooks)
+        super().__init__(github_client, local_client, polling_schedule, reviews_last_page_first,
+                         recheck_seconds)
+        self.async_github_client = async_github_client
+
+    async def prefetch_async(self, pull_requests: dict, batch_size: int):
+        states = await self.async_github_client.get_pull_requests_states(
+            list(pull_requests.values()), batch_size)
+        self.prime({api_route: state for api_route, state in zip(pull_requests, states)
+                    if state})
+
+    async def resolve_async(self, cache_path, fetch):
+        while True:
+            with self.lock:
+                if cache_path in self.results:
+                    logging.info(f"reusing {cache_path} resolved in this cycle")
+                    return self.results[cache_path]
+                request = self.in_flight.get(cache_path)
+                is_leader = request is None
+                if is_leader:
+                    request = self.in_flight[cache_path] = InFlightRequest()
+
+            if not is_leader:
+                logging.info(f"waiting for in-flight {cache_path} request")
+                await request.wait_async()
+                # the leader failed if there is still no result, try again
+                continue
+
+            try:
+                result = await fetch(cache_path)
+                with self.lock:
+                    self.results[cache_path] = result
+                if result:
+                    self.record(cache_path, result)
+                return result
+            finally:
+                with self.lock:
+                    del self.in_flight[cache_path]
+                request.set()
+
+    async def get_reviews_async(self, pull_request):
+        terminal_reviews = self.get_terminal_reviews(pull_request)
+        if terminal_reviews:
+            return terminal_reviews
+        return await self.resolve_async(
+            f"{pull_request.api_route}/reviews",
+            lambda cache_path: self._fetch_reviews_async(pull_request, cache_path))
+
+    async def get_details_async(self, pull_request):
+        terminal_details = self.get_terminal_details(pull_request)
+        if terminal_details:
+            return terminal_details
+        return await self.resolve_async(
+            f"{pull_request.api_route}/details",
+            lambda cache_path: self._fetch_details_async(pull_request, cache_path))
+
+    async def _fetch_reviews_async(self, pull_request, cache_path):
+        # local cache calls run in threads, they may wait for the disk or a path lock
+        async with self.path_locks.acquire_async(cache_path):
+            local_cache_data, github_api_params = await asyncio.to_thread(
+                self.prepare_reviews, pull_request, cache_path)
+            if github_api_params is None:
+                return local_cache_data
+            pages = await self.async_github_client.get_pull_request_reviews(**github_api_params)
+            return await asyncio.to_thread(self.complete, cache_path, local_cache_data,
+                                           self.merge_reviews(local_cache_data, pages))
+
+    async def _fetch_details_async(self, pull_request, cache_path):
+        async with self.path_locks.acquire_async(cache_path):
+            local_cache_data, github_api_params = await asyncio.to_thread(
+                self.prepare_details, pull_request, cache_path)
+            if github_api_params is None:
+                return local_cache_data
+            pull_request_data = await self.async_github_client.get_pull_request_details(
+                **github_api_params)
+            return await asyncio.to_thread(self.complete, cache_path, local_cache_data,
+                                           pull_request_data)
+
+    async def delete_async(self, cache_path):
+        async with self.path_locks.acquire_async(cache_path):
+            await asyncio.to_thread(self.local_client.delete, cache_path)
+            if self.polling_schedule:
+                self.polling_schedule.discard(cache_path)
+
+    async def delete_reviews_async(self, pull_request):
+        await self.delete_async(f"{pull_request.api_route}/reviews")
+
+    async def delete_details_async(self, pull_request):
+        await self.delete_async(f"{pull_request.api_route}/details")
@@ -0,0 +1,52 @@
+from benchmarks.fake_servers import FakeSlackServer, FakeGitHubServer
+from email.utils import formatdate, parsedate_to_datetime
+import pytest
+
+
+def get_pull_request(state="open", merged=False, reviews=None, head_sha="a" * 40):
+    # same shape as benchmarks.synthetic pull requests
+    return {"state": state,
+            "merged": merged,
+            "head_sha": head_sha,
+            "reviews": reviews if reviews is not None else [],
+            "updated_at": formatdate(usegmt=True)}
+
+
+def update_pull_request(pull_request, **changes):
+    # Last-Modified has a second resolution, a change has to move it forward
+    pull_request.update(changes)
+    updated_at = parsedate_to_datetime(pull_request["updated_at"]).timestamp() + 1
+    pull_request["updated_at"] = formatdate(updated_at, usegmt=True)
+
+
+def get_review(review_id, state="COMMENTED", login=None, commit_id="a" * 40):
+    return {"id": review_id, "state": state,
+            "user": {"login": login or f"reviewer{review_id}"}, "commit_id": commit_id}
+
+
+@pytest.fixture
+def github_server():
+    servers = []
+
+    def start(pull_requests, **kwargs):
+        server = FakeGitHubServer(pull_requests, **kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def slack_server():
+    servers = []
+
+    def start(channels, **kwargs):
+        server = FakeSlackServer(channels, **kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
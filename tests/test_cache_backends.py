@@ -0,0 +1,59 @@
+from clients import LocalCacheClient, NoCachedData
+from clients.local import CacheBackend, FileCacheBackend, SQLiteCacheBackend
+from clients.lease import LeaseBackend
+import pytest
+
+
+@pytest.fixture(params=["file", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteCacheBackend(str(tmp_path / "cache.db"))
+    return FileCacheBackend(str(tmp_path))
+
+
+def test_backend_interfaces_are_abstract():
+    with pytest.raises(TypeError):
+        CacheBackend()
+    with pytest.raises(TypeError):
+        LeaseBackend()
+
+
+def test_save_merges_into_existing_entry(backend):
+    backend.save({"headers": {"ETag": "1"}, "details": {"merged": False}},
+                 "repos/o/r/1", "data.json")
+    backend.save({"details": {"merged": True}}, "repos/o/r/1", "data.json")
+
+    assert backend.load("repos/o/r/1", "data.json") == \
+        {"headers": {"ETag": "1"}, "details": {"merged": True}}
+
+
+def test_validators_of_the_merged_entry(backend):
+    backend.save({"details": {"merged": False},
+                  "headers": {"ETag": "1", "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}},
+                 "repos/o/r/1", "data.json")
+    backend.save({"headers": {"ETag": "2", "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}},
+                 "repos/o/r/1", "data.json")
+
+    assert backend.load_validators("repos/o/r/1", "data.json") == \
+        {"ETag": "2", "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+    assert backend.load_validators("repos/o/r/2", "data.json") == {}
+
+
+def test_delete_removes_nested_paths_only(backend):
+    for path in ("repos/o/r/1/reviews", "repos/o/r/1/details", "repos/o/r/10/details"):
+        backend.save({"path": path}, path, "data.json")
+
+    backend.delete("repos/o/r/1")
+
+    with pytest.raises(NoCachedData):
+        backend.load("repos/o/r/1/reviews", "data.json")
+    assert [entry[0] for entry in backend.list_entries("repos")] == ["repos/o/r/10/details"]
+
+
+def test_sqlite_backend_migrates_cache_files(tmp_path):
+    LocalCacheClient(str(tmp_path)).save({"details": {"merged": True}}, "repos/o/r/1/details")
+
+    local_client = LocalCacheClient(str(tmp_path), "sqlite")
+
+    assert local_client.load("repos/o/r/1/details") == {"details": {"merged": True}}
+    assert not (tmp_path / "repos").exists()
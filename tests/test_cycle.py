@@ -0,0 +1,54 @@
+from clients import SlackClient, GitHubClient, LocalCacheClient
+from processors import PullRequestStateService
+from main import run_threaded
+from argparse import Namespace
+from queue import Queue
+from threading import Thread
+from .conftest import get_pull_request
+import time
+
+URL = "https://github.com/owner/repo/pull/1"
+
+
+def get_message(ts):
+    return {"type": "message", "user": "U1", "ts": ts, "text": f"please review <{URL}>",
+            "blocks": [{"type": "rich_text", "block_id": "b1", "elements": [
+                {"type": "rich_text_section", "elements": [{"type": "link", "url": URL}]}]}]}
+
+
+def drain(worker_queue, messages):
+    while True:
+        message = worker_queue.get()
+        if message is None:
+            break
+        messages.append(message)
+        worker_queue.task_done()
+
+
+def test_cross_posted_pull_requests_are_prefetched_once(slack_server, github_server, tmp_path):
+    ts = f"{time.time() - 60:.6f}"
+    slack = slack_server({"C1": [get_message(ts)], "C2": [get_message(ts)]})
+    github = github_server({"owner/repo/1": get_pull_request()})
+    config = Namespace(slack_time_window_minutes=60,
+                       slack_reply_workers=2,
+                       github_graphql_batch_size=50,
+                       approved_reaction_name="white_check_mark",
+                       merged_reaction_name="merged")
+    state_service = PullRequestStateService(
+        GitHubClient("token", api_host=github.url, graphql_url=f"{github.url}/graphql"),
+        LocalCacheClient(str(tmp_path)))
+
+    queue_req_approval, queue_req_merging = Queue(), Queue()
+    queued = []
+    workers = [Thread(target=drain, args=(worker_queue, queued), daemon=True)
+               for worker_queue in (queue_req_approval, queue_req_merging)]
+    for worker in workers:
+        worker.start()
+    run_threaded(SlackClient("xoxb-test", base_url=slack.url), config,
+                 queue_req_approval, queue_req_merging,
+                 {"C1": (None, None), "C2": (None, None)}, state_service)
+    queue_req_approval.put(None)
+    queue_req_merging.put(None)
+
+    assert github.calls == {"graphql 200": 1}
+    assert sorted(message["channel"] for message in queued) == ["C1", "C1", "C2", "C2"]
@@ -0,0 +1,74 @@
+from clients import GitHubClient, LocalCacheClient
+from parsers import PullRequestDataParser, PullRequestRef
+from processors import PullRequestStateService
+from utils import get_arguments
+from .conftest import get_pull_request
+import sys
+
+PULL_REQUESTS = {"owner/repo/1": get_pull_request("closed", merged=True),
+                 "owner/repo/2": get_pull_request(reviews=[
+                     {"id": 1, "state": "APPROVED", "user": {"login": "reviewer"},
+                      "commit_id": "a" * 40}]),
+                 "owner/repo/3": get_pull_request("closed")}
+
+
+def get_refs():
+    return [PullRequestRef("owner", "repo", number) for number in (1, 2, 3)]
+
+
+def test_states_are_resolved_in_batches(github_server):
+    server = github_server(PULL_REQUESTS)
+    github_client = GitHubClient("token", api_host=server.url)
+
+    states = github_client.get_pull_requests_states(
+        [pull_request.params for pull_request in get_refs()], batch_size=2)
+
+    assert [(state["state"], state["merged"]) for state in states] == \
+        [("MERGED", True), ("OPEN", False), ("CLOSED", False)]
+    assert states[1]["reviewDecision"] == "APPROVED"
+    assert server.calls["graphql 200"] == 2
+
+
+def test_unknown_pull_requests_resolve_to_none(github_server):
+    server = github_server(PULL_REQUESTS)
+    github_client = GitHubClient("token", api_host=server.url)
+
+    states = github_client.get_pull_requests_states(
+        [PullRequestRef("owner", "repo", 4).params])
+
+    assert states == [None]
+
+
+def test_prefetch_answers_lookups_without_rest_calls(github_server, tmp_path):
+    server = github_server(PULL_REQUESTS)
+    github_client = GitHubClient("token", api_host=server.url)
+    state_service = PullRequestStateService(github_client, LocalCacheClient(str(tmp_path)))
+    merged, approved, closed = get_refs()
+
+    state_service.new_cycle()
+    state_service.prefetch({pull_request.api_route: pull_request.params
+                            for pull_request in get_refs()}, batch_size=50)
+
+    assert PullRequestDataParser(state_service.get_details(merged)).get_details_merged()
+    assert PullRequestDataParser(state_service.get_reviews(approved)).get_reviews_approved()
+    assert PullRequestDataParser(state_service.get_details(closed)).get_details_closed()
+    assert state_service.is_closed(closed)
+    assert set(server.calls) == {"graphql 200"}
+
+
+def test_api_urls_are_configurable(github_server, monkeypatch):
+    server = github_server(PULL_REQUESTS)
+    monkeypatch.setattr(sys, "argv", ["main.py",
+                                      "--slack_api_token", "xoxb-test",
+                                      "--slack_channel_id", "C1",
+                                      "--github_api_token", "token",
+                                      "--sleep_period_minutes", "1",
+                                      "--github_api_url", server.url])
+    monkeypatch.setenv("GITHUB_GRAPHQL_URL", f"{server.url}/graphql")
+    args = get_arguments()
+    github_client = GitHubClient(args.github_api_token,
+                                 api_host=args.github_api_url,
+                                 graphql_url=args.github_graphql_url)
+
+    assert github_client.graphql_url == f"{server.url}/graphql"
+    assert github_client.get_pull_requests_states([get_refs()[0].params])[0]["merged"]
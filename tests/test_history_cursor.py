@@ -0,0 +1,58 @@
+from clients import LocalCacheClient, SlackHistoryCursor
+from clients.slack import SlackThreadIndex
+from main import SlackChannelScanner
+from argparse import Namespace
+import pytest
+import time
+
+CHANNEL = "C1"
+
+
+def get_message(ts, reply_count=0):
+    message = {"type": "message", "ts": ts, "channel": CHANNEL,
+               "text": "please review <https://github.com/owner/repo/pull/1>"}
+    if reply_count:
+        message.update({"reply_count": reply_count, "latest_reply": ts})
+    return message
+
+
+@pytest.fixture
+def config():
+    return Namespace(slack_time_window_minutes=60,
+                     approved_reaction_name="white_check_mark",
+                     merged_reaction_name="merged")
+
+
+@pytest.mark.parametrize("thread_index", [None, SlackThreadIndex()])
+def test_pending_messages_without_threads_are_not_fetched(tmp_path, config, thread_index):
+    local_client = LocalCacheClient(str(tmp_path))
+    now = time.time()
+    message, thread = get_message(f"{now - 20:.6f}"), get_message(f"{now - 10:.6f}", 2)
+
+    cursor = SlackHistoryCursor(local_client, CHANNEL)
+    scanner = SlackChannelScanner(config, CHANNEL, cursor, thread_index)
+    pending = scanner.scan([message, thread], {message["ts"]: [message],
+                                               thread["ts"]: [thread]})
+    assert pending == {message["ts"]: message, thread["ts"]: thread}
+    scanner.update([message, thread], pending, full_sync=True)
+
+    # the stored message is scanned again without a replies call, the thread is fetched
+    cursor = SlackHistoryCursor(local_client, CHANNEL)
+    scanner = SlackChannelScanner(config, CHANNEL, cursor, thread_index)
+    message_replies, threads = scanner.get_threads([], full_sync=False)
+    assert message_replies == {message["ts"]: [message]}
+    assert threads == [thread["ts"]]
+
+    message_replies[thread["ts"]] = [thread]
+    assert scanner.scan([], message_replies) == pending
+    assert [queued["ts"] for queued in scanner.messages_approval] == \
+        [message["ts"], thread["ts"]]
+
+
+def test_legacy_cursors_fetch_pending_threads(tmp_path, config):
+    local_client = LocalCacheClient(str(tmp_path))
+    local_client.save({"latest_ts": "2.000000", "full_sync_ts": time.time(),
+                       "pending": ["1.000000"]}, f"channels/{CHANNEL}", "cursor.json")
+
+    scanner = SlackChannelScanner(config, CHANNEL, SlackHistoryCursor(local_client, CHANNEL))
+    assert scanner.get_threads([], full_sync=False) == ({}, ["1.000000"])
@@ -0,0 +1,108 @@
+from clients import LocalCacheClient, NoCachedData
+from threading import Event, Thread
+import pytest
+import time
+
+
+@pytest.fixture
+def local_client(tmp_path):
+    return LocalCacheClient(str(tmp_path), memory_max_entries=16,
+                            memory_max_bytes=1024 * 1024, memory_ttl=60)
+
+
+def test_memory_hits_return_copies(local_client):
+    local_client.save({"details": {"merged": False}}, "repos/o/r/1/details")
+
+    local_client.load("repos/o/r/1/details")["details"]["merged"] = True
+
+    assert local_client.load("repos/o/r/1/details") == {"details": {"merged": False}}
+    assert local_client.stats()["hits"] == 2
+
+
+def test_saves_write_the_merged_entry_through(local_client):
+    local_client.save({"headers": {"ETag": "1"}}, "repos/o/r/1/details")
+    local_client.save({"details": {"merged": True}}, "repos/o/r/1/details")
+
+    assert local_client.load("repos/o/r/1/details") == \
+        {"headers": {"ETag": "1"}, "details": {"merged": True}}
+    assert local_client.stats()["hits"] == 1
+    assert local_client.stats()["misses"] == 0
+
+
+def test_save_is_not_overtaken_by_a_slow_load(local_client):
+    local_client.save({"details": {"merged": False}}, "repos/o/r/1/details")
+    backend_load = local_client.backend.load
+    entered, release = Event(), Event()
+
+    def slow_load(file_path, file_name):
+        data = backend_load(file_path, file_name)
+        entered.set()
+        release.wait(5)
+        return data
+
+    local_client.backend.load = slow_load
+    reader = Thread(target=local_client.load, args=("repos/o/r/1/details",))
+    reader.start()
+    entered.wait(5)
+    writer = Thread(target=local_client.save,
+                    args=({"details": {"merged": True}}, "repos/o/r/1/details"))
+    writer.start()
+    time.sleep(0.1)
+    release.set()
+    reader.join()
+    writer.join()
+
+    # the fill of the old data must not outlive the save
+    assert local_client.load("repos/o/r/1/details") == {"details": {"merged": True}}
+
+
+def test_deleted_entries_are_not_served_from_memory(local_client):
+    local_client.save({"details": {"merged": False}}, "repos/o/r/1/details")
+    local_client.load("repos/o/r/1/details")
+
+    local_client.delete("repos/o/r/1/details")
+
+    with pytest.raises(NoCachedData):
+        local_client.load("repos/o/r/1/details")
+    local_client.collect_garbage()
+    with pytest.raises(NoCachedData):
+        local_client.load("repos/o/r/1/details")
+
+
+def test_save_after_delete_drops_stale_data(local_client):
+    local_client.save({"headers": {"ETag": "1"}, "reviews": []}, "repos/o/r/1/reviews")
+    local_client.delete("repos/o/r/1/reviews")
+
+    local_client.save({"reviewers": {}}, "repos/o/r/1/reviews")
+
+    assert local_client.load("repos/o/r/1/reviews") == {"reviewers": {}}
+
+
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+def test_tombstones_survive_a_restart(tmp_path, backend):
+    local_client = LocalCacheClient(str(tmp_path), backend)
+    local_client.save({"details": {"merged": False}}, "repos/o/r/1/details")
+    local_client.save({"details": {"merged": False}}, "repos/o/r/2/details")
+    local_client.delete("repos/o/r/1/details")
+
+    local_client = LocalCacheClient(str(tmp_path), backend)
+
+    with pytest.raises(NoCachedData):
+        local_client.load("repos/o/r/1/details")
+    local_client.collect_garbage()
+    local_client = LocalCacheClient(str(tmp_path), backend)
+    assert local_client.tombstones == set()
+    assert [entry[0] for entry in local_client.backend.list_entries("repos")] == \
+        ["repos/o/r/2/details"]
+
+
+def test_tombstones_are_migrated_into_sqlite(tmp_path):
+    local_client = LocalCacheClient(str(tmp_path))
+    local_client.save({"details": {"merged": False}}, "repos/o/r/1/details")
+    local_client.delete("repos/o/r/1/details")
+
+    local_client = LocalCacheClient(str(tmp_path), "sqlite")
+
+    assert local_client.tombstones == {"repos/o/r/1/details"}
+    with pytest.raises(NoCachedData):
+        local_client.load("repos/o/r/1/details")
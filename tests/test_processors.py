@@ -0,0 +1,37 @@
+from processors import MessageApproved, MessageMerged
+from argparse import Namespace
+from queue import Queue
+from threading import Thread
+import pytest
+
+
+class FailingStateService:
+    """ raises on every lookup """
+
+    def is_closed(self, pull_request):
+        raise RuntimeError("lookup failed")
+
+    def get_details(self, pull_request):
+        raise RuntimeError("lookup failed")
+
+
+@pytest.mark.parametrize("processor_class", [MessageApproved, MessageMerged])
+def test_workers_survive_failing_messages(processor_class):
+    config = Namespace(approved_reaction_name="white_check_mark", merged_reaction_name="merged",
+                       dry_run=True)
+    worker_queue = Queue()
+    processor = processor_class(None, None, None, config, worker_queue, FailingStateService())
+    processor.start()
+    message = {"channel": "C1", "ts": "1.000000",
+               "text": "<https://github.com/owner/repo/pull/1>"}
+    for _ in range(3):
+        worker_queue.put(message)
+
+    # every failed message is still marked as done, join() returns
+    joiner = Thread(target=worker_queue.join, daemon=True)
+    joiner.start()
+    joiner.join(5)
+    assert not joiner.is_alive()
+    assert processor.is_alive()
+    worker_queue.put(None)
+    processor.join(5)
@@ -0,0 +1,47 @@
+from clients.github import GitHubRequestBudget
+from unittest import mock
+import pytest
+
+RESET_SECONDS = 600
+
+
+@pytest.fixture
+def clock():
+    with mock.patch("clients.github.time") as time_mock:
+        time_mock.time.return_value = 1000.0
+        yield time_mock.time
+
+
+def get_headers(remaining, reset_time=1000 + RESET_SECONDS):
+    return {"x-ratelimit-limit": "5000", "x-ratelimit-remaining": str(remaining),
+            "x-ratelimit-reset": str(reset_time)}
+
+
+def test_bursts_are_not_paced(clock):
+    budget = GitHubRequestBudget(reserve=100)
+    budget.update(get_headers(5000))
+    for remaining in range(4999, 4800, -1):
+        clock.return_value += 0.003
+        budget.update(get_headers(remaining))
+        assert budget.get_delay() == 0
+
+
+def test_overspending_is_paced(clock):
+    budget = GitHubRequestBudget(reserve=100)
+    budget.update(get_headers(5000))
+    # 3000 requests within 60s would use up the quota long before the reset
+    clock.return_value += 60
+    budget.update(get_headers(2000))
+
+    delays = [budget.get_delay() for _ in range(3)]
+    interval = (RESET_SECONDS - 60) / (2000 - 100)
+    assert delays == pytest.approx([0, interval, 2 * interval])
+    # conditional requests are never paced
+    assert budget.get_delay(is_conditional=True) == 0
+
+
+def test_reserve_is_kept_for_conditional_requests(clock):
+    budget = GitHubRequestBudget(reserve=100)
+    budget.update(get_headers(100))
+    assert budget.get_delay() == RESET_SECONDS
+    assert budget.get_delay(is_conditional=True) == 0
@@ -0,0 +1,93 @@
+from clients import GitHubClient, AsyncGitHubClient, LocalCacheClient
+from clients.github import REVIEWS_PER_PAGE
+from parsers import PullRequestDataParser, PullRequestRef
+from processors import AsyncPullRequestStateService
+from .conftest import get_pull_request, get_review, update_pull_request
+import asyncio
+import pytest
+
+
+@pytest.fixture(params=["threaded", "asyncio"])
+def get_reviews(request, github_server, tmp_path):
+    # returns a function resolving the reviews in a new cycle and the server
+    def start(reviews, reviews_last_page_first=False):
+        data = get_pull_request(reviews=reviews)
+        server = github_server({"owner/repo/1": data})
+        state_service = AsyncPullRequestStateService(
+            GitHubClient("token", api_host=server.url),
+            LocalCacheClient(str(tmp_path)),
+            reviews_last_page_first=reviews_last_page_first,
+            async_github_client=AsyncGitHubClient("token", api_host=server.url))
+        pull_request = PullRequestRef("owner", "repo", 1)
+
+        async def get_reviews_async():
+            await state_service.async_github_client.open()
+            try:
+                return await state_service.get_reviews_async(pull_request)
+            finally:
+                await state_service.async_github_client.close()
+
+        def get_reviews():
+            server.calls.clear()
+            state_service.new_cycle()
+            if request.param == "asyncio":
+                return asyncio.run(get_reviews_async())
+            return state_service.get_reviews(pull_request)
+
+        return get_reviews, data, server
+
+    return start
+
+
+def get_comments(start, count):
+    return [get_review(review_id) for review_id in range(start, start + count)]
+
+
+def test_not_modified_first_page_with_a_changed_second_page(get_reviews):
+    get_reviews, data, server = get_reviews(get_comments(1, REVIEWS_PER_PAGE + 50))
+    get_reviews()
+    assert server.calls == {"pulls.reviews 200": 2}
+
+    update_pull_request(data, reviews=data["reviews"] + [get_review(1000, "APPROVED")])
+    pull_request_data = get_reviews()
+    assert server.calls == {"pulls.reviews 304": 1, "pulls.reviews 200": 1}
+    parser = PullRequestDataParser(pull_request_data)
+    assert len(parser.get_reviewers()) == REVIEWS_PER_PAGE + 51
+    assert parser.get_reviews_approved()
+    assert [page["count"] for page in parser.get_reviews_pages()] == [REVIEWS_PER_PAGE, 51]
+
+
+def test_full_last_page_probes_for_a_new_page(get_reviews):
+    get_reviews, data, server = get_reviews(get_comments(1, REVIEWS_PER_PAGE))
+    get_reviews()
+    assert server.calls == {"pulls.reviews 200": 1}
+
+    # unchanged, the empty probe of the next page is not kept
+    pull_request_data = get_reviews()
+    assert server.calls == {"pulls.reviews 304": 1, "pulls.reviews 200": 1}
+    assert len(PullRequestDataParser(pull_request_data).get_reviews_pages()) == 1
+
+    update_pull_request(data, reviews=data["reviews"] + [get_review(1000, "APPROVED")])
+    pull_request_data = get_reviews()
+    assert server.calls == {"pulls.reviews 304": 1, "pulls.reviews 200": 1}
+    parser = PullRequestDataParser(pull_request_data)
+    assert parser.get_reviews_approved()
+    assert [page["count"] for page in parser.get_reviews_pages()] == [REVIEWS_PER_PAGE, 1]
+
+
+def test_last_page_first(get_reviews):
+    get_reviews, data, server = get_reviews(get_comments(1, REVIEWS_PER_PAGE + 50),
+                                            reviews_last_page_first=True)
+    get_reviews()
+    assert server.calls == {"pulls.reviews 200": 2}
+
+    # only the last page is revalidated
+    get_reviews()
+    assert server.calls == {"pulls.reviews 304": 1}
+
+    update_pull_request(data, reviews=data["reviews"] + [get_review(1000, "APPROVED")])
+    pull_request_data = get_reviews()
+    assert server.calls == {"pulls.reviews 200": 1}
+    parser = PullRequestDataParser(pull_request_data)
+    assert parser.get_reviews_approved()
+    assert len(parser.get_reviewers()) == REVIEWS_PER_PAGE + 51
@@ -0,0 +1,100 @@
+from parsers import PullRequestDataParser, merge_reviews_projection
+from parsers.github import get_reviews_projection
+from .conftest import get_review
+
+HEADERS = {"ETag": '"page-1"', "Last-Modified": "Mon, 01 Jan 2024 00:00:00 GMT"}
+
+
+def get_states(projection):
+    return {login: reviewer["state"] for login, reviewer in projection["reviewers"].items()}
+
+
+def test_comments_do_not_override_earlier_reviews():
+    projection = get_reviews_projection([(HEADERS, [
+        get_review(1, "APPROVED", login="alice"),
+        get_review(2, "CHANGES_REQUESTED", login="bob"),
+        get_review(3, login="alice"),
+        get_review(4, login="bob"),
+        get_review(5, login="carol")])])
+
+    assert get_states(projection) == {"alice": "APPROVED",
+                                      "bob": "CHANGES_REQUESTED",
+                                      "carol": "COMMENTED"}
+    assert projection["last_review_id"] == 5
+    assert not PullRequestDataParser(projection).get_reviews_approved()
+
+    # a later review does override the earlier one, also across merges
+    projection = merge_reviews_projection(projection, [
+        (1, HEADERS, [get_review(6, "APPROVED", login="bob")])])
+    assert get_states(projection)["bob"] == "APPROVED"
+    assert PullRequestDataParser(projection).get_reviews_approved()
+
+
+def test_refetched_pages_only_apply_dismissals():
+    reviews = [get_review(1, "APPROVED", login="alice", commit_id="a" * 40),
+               get_review(2, login="bob")]
+    projection = get_reviews_projection([(HEADERS, reviews)])
+    assert PullRequestDataParser(projection).get_reviews_approved_commit() == "a" * 40
+
+    reviews[0] = {**reviews[0], "state": "DISMISSED"}
+    projection = merge_reviews_projection(projection, [(1, HEADERS, reviews)])
+    assert get_states(projection) == {"alice": "DISMISSED", "bob": "COMMENTED"}
+    assert not PullRequestDataParser(projection).get_reviews_approved()
+    assert PullRequestDataParser(projection).get_reviews_approved_commit() is None
+
+
+def test_reviews_are_applied_once_by_id():
+    pages = [(1, HEADERS, [get_review(1, "APPROVED", login="alice"),
+                           get_review(2, "CHANGES_REQUESTED", login="bob")])]
+    projection = merge_reviews_projection({}, pages)
+    assert merge_reviews_projection(projection, pages) == projection
+
+    # reviews up to the last applied id are skipped, a changed state is only a dismissal
+    stale = [(1, HEADERS, [get_review(1, "APPROVED", login="carol")])]
+    assert merge_reviews_projection(projection, stale)["reviewers"] == projection["reviewers"]
+
+    # pending reviews move the cursor but never count
+    projection = merge_reviews_projection(projection, [
+        (1, HEADERS, [get_review(3, "PENDING", login="carol")])])
+    assert "carol" not in projection["reviewers"]
+    assert projection["last_review_id"] == 3
+
+
+def test_page_validators():
+    projection = merge_reviews_projection({}, [
+        (1, HEADERS, [get_review(1)]),
+        (2, {"ETag": '"page-2"'}, [get_review(2)]),
+        # empty probe past the last page
+        (3, {"ETag": '"page-3"'}, [])])
+    assert projection["pages"] == [{**HEADERS, "count": 1}, {"ETag": '"page-2"', "count": 1}]
+    assert PullRequestDataParser(projection).get_reviews_pages() == projection["pages"]
+
+    # not modified pages keep their validators
+    assert merge_reviews_projection(projection, [(1, HEADERS, None)])["pages"] == \
+        projection["pages"]
+    # an empty listing still has validators for its first page
+    assert merge_reviews_projection({}, [(1, HEADERS, [])])["pages"] == \
+        [{**HEADERS, "count": 0}]
+
+
+def test_legacy_entries_are_projected_on_read():
+    legacy = {"reviews": [
+        {"review": [get_review(1, "CHANGES_REQUESTED", login="alice"),
+                    get_review(2, "APPROVED", login="bob", commit_id="b" * 40)]},
+        {"review": [get_review(3, login="alice"),
+                    get_review(4, "APPROVED", login="alice", commit_id="c" * 40)]}]}
+    parser = PullRequestDataParser(legacy)
+
+    assert {login: reviewer["state"] for login, reviewer in parser.get_reviewers().items()} == \
+        {"alice": "APPROVED", "bob": "APPROVED"}
+    assert parser.get_reviews_approved()
+    assert parser.get_reviews_approved_commit() == "c" * 40
+    # legacy entries have no page validators, they are fetched in full
+    assert parser.get_reviews_pages() == []
+
+
+def test_head_is_only_kept_when_known():
+    reviews = [get_review(1, "APPROVED", commit_id="a" * 40)]
+    # the reviews endpoint doesn't expose the head, the reviewed commit is not a stand-in
+    assert get_reviews_projection([(HEADERS, reviews)])["head_sha"] is None
+    assert get_reviews_projection([(HEADERS, reviews)], "b" * 40)["head_sha"] == "b" * 40
@@ -0,0 +1,24 @@
+from parsers import get_pull_request_urls
+
+URL = "https://github.com/owner/repo/pull/1"
+
+
+def test_links_in_attachment_field_values():
+    message = {"text": "deploy request",
+               "attachments": [{"pretext": "new deployment",
+                                "fields": [{"title": "Pull request",
+                                            "value": f"<{URL}|#1>", "short": True},
+                                           {"title": "Also", "value": f"{URL}/files"}]}]}
+
+    assert list(get_pull_request_urls(message)) == [URL]
+
+
+def test_links_are_yielded_once():
+    other = "https://github.com/owner/repo/pull/2"
+    message = {"text": f"<{other}> and <{URL}>",
+               "blocks": [{"type": "rich_text", "elements": [
+                   {"type": "rich_text_section", "elements": [{"type": "link", "url": URL}]}]}],
+               "attachments": [{"title_link": other}]}
+
+    # blocks come first, then text and attachments
+    assert list(get_pull_request_urls(message)) == [URL, other]
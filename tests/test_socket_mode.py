@@ -0,0 +1,101 @@
+from benchmarks.fake_servers import FakeSocketModeServer
+from clients import SlackClient, GitHubClient, LocalCacheClient
+from processors import PullRequestStateService
+from main import SlackEventHandler
+from argparse import Namespace
+from queue import Queue, Empty
+import pytest
+import time
+
+CHANNEL = "C1"
+URL = "https://github.com/owner/repo/pull/1"
+
+
+def get_message(ts, url=URL):
+    if not url:
+        return {"type": "message", "user": "U1", "ts": ts, "text": "no links"}
+    return {"type": "message", "user": "U1", "ts": ts, "text": f"please review <{url}>",
+            "blocks": [{"type": "rich_text", "block_id": "b1", "elements": [
+                {"type": "rich_text_section", "elements": [{"type": "link", "url": url}]}]}]}
+
+
+@pytest.fixture
+def socket_server():
+    server = FakeSocketModeServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def pipeline(slack_server, socket_server, tmp_path):
+    ts = f"{time.time() - 60:.6f}"
+    server = slack_server({CHANNEL: [get_message(ts)]}, socket_url=socket_server.url)
+    slack_client = SlackClient("xoxb-test", base_url=server.url)
+    config = Namespace(slack_channel_id=[CHANNEL],
+                       slack_time_window_minutes=60,
+                       approved_reaction_name="white_check_mark",
+                       merged_reaction_name="merged")
+    state_service = PullRequestStateService(GitHubClient("token"),
+                                            LocalCacheClient(str(tmp_path)))
+    queue_req_approval, queue_req_merging, handled = Queue(), Queue(), Queue()
+    handler = SlackEventHandler(slack_client, config, queue_req_approval, queue_req_merging,
+                                state_service)
+
+    def listener(event):
+        handler(event)
+        handled.put(event)
+
+    slack_client.start_socket_mode("xapp-test", listener)
+    assert socket_server.connected.wait(5)
+    yield Namespace(ts=ts, handled=handled, state_service=state_service,
+                    queue_req_approval=queue_req_approval,
+                    queue_req_merging=queue_req_merging)
+    slack_client.socket_client.close()
+
+
+def send(socket_server, pipeline, event):
+    envelope_id = socket_server.send_event(event)
+    assert pipeline.handled.get(timeout=5) == event
+    assert socket_server.wait_ack(envelope_id)
+
+
+def get_queued(worker_queue):
+    try:
+        return worker_queue.get_nowait()["ts"]
+    except Empty:
+        return None
+
+
+def test_new_messages_are_queued(socket_server, pipeline):
+    send(socket_server, pipeline, {**get_message("2.000000"), "channel": CHANNEL})
+    send(socket_server, pipeline, {**get_message("3.000000"), "channel": "C2"})
+    send(socket_server, pipeline, {**get_message("4.000000", url=None), "channel": CHANNEL})
+
+    assert get_queued(pipeline.queue_req_approval) == "2.000000"
+    assert get_queued(pipeline.queue_req_merging) == "2.000000"
+    assert get_queued(pipeline.queue_req_approval) is None
+
+
+def test_edited_messages_are_queued(socket_server, pipeline):
+    send(socket_server, pipeline, {"type": "message", "subtype": "message_changed",
+                                   "channel": CHANNEL, "message": get_message(pipeline.ts)})
+
+    assert get_queued(pipeline.queue_req_approval) == pipeline.ts
+
+
+def test_reactions_of_others_mark_messages_done(socket_server, pipeline):
+    item = {"type": "message", "channel": CHANNEL, "ts": pipeline.ts}
+    send(socket_server, pipeline, {"type": "reaction_added", "reaction": "eyes", "item": item})
+    send(socket_server, pipeline, {"type": "reaction_added", "reaction": "merged", "item": item})
+    terminal_index = pipeline.state_service.terminal_index
+    assert terminal_index.is_message_actionable("white_check_mark", CHANNEL, pipeline.ts)
+    assert not terminal_index.is_message_actionable("merged", CHANNEL, pipeline.ts)
+
+    send(socket_server, pipeline, {**get_message(pipeline.ts), "channel": CHANNEL})
+    assert get_queued(pipeline.queue_req_approval) == pipeline.ts
+    assert get_queued(pipeline.queue_req_merging) is None
+
+    # removing the reaction fetches the message and queues it again
+    send(socket_server, pipeline, {"type": "reaction_removed", "reaction": "merged", "item": item})
+    assert terminal_index.is_message_actionable("merged", CHANNEL, pipeline.ts)
+    assert get_queued(pipeline.queue_req_merging) == pipeline.ts
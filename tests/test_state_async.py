@@ -0,0 +1,102 @@
+from clients import GitHubClient, LocalCacheClient
+from processors import AsyncPullRequestStateService
+from utils import KeyedLock
+from threading import Event, Thread
+import asyncio
+
+CACHE_PATH = "repos/owner/repo/pulls/1/reviews"
+
+
+def get_state_service(tmp_path):
+    return AsyncPullRequestStateService(GitHubClient("token"), LocalCacheClient(str(tmp_path)))
+
+
+def test_threads_and_coroutines_share_in_flight_requests(tmp_path):
+    state_service = get_state_service(tmp_path)
+    started, release, fetches = Event(), Event(), []
+
+    def fetch(cache_path):
+        fetches.append(cache_path)
+        started.set()
+        release.wait(5)
+        return {"reviewers": {}}
+
+    async def fetch_async(cache_path):
+        fetches.append(cache_path)
+        return {}
+
+    thread = Thread(target=state_service.resolve, args=(CACHE_PATH, fetch))
+    thread.start()
+    assert started.wait(5)
+
+    async def resolve():
+        task = asyncio.create_task(state_service.resolve_async(CACHE_PATH, fetch_async))
+        await asyncio.sleep(0.05)
+        # the loop is not blocked by the threaded leader
+        assert not task.done()
+        release.set()
+        return await task
+
+    assert asyncio.run(resolve()) == {"reviewers": {}}
+    thread.join(5)
+    assert fetches == [CACHE_PATH]
+
+
+def test_async_path_lock_waits_without_blocking_the_loop():
+    path_locks = KeyedLock(reentrant=False)
+    acquired, release = Event(), Event()
+
+    def hold():
+        with path_locks(CACHE_PATH):
+            acquired.set()
+            release.wait(5)
+
+    thread = Thread(target=hold)
+    thread.start()
+    assert acquired.wait(5)
+
+    async def acquire():
+        order = []
+
+        async def locked():
+            async with path_locks.acquire_async(CACHE_PATH):
+                order.append("locked")
+
+        task = asyncio.create_task(locked())
+        await asyncio.sleep(0.05)
+        order.append("loop")
+        release.set()
+        await task
+        return order
+
+    assert asyncio.run(acquire()) == ["loop", "locked"]
+    thread.join(5)
+    assert not path_locks.locks
+
+
+def test_coroutines_do_not_reenter_path_locks():
+    path_locks = KeyedLock(reentrant=False)
+
+    async def hold(order, name):
+        async with path_locks.acquire_async(CACHE_PATH):
+            order.append(f"{name} in")
+            await asyncio.sleep(0.02)
+            order.append(f"{name} out")
+
+    async def run():
+        order = []
+        await asyncio.gather(hold(order, "a"), hold(order, "b"))
+        return order
+
+    assert asyncio.run(run()) == ["a in", "a out", "b in", "b out"]
+
+
+def test_async_deletes_are_serialized_with_fetches(tmp_path):
+    state_service = get_state_service(tmp_path)
+    state_service.local_client.save({"reviewers": {}}, CACHE_PATH)
+
+    async def run():
+        await state_service.delete_async(CACHE_PATH)
+        return await asyncio.to_thread(state_service.load, CACHE_PATH)
+
+    assert asyncio.run(run()) is None
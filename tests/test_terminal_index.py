@@ -0,0 +1,79 @@
+from clients import GitHubClient, LocalCacheClient
+from parsers import PullRequestDataParser, PullRequestRef
+from processors import PullRequestStateService
+from processors.state import TerminalStateIndex
+from .conftest import get_pull_request, get_review, update_pull_request
+import pytest
+
+
+@pytest.fixture
+def pull_request():
+    return PullRequestRef("owner", "repo", 1)
+
+
+def get_state_service(server, tmp_path, **kwargs):
+    return PullRequestStateService(GitHubClient("token", api_host=server.url),
+                                   LocalCacheClient(str(tmp_path)), **kwargs)
+
+
+def get_review_calls(server):
+    return sum(count for label, count in server.calls.items()
+               if label.startswith("pulls.reviews"))
+
+
+def test_approval_is_final_only_at_the_approved_head(github_server, tmp_path, pull_request):
+    data = get_pull_request(reviews=[get_review(1, "APPROVED", commit_id="a" * 40)])
+    server = github_server({"owner/repo/1": data})
+    state_service = get_state_service(server, tmp_path)
+
+    state_service.new_cycle()
+    assert PullRequestDataParser(state_service.get_reviews(pull_request)).get_reviews_approved()
+    state_service.get_details(pull_request)
+    state_service.new_cycle()
+    calls = get_review_calls(server)
+    assert PullRequestDataParser(state_service.get_reviews(pull_request)).get_reviews_approved()
+    assert get_review_calls(server) == calls
+
+    # a new push moves the head away from the approved commit
+    update_pull_request(data, head_sha="b" * 40)
+    state_service.new_cycle()
+    state_service.get_details(pull_request)
+    state_service.new_cycle()
+    state_service.get_reviews(pull_request)
+    assert get_review_calls(server) == calls + 1
+
+    update_pull_request(data, reviews=[get_review(1, "DISMISSED", commit_id="a" * 40)])
+    state_service.new_cycle()
+    assert not PullRequestDataParser(
+        state_service.get_reviews(pull_request)).get_reviews_approved()
+
+
+def test_closed_pull_requests_are_checked_again(github_server, tmp_path, pull_request):
+    data = get_pull_request("closed")
+    server = github_server({"owner/repo/1": data})
+    state_service = get_state_service(server, tmp_path, recheck_seconds=3600)
+
+    state_service.new_cycle()
+    assert PullRequestDataParser(state_service.get_details(pull_request)).get_details_closed()
+    assert state_service.is_closed(pull_request)
+
+    update_pull_request(data, state="open")
+    state_service.terminal_index.pull_requests[pull_request.api_route]["checked_at"] -= 3600
+    assert not state_service.is_closed(pull_request)
+    state_service.new_cycle()
+    assert not PullRequestDataParser(state_service.get_details(pull_request)).get_details_closed()
+    assert "details" not in state_service.terminal_index.get(pull_request.api_route)
+
+
+def test_skipped_messages_expire_and_reactions_stay(tmp_path):
+    terminal_index = TerminalStateIndex(LocalCacheClient(str(tmp_path)), recheck_seconds=3600)
+    terminal_index.mark_message("merged", "C1", "1.0")
+    terminal_index.mark_reacted("merged", "C1", "2.0")
+    assert not terminal_index.is_message_actionable("merged", "C1", "1.0")
+
+    terminal_index.skipped["merged/C1/1.0"][1] -= 3600
+    terminal_index.flush()
+    terminal_index = TerminalStateIndex(LocalCacheClient(str(tmp_path)), recheck_seconds=3600)
+
+    assert terminal_index.is_message_actionable("merged", "C1", "1.0")
+    assert not terminal_index.is_message_actionable("merged", "C1", "2.0")
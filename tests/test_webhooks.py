@@ -0,0 +1,54 @@
+from clients import GitHubClient, LocalCacheClient
+from processors import PullRequestStateService
+from main import GitHubWebhookHandler
+from argparse import Namespace
+from queue import Queue
+import pytest
+
+API_ROUTE = "repos/owner/repo/pulls/1"
+MESSAGE = {"channel": "C1", "ts": "1.000000", "text": "please review"}
+
+
+@pytest.fixture
+def handler(tmp_path):
+    config = Namespace(approved_reaction_name="white_check_mark",
+                       merged_reaction_name="merged")
+    state_service = PullRequestStateService(GitHubClient("token"),
+                                            LocalCacheClient(str(tmp_path)))
+    state_service.message_index.add(API_ROUTE, MESSAGE)
+    return GitHubWebhookHandler(config, Queue(), Queue(), state_service)
+
+
+def get_payload(action, **pull_request):
+    return {"action": action,
+            "repository": {"owner": {"login": "owner"}, "name": "repo"},
+            "pull_request": {"number": 1, **pull_request}}
+
+
+def test_approval_is_left_to_the_reviews_fetch(handler):
+    terminal_index = handler.state_service.terminal_index
+    handler.state_service.results[f"{API_ROUTE}/reviews"] = {}
+    handler("pull_request_review", {**get_payload("submitted"),
+                                    "review": {"state": "approved", "commit_id": "a" * 40}})
+
+    assert not terminal_index.get(API_ROUTE)
+    assert f"{API_ROUTE}/reviews" not in handler.state_service.results
+    assert handler.queue_req_approval.get_nowait() == MESSAGE
+    assert handler.queue_req_merging.empty()
+
+
+def test_closed_and_reopened_pull_requests(handler):
+    terminal_index = handler.state_service.terminal_index
+    handler("pull_request", get_payload("closed", merged=False))
+    assert terminal_index.get_closed(API_ROUTE)
+    assert handler.queue_req_approval.get_nowait() == MESSAGE
+    assert handler.queue_req_merging.get_nowait() == MESSAGE
+    terminal_index.mark(API_ROUTE, "reviews", "approved", "a" * 40)
+    terminal_index.mark_message("merged", "C1", MESSAGE["ts"])
+
+    handler("pull_request", get_payload("reopened"))
+    assert not terminal_index.get_closed(API_ROUTE)
+    assert "reviews" not in terminal_index.get(API_ROUTE)
+    assert terminal_index.is_message_actionable("merged", "C1", MESSAGE["ts"])
+    assert handler.queue_req_approval.get_nowait() == MESSAGE
+    assert handler.queue_req_merging.get_nowait() == MESSAGE
@@ -1,9 +1,15 @@
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timedelta
-from time import sleep
+from time import sleep, monotonic
+from threading import Lock, RLock
 from schedule import Scheduler
 from traceback import format_exc
+import asyncio
 import configargparse
 import logging
+import queue
+import socket
 
 
 class SafeScheduler(Scheduler):
@@ -34,6 +40,146 @@ class SafeScheduler(Scheduler):
                 self.cancel_job(job)
 
 
+class TokenBucket:
+    """ Token Bucket rate limiter class """
+
+    def __init__(self, rate: float, capacity: float):
+        # rate - tokens added per second, capacity - max burst size
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.timestamp = monotonic()
+        self.lock = Lock()
+
+    def _refill(self):
+        time_now = monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (time_now - self.timestamp) * self.rate)
+        self.timestamp = time_now
+
+    @property
+    def level(self):
+        with self.lock:
+            self._refill()
+            return max(self.tokens, 0) / self.capacity
+
+    def try_acquire(self, tokens: float = 1):
+        # returns 0 if tokens were taken, otherwise seconds until they could be
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1):
+        while time_wait := self.try_acquire(tokens):
+            sleep(time_wait)
+
+    async def acquire_async(self, tokens: float = 1):
+        while time_wait := self.try_acquire(tokens):
+            await asyncio.sleep(time_wait)
+
+    def drain(self, seconds: float = 0):
+        # no tokens are handed out until the given period elapses
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class FairQueue(queue.Queue):
+    """ Weighted Round-Robin Queue class """
+
+    def __init__(self, maxsize=0, key=None, weights: dict = None):
+        # key - function returning the sub-queue of an item, weights - items in a row per key
+        self.key = key if key else lambda item: None
+        self.weights = weights if weights else {}
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.queues = OrderedDict()
+        self.size = 0
+        self.served = 0
+
+    def _qsize(self):
+        return self.size
+
+    def _put(self, item):
+        key = self.key(item) if item is not None else None
+        self.queues.setdefault(key, deque()).append(item)
+        self.size += 1
+
+    def _get(self):
+        key, items = next(iter(self.queues.items()))
+        item = items.popleft()
+        self.size -= 1
+        self.served += 1
+        if not items:
+            del self.queues[key]
+            self.served = 0
+        elif self.served >= self.weights.get(key, 1):
+            self.queues.move_to_end(key)
+            self.served = 0
+        return item
+
+
+class KeyedLock:
+    """ Keyed Lock class """
+
+    def __init__(self, reentrant=True):
+        # key -> [lock, holders and waiters], entries go away with the last holder
+        self.locks = {}
+        self.lock = Lock()
+        # coroutines share their event loop thread, they need a lock a thread can't re-enter
+        self.lock_class = RLock if reentrant else Lock
+
+    def enter(self, key):
+        with self.lock:
+            entry = self.locks.setdefault(key, [self.lock_class(), 0])
+            entry[1] += 1
+        return entry
+
+    def leave(self, key, entry):
+        with self.lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[key]
+
+    @contextmanager
+    def __call__(self, key):
+        entry = self.enter(key)
+        try:
+            with entry[0]:
+                yield
+        finally:
+            self.leave(key, entry)
+
+    @asynccontextmanager
+    async def acquire_async(self, key, poll_seconds=0.01):
+        # polls instead of blocking the event loop while a thread holds the key
+        entry = self.enter(key)
+        try:
+            while not entry[0].acquire(blocking=False):
+                await asyncio.sleep(poll_seconds)
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            self.leave(key, entry)
+
+
+def get_channels(channel_ids: list):
+    # "<channel id>[:<weight>]" -> channel id -> weight
+    channels = OrderedDict()
+    for channel_id in channel_ids:
+        for value in channel_id.split(","):
+            channel, _, weight = value.strip().partition(":")
+            if channel:
+                channels[channel] = max(1, int(weight)) if weight else 1
+    return channels
+
+
 def get_arguments():
     parser = configargparse.ArgParser(default_config_files=["./config.yaml"])
 
@@ -48,9 +194,20 @@ def get_arguments():
                         type=str,
                         required=True,
                         env_var="SLACK_API_TOKEN")
+    parser.add_argument("--slack_app_token",
+                        action="store",
+                        type=str,
+                        required=False,
+                        env_var="SLACK_APP_TOKEN")
+    parser.add_argument("--slack_api_url",
+                        action="store",
+                        type=str,
+                        required=False,
+                        env_var="SLACK_API_URL")
     parser.add_argument("--slack_channel_id",
                         action="store",
                         type=str,
+                        nargs="+",
                         required=True,
                         env_var="CHANNEL_ID")
     parser.add_argument("--slack_time_window_minutes",
@@ -58,6 +215,38 @@ def get_arguments():
                         type=int,
                         required=False,
                         env_var="TIME_WINDOW_MINUTES")
+    parser.add_argument("--slack_incremental_sync",
+                        action="store_true",
+                        required=False,
+                        env_var="SLACK_INCREMENTAL_SYNC")
+    parser.add_argument("--slack_full_sync_minutes",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=60,
+                        env_var="SLACK_FULL_SYNC_MINUTES")
+    parser.add_argument("--slack_disable_thread_index",
+                        action="store_true",
+                        required=False,
+                        env_var="SLACK_DISABLE_THREAD_INDEX")
+    parser.add_argument("--slack_reply_workers",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=4,
+                        env_var="SLACK_REPLY_WORKERS")
+    parser.add_argument("--approval_workers",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=1,
+                        env_var="APPROVAL_WORKERS")
+    parser.add_argument("--merge_workers",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=1,
+                        env_var="MERGE_WORKERS")
     parser.add_argument("--approved_reaction_name",
                         action="store",
                         type=str,
@@ -75,23 +264,162 @@ def get_arguments():
                         type=str,
                         required=True,
                         env_var="GITHUB_API_TOKEN")
+    parser.add_argument("--github_api_url",
+                        action="store",
+                        type=str,
+                        required=False,
+                        env_var="GITHUB_API_URL")
+    parser.add_argument("--github_graphql_url",
+                        action="store",
+                        type=str,
+                        required=False,
+                        env_var="GITHUB_GRAPHQL_URL")
+    parser.add_argument("--github_quota_reserve",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=100,
+                        env_var="GITHUB_QUOTA_RESERVE")
+    parser.add_argument("--github_webhook_port",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=0,
+                        env_var="GITHUB_WEBHOOK_PORT")
+    parser.add_argument("--github_webhook_secret",
+                        action="store",
+                        type=str,
+                        required=False,
+                        env_var="GITHUB_WEBHOOK_SECRET")
+    parser.add_argument("--github_graphql_batch_size",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=0,
+                        env_var="GITHUB_GRAPHQL_BATCH_SIZE")
+    parser.add_argument("--github_reviews_last_page_first",
+                        action="store_true",
+                        required=False,
+                        env_var="GITHUB_REVIEWS_LAST_PAGE_FIRST")
     parser.add_argument("--cache_folder_path",
                         action="store",
                         type=str,
                         required=False,
                         default="./cache",
                         env_var="CACHE_FOLDER_PATH")
+    parser.add_argument("--cache_backend",
+                        action="store",
+                        type=str,
+                        required=False,
+                        choices=["file", "sqlite"],
+                        default="file",
+                        env_var="CACHE_BACKEND")
+    parser.add_argument("--cache_memory_max_entries",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=1024,
+                        env_var="CACHE_MEMORY_MAX_ENTRIES")
+    parser.add_argument("--cache_memory_max_bytes",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=16 * 1024 * 1024,
+                        env_var="CACHE_MEMORY_MAX_BYTES")
+    parser.add_argument("--cache_memory_ttl_seconds",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=3600,
+                        env_var="CACHE_MEMORY_TTL_SECONDS")
+    parser.add_argument("--cache_gc_minutes",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=10,
+                        env_var="CACHE_GC_MINUTES")
+    parser.add_argument("--cache_gc_batch_size",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=500,
+                        env_var="CACHE_GC_BATCH_SIZE")
+    parser.add_argument("--closed_recheck_minutes",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=60,
+                        env_var="CLOSED_RECHECK_MINUTES")
     parser.add_argument("--sleep_period_minutes",
                         action="store",
                         type=int,
                         required=True,
                         env_var="SLEEP_PERIOD_MINUTES")
+    parser.add_argument("--adaptive_polling",
+                        action="store_true",
+                        required=False,
+                        env_var="ADAPTIVE_POLLING")
+    parser.add_argument("--adaptive_polling_max_minutes",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=60,
+                        env_var="ADAPTIVE_POLLING_MAX_MINUTES")
+    parser.add_argument("--shard_backend",
+                        action="store",
+                        type=str,
+                        required=False,
+                        choices=["sqlite"],
+                        default="sqlite",
+                        env_var="SHARD_BACKEND")
+    parser.add_argument("--shard_lease_path",
+                        action="store",
+                        type=str,
+                        required=False,
+                        env_var="SHARD_LEASE_PATH")
+    parser.add_argument("--shard_member_id",
+                        action="store",
+                        type=str,
+                        required=False,
+                        default=socket.gethostname(),
+                        env_var="SHARD_MEMBER_ID")
+    parser.add_argument("--shard_lease_seconds",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=60,
+                        env_var="SHARD_LEASE_SECONDS")
+    parser.add_argument("--shard_heartbeat_seconds",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=15,
+                        env_var="SHARD_HEARTBEAT_SECONDS")
+    parser.add_argument("--engine",
+                        action="store",
+                        type=str,
+                        required=False,
+                        choices=["threads", "asyncio"],
+                        default="threads",
+                        env_var="ENGINE")
+    parser.add_argument("--async_concurrency",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=100,
+                        env_var="ASYNC_CONCURRENCY")
     parser.add_argument("--max_retries",
                         action="store",
                         type=int,
                         required=False,
                         default=5,
                         env_var="MAX_RETRIES")
+    parser.add_argument("--metrics_port",
+                        action="store",
+                        type=int,
+                        required=False,
+                        default=0,
+                        env_var="METRICS_PORT")
     parser.add_argument("--dry_run",
                         action="store_true",
                         required=False,